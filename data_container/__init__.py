@@ -1,6 +1,18 @@
 # import package modules
 from .dc_config import DcConfig
 config = DcConfig()
+from .dc_slice_cache import SliceCache
+slice_cache = SliceCache()
+from .dc_zstd_dict import ZstdDicts
+zstd_dicts = ZstdDicts()
+from .dc_timebase import Timebase
+from .dc_sketch import QuantileSketch
+from .dc_rollup import Rollup
+from .dc_series import ChunkedSeries
+from .dc_slice_store import SliceStore
+from .dc_writer import BackgroundWriter
+from .dc_pipeline import SlicePipeline
+from .dc_upload import UploadScheduler
 from .data_file import DataFile
 from .data_column import DataColumn
 from .data_slice import DataSlice
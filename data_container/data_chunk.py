@@ -131,19 +131,12 @@ class DataChunkCol(EmbeddedDocument):
     def x(self):
 
         try:
-            time_rec = []
-
-            if self._slices_time_rec:
-                for sl_info in self._slices_time_rec:
-                    sl = self.df.get_slice(sl_info['hash'])
-                    time_rec += sl.values[sl_info['i_start']:sl_info['i_end']]
+            return self._concatenate_slice_values(self._slices_time_rec, self.dtype_x_numpy)
 
         # Chunk not finalized and probably therefore end indices not existing
         except KeyError:
             self.logger.warning(f'ChunkCol.x {self.hash_long} indices probably not complete ({self._slices_y}). Chunk finalized: {self.chunk.finalized}. Returning empty val.')
-            time_rec = []
-
-        return np.asarray(time_rec, dtype=self.dtype_x_numpy)
+            return np.asarray([], dtype=self.dtype_x_numpy)
 
     @property
     def x_offset(self):
@@ -158,18 +151,24 @@ class DataChunkCol(EmbeddedDocument):
     def y(self):
 
         try:
-            y = []
-
-            if self._slices_y:
-                for sl_info in self._slices_y:
-                    sl = self.df.get_slice(sl_info['hash'])
-                    y += sl.values[sl_info['i_start']:sl_info['i_end']]
+            return self._concatenate_slice_values(self._slices_y, self.dtype_y_numpy)
 
         except KeyError:
             self.logger.warning(f'ChunkCol.y {self.hash_long} indices probably not complete ({self._slices_y}). Chunk finalized: {self.chunk.finalized}. Returning empty val.')
-            y = []
+            return np.asarray([], dtype=self.dtype_y_numpy)
+
+    def _concatenate_slice_values(self, slices_info, dtype):
+        # copy the values of the slices (i_start:i_end) into one preallocated array (see DataColumn.x)
+
+        slices = []
+        size = 0
+        for sl_info in slices_info or []:
+            sl = self.df.get_slice(sl_info['hash'])
+            index = slice(sl_info['i_start'], sl_info['i_end'])
+            slices.append((sl, index))
+            size += len(range(*index.indices(sl.values_count)))
 
-        return np.asarray(y, dtype=self.dtype_y_numpy)
+        return DcHelper.concatenate_arrays((np.asarray(sl.values)[index] for sl, index in slices), size, dtype)
 
     @property
     def slices_available(self):
@@ -594,8 +593,9 @@ class DataChunk(EmbeddedDocument):
         # binaries were appended
         if sl.binaries_appended:
             return sl.values_write_pointer
+        # without loading the values (e.g. the shared time_rec slices of combined columns for every member)
         else:
-            return len(sl.values)
+            return sl.values_count
 
     def build_instances(self):
 
@@ -693,7 +693,8 @@ class DataChunk(EmbeddedDocument):
         if config.data_types_dict[data_type]['box_plot'] or config.data_types_dict[data_type]['send_json']:
 
             if values_list:
-                values_list.sort()
+                # the list may contain numpy scalars (slices of sl.values) => float64 to avoid overflows in the sum
+                values_list = np.sort(np.asarray(values_list, dtype=np.float64))
                 length = len(values_list)
                 half = int(length / 2)
                 first_quarter = int(length / 4)
@@ -702,10 +703,10 @@ class DataChunk(EmbeddedDocument):
                 self.cols[data_type].median = round(float(values_list[half]), 2)
                 self.cols[data_type].upper_quartile = round(float(values_list[third_quarter]), 2)
                 self.cols[data_type].lower_quartile = round(float(values_list[first_quarter]), 2)
-                self.cols[data_type].min = round(float(min(values_list)), 2)
-                self.cols[data_type].max = round(float(max(values_list)), 2)
+                self.cols[data_type].min = round(float(values_list[0]), 2)
+                self.cols[data_type].max = round(float(values_list[-1]), 2)
                 self.cols[data_type].samples = length
-                self.cols[data_type].mean = round(float(sum(values_list) / length), 2)
+                self.cols[data_type].mean = round(float(values_list.sum() / length), 2)
 
             else:
                 self._set_empty_values(data_type)
@@ -814,8 +815,8 @@ class DataChunk(EmbeddedDocument):
 
                 start_slice_found = True
                 # find first time_rec value which is greater than or equal TIME_START (tolerance of 0 seconds)
-                # https://www.geeksforgeeks.org/python-get-the-index-of-first-element-greater-than-k/
-                index_time_rec_start = next(x for x, val in enumerate(sl_time_rec.values) if val >= self.time_start - 0)
+                # (O(segments) with the timebase of the slice, see DataSlice.timebase)
+                index_time_rec_start = sl_time_rec.timebase.first_index(self.time_start - 0)
 
                 sl_dict_time_rec['hash'] = sl_time_rec.hash
                 sl_dict_time_rec['i_start'] = index_time_rec_start
@@ -824,15 +825,12 @@ class DataChunk(EmbeddedDocument):
                 # end is in current slice
                 if self.time_end <= sl_last_time_value:
                     # find last time_rec value which is smaller than or equal TIME_END (tolerance of 0 seconds)
-                    bool_list = [x for x, val in enumerate(reversed(sl_time_rec.values[index_time_rec_start:])) if
-                                 val <= self.time_end - 0]
+                    index_time_rec_end = sl_time_rec.timebase.last_index(self.time_end - 0)
 
-                    # if this list is empty, this means that time_end is bigger than the highes value in the  previous
-                    # slice but in the current slice, the smalles value is smaller than this value.
+                    # if there is no such value after the start, this means that time_end is bigger than the highes
+                    # value in the  previous slice but in the current slice, the smalles value is smaller than this value.
                     # => the current slice can be skipped
-                    if bool_list:
-                        reversed_index_time_rec_end = next(iter(bool_list))
-                        index_time_rec_end = len(sl_time_rec.values) - reversed_index_time_rec_end
+                    if index_time_rec_end > index_time_rec_start:
                         sl_dict_time_rec['i_end'] = index_time_rec_end
                         time_rec_dict_list.append(sl_dict_time_rec)
 
@@ -858,10 +856,7 @@ class DataChunk(EmbeddedDocument):
                 # end is in current slice
                 if self.time_end <= sl_last_time_value:
                     # find last time_rec value which is smaller than or equal TIME_END (tolerance of 0 seconds)
-                    reversed_index_time_rec_end = next(
-                        x for x, val in enumerate(reversed(sl_time_rec.values[index_time_rec_start:])) if
-                        val <= self.time_end - 0)
-                    index_time_rec_end = len(sl_time_rec.values) - reversed_index_time_rec_end
+                    index_time_rec_end = sl_time_rec.timebase.last_index(self.time_end - 0)
                     sl_dict_time_rec['i_end'] = index_time_rec_end
 
                     # Start and end can be used, don't iterate through the rest...
@@ -5,12 +5,17 @@ from pathlib import Path
 import json
 import numpy as np
 
-from mongoengine import EmbeddedDocumentListField, EmbeddedDocument, StringField, FloatField, IntField
+from mongoengine import EmbeddedDocumentListField, EmbeddedDocument, StringField, FloatField, IntField, BooleanField
 import mongoengine
 
 # import package modules
 from .data_slice import DataSlice
 from .dc_helper import DcHelper, AttributesContainer, InstancesContainer
+from .dc_timebase import Timebase
+from .dc_sketch import QuantileSketch
+from .dc_rollup import Rollup
+from .dc_series import ChunkedSeries
+from .dc_slice_store import SliceListField, SliceStore
 from .odm import User, Project, Person, Receiver, Device, EventLog, Comment
 
 from . import config
@@ -43,9 +48,10 @@ class DataColumn(EmbeddedDocument):
     duration = FloatField(default=0, db_field='dur')
     transfer_rate_all = FloatField(db_field='tr_a', null=True)
 
-    # embedded docs: slices
-    _slices_y = EmbeddedDocumentListField('DataSlice', db_field='s_y')
-    _slices_time_rec = EmbeddedDocumentListField('DataSlice', db_field='s_tr')
+    # embedded docs: slices (stored by the SliceStore instead if slices_external)
+    slices_external = BooleanField(default=False, db_field='s_ext')
+    _slices_y = SliceListField('DataSlice', db_field='s_y')
+    _slices_time_rec = SliceListField('DataSlice', db_field='s_tr')
 
     # Todo: old todos:
     # ToDo: define a setter/getter in df -> global default for all dc
@@ -63,6 +69,10 @@ class DataColumn(EmbeddedDocument):
         # todo: mongo needed in database? how to handle this when reopening the file?
         self._current_time = 0
         self.logger = config.logger
+        # slices_external: the slices are not fetched from the SliceStore yet
+        self._slices_pending = False
+        # running counters of the full slices {slice_type: (slices, last slice, samples, bin_size)}, see _count_slices()
+        self._full_slices = {}
         # todo: mongodb what about here?
         # set attr from data_types_dict.json
         #for attr in config.data_types_dict[self.data_type]:
@@ -72,6 +82,40 @@ class DataColumn(EmbeddedDocument):
 
         self.df = df
 
+    def _fetch_slices(self):
+        # slices of slices_external columns are fetched with the first access of _slices_y / _slices_time_rec
+
+        self._slices_pending = False
+        slices = SliceStore(self.df).load(self)
+        self.logger.debug(f'{self.hash_long}: fetched {len(slices["y"])} + {len(slices["time_rec"])} slices')
+
+        # not a change of the column
+        self._data['_slices_y'] = slices['y']
+        self._data['_slices_time_rec'] = slices['time_rec']
+        for sl in slices['y'] + slices['time_rec']:
+            sl._init(df=self.df)
+
+    def to_mongo(self, use_db_field=True, fields=None):
+
+        # the slices of a df.to_json() are embedded (e.g. for the db sync)
+        embed_slices = self.df is not None and self.df._embed_slices
+        if self._slices_pending and embed_slices:
+            self._fetch_slices()
+
+        # saved by the SliceStore => the slices are not serialized at all
+        if self.slices_external and not embed_slices:
+            fields = [field for field in (fields or self._fields) if field.split('.')[0] not in ('_slices_y', '_slices_time_rec')]
+
+        return super(DataColumn, self).to_mongo(use_db_field, fields)
+
+    def _get_changed_fields(self):
+
+        changed_fields = super(DataColumn, self)._get_changed_fields()
+        if self.slices_external:
+            # saved by the SliceStore
+            changed_fields = [key for key in changed_fields if key.split('.')[0] not in ('s_y', 's_tr')]
+        return changed_fields
+
     # ~ def __str__(self):
 
         # ~ # ToDos: ideas: file size, device, person, ...
@@ -99,7 +143,7 @@ class DataColumn(EmbeddedDocument):
     @property
     def slices(self):
 
-        return len(self._slices_y + self._slices_time_rec)
+        return len(self._slices_y) + len(self._slices_time_rec)
 
     @property
     def all_slices(self):
@@ -108,27 +152,38 @@ class DataColumn(EmbeddedDocument):
     @property
     def samples(self):
 
-        samples = 0
-
-        # loop only slices_time_rec and take the bin_size to calc the amount of samples
-        for sl in self._slices_y:
-            #print(sl.bin_size)
-            samples += sl.samples
-
-        return samples
+        # only the y slices
+        return self._count_slices('y')[0]
 
     @property
     def bin_size(self):
 
-        size_bytes = 0
-        all_slices = self._slices_y + self._slices_time_rec
+        # slices of any kind
+        return self._count_slices('y')[1] + self._count_slices('time_rec')[1]
 
-        # loop all slices of any kind
-        for sl in all_slices:
-            #print(sl.bin_size)
-            size_bytes += sl.bin_size
+    def _count_slices(self, slice_type):
+        # (samples, bin_size) of the slices: full slices don't change anymore, so they are counted once (running
+        # counters of the leading full slices, continued with the slices appended since the last call). Only the
+        # slices which are not full yet (usually the last one) are counted every time.
+        # The counters are reset if the counted slices changed (e.g. slices deleted or the slice list replaced).
+
+        slices = self._slices_y if slice_type == 'y' else self._slices_time_rec
+        count, last, samples, bin_size = self._full_slices.get(slice_type, (0, None, 0, 0))
+        if count > len(slices) or (count and slices[count - 1] is not last):
+            count, last, samples, bin_size = 0, None, 0, 0
+
+        while count < len(slices) and slices[count].status_slice_full:
+            last = slices[count]
+            samples += last.samples
+            bin_size += last.bin_size
+            count += 1
+        self._full_slices[slice_type] = (count, last, samples, bin_size)
 
-        return size_bytes
+        for i in range(count, len(slices)):
+            samples += slices[i].samples
+            bin_size += slices[i].bin_size
+
+        return samples, bin_size
 
     @property
     def file_size(self):
@@ -216,31 +271,52 @@ class DataColumn(EmbeddedDocument):
     @property
     def x(self):
 
-        time_rec = []
+        # combined columns: the time_rec slices are read once for all members
+        if self.time_slices_ref is not None or self.data_type in self.df.combined_columns_flatten:
+            return np.array(self._shared_x())
 
-        if self.time_slices_ref is None:
+        return self._concatenate_slice_values(self._slices_time_rec, self._x_dtype)
 
-            for sl in self._slices_time_rec:
-                time_rec += sl.values
-        else:
+    def _shared_x(self):
+        # read-only x of the time_rec slices of this column or its time_slices_ref, cached in the df until the
+        # time_rec slices change (new slices or values)
+
+        time_col = self if self.time_slices_ref is None else self.df.cols[self.time_slices_ref]
+        key = (time_col.data_type, self._x_dtype)
+        state = tuple((sl._hash, sl.values_count) for sl in time_col._slices_time_rec)
+
+        cached = self.df._shared_x_cache.get(key)
+        if cached is not None and cached[0] == state:
+            return cached[1]
 
-            col = self.df.cols[self.time_slices_ref]
+        x = self._concatenate_slice_values(time_col._slices_time_rec, self._x_dtype)
+        x.flags.writeable = False
+        self.df._shared_x_cache[key] = (state, x)
 
-            for sl in col._slices_time_rec:
-                time_rec += sl.values
+        return x
+
+    @property
+    def _x_dtype(self):
 
         if config.operating_system == 'Windows' or config.numpy_size == 'maximize':
-            return np.asarray(time_rec, dtype='float64')
+            return 'float64'
         else:
-            return np.asarray(time_rec, dtype=self.dtype_time)
+            return self.dtype_time
+
+    @property
+    def timebase(self):
+        # time_rec of all slices as one Timebase (see DataSlice.timebase): O(segments) lookups without loading the values
+
+        col = self if self.time_slices_ref is None else self.df.cols[self.time_slices_ref]
+        return Timebase.concatenate([sl.timebase for sl in col._slices_time_rec], self.dtype_time)
 
     @property
     def y(self):
 
-        y = []
+        return self._concatenate_slice_values(self._slices_y, self._y_dtype)
 
-        for sl in self._slices_y:
-            y += sl.values
+    @property
+    def _y_dtype(self):
 
         if config.operating_system == 'Windows' or config.numpy_size == 'maximize':
             # this will return in all data types being 64 bit float, but it works on windows
@@ -252,8 +328,6 @@ class DataColumn(EmbeddedDocument):
             else:
                 dtype = 'float64'
 
-            return np.asarray(y, dtype=dtype)
-
         else:
             if self.dtype == 'uint24':
                 dtype = 'uint32'
@@ -262,29 +336,184 @@ class DataColumn(EmbeddedDocument):
             else:
                 dtype = self.dtype
 
-            return np.asarray(y, dtype=dtype)
+        return dtype
+
+    @staticmethod
+    def _concatenate_slice_values(slices, dtype):
+        # copy the values of the slices into one preallocated array (the total length is known from the slice metadata),
+        # without converting them to python lists or concatenating them
+
+        # a single read-only slice (e.g. memory mapped with df.mmap_slices) is returned without copying it
+        if len(slices) == 1:
+            values = np.asarray(slices[0].values)
+            if not values.flags.writeable and values.dtype == dtype:
+                return values
+
+        size = sum(sl.values_count for sl in slices)
+        return DcHelper.concatenate_arrays((sl.values for sl in slices), size, dtype)
+
+    def series(self, slice_type='y'):
+        # lazy ChunkedSeries of the y (or time_rec) values: only the slices which are accessed are read (see ChunkedSeries)
+
+        if slice_type == 'y':
+            return ChunkedSeries(self._slices_y, self._y_dtype)
+        elif slice_type == 'time_rec':
+            time_col = self if self.time_slices_ref is None else self.df.cols[self.time_slices_ref]
+            return ChunkedSeries(time_col._slices_time_rec, self._x_dtype)
+
+        self.logger.error(f'series {self.hash_long}: slice_type must be y or time_rec, not {slice_type}')
+        return None
 
     @property
-    def time_rec(self, start=None, end=None, duration=None):
+    def time_rec(self):
         # returns slices_time_rec
-        pass
+        return self.x
 
     @property
-    def x_min(self, start=None, end=None, duration=None):
+    def x_min(self):
         # returns time_rec in units min
-        pass
+        return self.x / 60
 
     @property
-    def x_hours(self, start=None, end=None, duration=None):
+    def x_hours(self):
         # returns time_rec in units hours
-        pass
+        return self.x / 3600
+
+    def window(self, start=None, end=None, duration=None):
+        # returns x, y (numpy arrays like self.x, self.y) of the samples with start <= time_rec <= end (seconds relative
+        # to df.date_time_start, None: no limit). Only the slices in the time window are read, e.g. 10 min of a 24 h
+        # ppg column are in one or two slices.
+
+        sample_start, sample_end = self.__slicing(start, end, duration)
+        time_col = self if self.time_slices_ref is None else self.df.cols[self.time_slices_ref]
+
+        x = self._read_samples(time_col._slices_time_rec, sample_start, sample_end, self._x_dtype)
+        y = self._read_samples(self._slices_y, sample_start, sample_end, self._y_dtype)
+
+        return x, y
+
+    def window_chunk(self, chunk, start=0, end=None):
+        # like window() with times relative to the start of the chunk (default: the whole chunk)
+
+        time_offset = chunk.time_offset or 0
+        if end is None and chunk.duration:
+            end = chunk.duration
+
+        return self.window(time_offset + start, None if end is None else time_offset + end)
+
+    def window_datetime(self, date_time_start, date_time_end=None):
+        # like window() with timezone aware datetimes
+
+        for date_time in (date_time_start, date_time_end):
+            if date_time is not None and (date_time.tzinfo is None or date_time.tzinfo.utcoffset(date_time) is None):
+                self.logger.warning(f'window_datetime {self.hash_long}: datetime objects must be timezone aware.')
+                return None
+
+        start = (date_time_start - self.df.date_time_start).total_seconds()
+        end = None if date_time_end is None else (date_time_end - self.df.date_time_start).total_seconds()
+
+        return self.window(start, end)
+
+    def rollup(self, level='1min', start=None, end=None):
+        # min/max/mean/count buckets of the column (level: '1s', '1min', '15min', see Rollup) which overlap
+        # start <= time_rec <= end (seconds relative to df.date_time_start, None: no limit). Returns a numpy structured
+        # array with the fields time (start of the bucket), count, min, max and mean.
+        # The rollups are brought up to date first (only the samples since the last update are read, under the lock of
+        # Rollup.update(), so concurrent readers in other processes don't count samples twice).
+
+        if level not in Rollup.LEVELS:
+            self.logger.error(f'rollup {self.hash_long}: unknown level {level} (available: {list(Rollup.LEVELS)})')
+            return None
+
+        rollup = Rollup(self)
+        rollup.update()
+
+        return rollup.read(level, start, end)
 
     def __slicing(self, start=None, end=None, duration=None):
         '''
         for all of the data returs (x, y, time_rec, ...) you could provide params: start, end, duration
         in this method it's handled and the needed slices gets selected and loaded to finally return the data
+
+        returns the sample indices (start, end) of the column. slice_time_offset and last_val of the time_rec slices are
+        the time index of the slices, only the edge slices are searched (binary search, see DataSlice.timebase)
         '''
-        pass
+
+        if duration is not None:
+            end = (start or 0) + duration
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+
+        time_col = self if self.time_slices_ref is None else self.df.cols[self.time_slices_ref]
+
+        sample_start = None
+        sample_end = 0
+        offset = 0
+
+        for sl in time_col._slices_time_rec:
+
+            samples = sl.values_count
+            if not samples:
+                continue
+
+            # last_val is set by write_bin() => values which are not written yet must be checked
+            if sl._values is not None and len(sl._values) > sl.values_write_pointer:
+                sl_time_end = sl._values[-1]
+            else:
+                sl_time_end = sl.last_val if sl.last_val is not None else np.inf
+            sl_time_start = sl.slice_time_offset if sl.slice_time_offset is not None else -np.inf
+
+            # slices before the window
+            if sl_time_end < start:
+                offset += samples
+                continue
+            # slices after the window
+            if sl_time_start > end:
+                break
+
+            # the whole slice is in the window (no need to read it)
+            if start <= sl_time_start and sl_time_end <= end:
+                i_start, i_end = 0, samples
+            else:
+                i_start = sl.timebase.first_index(start)
+                i_end = sl.timebase.last_index(end)
+
+            if i_end > i_start:
+                if sample_start is None:
+                    sample_start = offset + i_start
+                sample_end = offset + i_end
+
+            offset += samples
+
+        if sample_start is None:
+            return 0, 0
+
+        return sample_start, sample_end
+
+    @staticmethod
+    def _read_samples(slices, sample_start, sample_end, dtype):
+        # the samples sample_start:sample_end of the slices (only the slices with these samples are read)
+
+        arrays = []
+        offset = 0
+
+        for sl in slices:
+
+            if offset >= sample_end:
+                break
+
+            samples = sl.values_count
+            if offset + samples > sample_start:
+                i_start = max(sample_start - offset, 0)
+                i_end = min(sample_end - offset, samples)
+                arrays.append(np.asarray(sl.read_values(i_end)[i_start:i_end]))
+
+            offset += samples
+
+        if not arrays:
+            return np.asarray([], dtype=dtype)
+
+        return np.concatenate(arrays).astype(dtype, copy=False)
 
     def csv_export(self):
         # interpolation
@@ -322,6 +551,40 @@ class DataColumn(EmbeddedDocument):
                 self._initiate_new_slice('time_rec')
             self._slices_time_rec[-1].append(time_rec)
 
+    def append_values(self, values, time_rec):
+        # bulk version of append_value() (values and time_rec are numpy arrays of the same length, checked in the df)
+        # the slices are filled exactly like sample by sample with append_value(), but with one extend per slice
+
+        if 'int' in self.dtype:
+            values = np.rint(values)
+
+        self._extend_slices('y', values, time_rec)
+
+        # add time slices only if there is no time_slices reference (combined_columns)
+        if self.time_slices_ref is None:
+            self._extend_slices('time_rec', time_rec, time_rec)
+
+        self._current_time = float(time_rec[-1])
+
+    def _extend_slices(self, slice_type, values, time_rec):
+
+        slices = self._slices_y if slice_type == 'y' else self._slices_time_rec
+        dtype_size = self.dtype_size if slice_type == 'y' else self.dtype_time_size
+        # append_value() starts a new slice once bin_size >= slice_max_size
+        samples_per_slice = -(-self.df.slice_max_size // dtype_size)
+
+        pos = 0
+        while pos < len(values):
+            if not slices or slices[-1].samples >= samples_per_slice:
+                self._current_time = float(time_rec[pos])
+                self._initiate_new_slice(slice_type)
+            samples = min(samples_per_slice - slices[-1].samples, len(values) - pos)
+            slices[-1].extend(values[pos:pos + samples])
+            pos += samples
+            # like set_values(): full slices are counted once by samples / bin_size (see _count_slices())
+            if slices[-1].samples >= samples_per_slice:
+                slices[-1].check_and_set_status_slice_full()
+
     def append_binary(self, byte_values, time_rec):
 
         # set the current time to None then the times can be determined later in final_analyze
@@ -583,12 +846,13 @@ class DataColumn(EmbeddedDocument):
 
         return dump_dic
 
-    def final_analyse(self):
+    def final_analyse(self, analyse_slices=True):
+        # analyse_slices=False: only merge the statistics of the slices (analysed already, see DataFile.close())
 
         min_list = []
         max_list = []
-        values_list = []
-        mean_sum = 0
+        sketches = []
+        values_sum = 0
         samples_sum = 0
 
         self.logger.debug(f'final_analyse {self}')
@@ -597,39 +861,37 @@ class DataColumn(EmbeddedDocument):
 
             if config.data_types_dict[self.data_type]['box_plot']:
 
-                # except for acc this is probably only one slice
+                # merge the statistics of the slices (O(slices) instead of sorting all values of the recording)
                 for sl in self._slices_y:
 
-                    sl.final_analyse()
+                    if analyse_slices:
+                        sl.final_analyse()
 
-                    values_list.extend(sl.values)
-                    if sl.min:
+                    sketches.append(sl.quantile_sketch)
+                    if sl.min is not None:
                         min_list.append(sl.min)
-                    if sl.max:
+                    if sl.max is not None:
                         max_list.append(sl.max)
-                    if sl.mean:
-                        mean_sum += sl.mean*sl.samples_meta
+                    if sl.values_sum is not None:
+                        values_sum += sl.values_sum
+                    elif sl.mean is not None:
+                        values_sum += sl.mean*sl.samples_meta
                     samples_sum += sl.samples_meta
 
-                length = len(values_list)
-
-                if length != 0:
-                    values_list.sort()
-                    half = int(length / 2)
-                    first_quarter = int(length / 4)
-                    third_quarter = int(length * 3 / 4)
+                sketch = QuantileSketch.merge(sketches)
 
+                if sketch.count != 0:
                     # cast to normal Python int/float to avoid incompatibilities with mongoengine floatfileds...
-                    self.median = round(float(values_list[half]), 2)
-                    self.upper_quartile = round(float(values_list[third_quarter]), 2)
-                    self.lower_quartile = round(float(values_list[first_quarter]), 2)
+                    self.median = round(sketch.quantile(1 / 2), 2)
+                    self.upper_quartile = round(sketch.quantile(3 / 4), 2)
+                    self.lower_quartile = round(sketch.quantile(1 / 4), 2)
                     if min_list:
                         self.min = round(float(min(min_list)), 2)
                     if max_list:
                         self.max = round(float(max(max_list)), 2)
                     self.samples_meta = samples_sum
                     try:
-                        self.mean = round(float(mean_sum / samples_sum), 2)  # weighted average
+                        self.mean = round(float(values_sum / samples_sum), 2)
                     except ZeroDivisionError:
                         self.mean = None
                 else:
@@ -646,7 +908,8 @@ class DataColumn(EmbeddedDocument):
 
                 for sl in self._slices_y:
 
-                    sl.final_analyse()
+                    if analyse_slices:
+                        sl.final_analyse()
                     samples_sum += sl.samples_meta
 
                 self.samples_meta = samples_sum
@@ -661,9 +924,13 @@ class DataColumn(EmbeddedDocument):
 
             for sl in self._slices_time_rec:
 
-                sl.final_analyse()
+                if analyse_slices:
+                    sl.final_analyse()
                 samples_sum += sl.samples_meta
 
+        if config.rollup:
+            Rollup(self).update()
+
         # compressed size:
         self.compressed_size_meta = self.compressed_size
         self.compression_ratio_meta = self.compression_ratio
@@ -13,6 +13,8 @@ import numpy as np
 import pandas as pd
 import time
 import concurrent.futures
+import functools
+import contextlib
 import threading
 import psutil
 import traceback
@@ -25,11 +27,18 @@ from mongoengine.queryset import OperationError
 # import package modules
 from .data_chunk import DataChunk, ChunkTimeError, ChunkNoValuesError
 from .data_column import DataColumn
-from .document_tweak import DocumentTweak
+from .data_slice import DataSlice
+from .dc_journal import SliceJournal
+from .dc_slice_store import SliceStore, DataFileQuerySet
+from .dc_writer import BackgroundWriter, df_locked
+from .dc_pipeline import SlicePipeline
+from .dc_upload import UploadScheduler
+from .document_tweak import DocumentTweak, AppendListField
 from .dc_helper import DcHelper, InstancesContainer
 
 utc_to_local = DcHelper.utc_to_local
 from . import config
+from . import slice_cache
 
 
 class DataFile(DocumentTweak):
@@ -51,6 +60,9 @@ class DataFile(DocumentTweak):
     #  https://stackoverflow.com/questions/59699716/valueerror-cannot-override-primary-key-field
     # _hash_id = StringField(primary_key=True)
 
+    # deleting DataFiles deletes their slices in the SliceStore as well
+    meta = {'queryset_class': DataFileQuerySet}
+
     # relationships
     scope = ReferenceField('Scope')
     project = ReferenceField('Project', required=True)
@@ -91,9 +103,9 @@ class DataFile(DocumentTweak):
     # embedded docs: cols, chunks
     combined_columns = MapField(ListField(StringField(max_length=50)), db_field='coc')
     cols = MapField(EmbeddedDocumentField('DataColumn'))
-    chunks = EmbeddedDocumentListField('DataChunk')
-    chunks_labelled = EmbeddedDocumentListField('DataChunk', db_field='ch_l')
-    markers = EmbeddedDocumentListField('DataChunk', db_field='mrkr')
+    chunks = AppendListField('DataChunk')
+    chunks_labelled = AppendListField('DataChunk', db_field='ch_l')
+    markers = AppendListField('DataChunk', db_field='mrkr')
 
     # other
     comments = ListField(EmbeddedDocumentField('Comment'), db_field='com')
@@ -160,13 +172,30 @@ class DataFile(DocumentTweak):
         # then the sl._values are reset to free the memory. Systems with less memory are then less likely to crash.
         self.free_slices_when_finally_analysed = False
         self._continue_recording = False
-        # while _saving_db is true, writing to the database (df.write_appended_binaries and df.store())
-        # are not allowed. The intention is to avoid data being stored during the send process which might create a
-        # conflict in the database.
-        # todo: didn't proof useful for the intended problem... maybe remove this again...
-        self._saving_db = False
+        # changes of the df (store(), save_changes(), append_value(s), append_binary, write_appended_binaries) hold this
+        # lock, e.g. to avoid data being stored during the send process which might create a conflict in the database
+        self._lock = threading.RLock()
+        # asynchronous store() (see start_background_writer())
+        self._writer = None
+        # results of the last upload of the slices (see UploadScheduler)
+        self.upload_results = []
+        self.upload_report = None
         # avoid loading y slices (only used when appending binaries)
         self._avoid_lazy_load = False
+        # mmap_slices: If True, uncompressed .bin slices are lazy loaded as read-only np.memmap instead of reading them into memory.
+        # The OS page cache then decides which parts stay resident (useful on the server with many large DataFiles open at once).
+        self.mmap_slices = False
+        # group_commit: If True, the slice writes of one store() / write_appended_binaries() are fsynced once via a journal
+        # instead of one fsync per slice (less latency and SD card wear, see SliceJournal)
+        self.group_commit = False
+        self._journal = None
+        # time_rec of the combined columns (see DataColumn._shared_x()): {(time_slices_ref, dtype): (slice state, x)}
+        self._shared_x_cache = {}
+        # {slice hash: slice} of all slices of this df (see get_slice())
+        self._slice_index = {}
+        # slices_external columns: _ids of the slices in the SliceStore (saved or loaded), embed the slices in to_json()
+        self._slice_store_ids = set()
+        self._embed_slices = False
         self.server = None
         self.api_client = None
         self.c = None
@@ -174,13 +203,24 @@ class DataFile(DocumentTweak):
         # initiate slices after loading from database
         for data_type in self.cols:
 
-            self.cols[data_type]._init(df=self)
+            col = self.cols[data_type]
+            col._init(df=self)
+
+            # the slices are fetched from the SliceStore when they are needed
+            if col.slices_external and not col._data['_slices_y'] and not col._data['_slices_time_rec']:
+                col._slices_pending = True
+                continue
 
             for sl in self.cols[data_type]._slices_y:
                 sl._init(df=self)
             for sl in self.cols[data_type]._slices_time_rec:
                 sl._init(df=self)
 
+        # apply group commit writes which did not make it into the slice files (e.g. the device was unplugged), not if
+        # the df is still written by another instance (see SliceJournal)
+        if self._hash_id and self.path.exists():
+            SliceJournal(self).replay()
+
         # initiate data chunks
         for chunk in self.chunks:
             chunk._init(df=self)
@@ -288,33 +328,106 @@ class DataFile(DocumentTweak):
 
     def store(self, final_analyse=True):
 
-        if self._hash_id:
+        # background writer: request the store (returns the ticket for wait())
+        if self._writer is not None and not self._writer.active:
+            return self._writer.request(final_analyse)
+
+        # don't store while saving db to avoid db conflicts
+        with self._lock:
+            if self._hash_id:
+
+                # this must happen before save_changes() otherwise the new pointers will get lost
+                self._write_slices()
+                self.save_changes(final_analyse=final_analyse)
+
+            else:
+
+                self.save(final_analyse=final_analyse)
 
-            # don't store while saving db to avoid db conflicts
-            while self._saving_db:
-                self.logger.debug(f'{self.hash_id}: while loop in store: waiting for db save to finish')
-                time.sleep(0.1)
+                # todo: nicer way for this?
+                #  check if values need to be written
+                #  if yes => write and save_changes to avoid loss of pointers
 
-            # this must happen before save_changes() otherwise the new pointers will get lost
+                with self._group_commit():
+                    for data_type in self.cols:
+                        self.cols[data_type].write_bin()
+                if self.cols:
+                    self.save_changes(final_analyse=final_analyse)
+
+    def _write_slices(self):
+        # write the values and appended binaries of all columns to the slice files
+
+        with self._group_commit():
             for data_type in self.cols:
                 self.cols[data_type].write_bin()
                 # only write y since time_rec was just stored in the line above
                 self.cols[data_type].write_appended_binaries(skip_time=True)
 
-            self.save_changes(final_analyse=final_analyse)
+    def start_background_writer(self, max_pending=10000):
+        # store() in an own thread: appending never waits for the database (see BackgroundWriter)
 
-        else:
+        if self._writer is None:
+            self._writer = BackgroundWriter(self, max_pending=max_pending)
+            self._writer.start()
+            self.logger.debug(f'{self.hash_id}: background writer started')
 
-            self.save(final_analyse=final_analyse)
+        return self._writer
 
-            # todo: nicer way for this?
-            #  check if values need to be written
-            #  if yes => write and save_changes to avoid loss of pointers
+    def stop_background_writer(self, timeout=None):
+        # store everything and return to the synchronous store()
 
-            for data_type in self.cols:
-                self.cols[data_type].write_bin()
-            if self.cols:
-                self.save_changes(final_analyse=final_analyse)
+        if self._writer is None:
+            return True
+
+        # the writer is stopped even if a queued append failed (raised by wait())
+        writer = self._writer
+        ticket = writer.request(final_analyse=True)
+        try:
+            success = writer.wait(ticket, timeout)
+        finally:
+            writer.stop(timeout)
+            self._writer = None
+            self.logger.debug(f'{self.hash_id}: background writer stopped')
+
+        # queued appends which failed while the writer stopped
+        writer.check()
+        return success
+
+    def wait(self, ticket=None, timeout=None):
+        # wait until the store with ticket (returned by store(), None: the last one) is done. False on timeout or errors.
+        # Raises the exception of a queued append which failed (see BackgroundWriter)
+
+        if self._writer is None:
+            return True
+        return self._writer.wait(ticket, timeout)
+
+    def flush(self, final_analyse=True, timeout=None):
+        # durability point: everything appended so far is stored when flush() returns True (raises like wait())
+
+        if self._writer is None:
+            self.store(final_analyse=final_analyse)
+            return True
+        return self._writer.wait(self._writer.request(final_analyse), timeout)
+
+    @property
+    def journal(self):
+        return self._journal
+
+    @contextlib.contextmanager
+    def _group_commit(self):
+        # all slice writes in this block are fsynced once at the end (if self.group_commit, see SliceJournal)
+
+        if not self.group_commit or not self._hash_id:
+            yield
+            return
+
+        if self._journal is None:
+            self._journal = SliceJournal(self)
+        self._journal.begin()
+        try:
+            yield
+        finally:
+            self._journal.commit()
 
     def save(self, final_analyse=True, *args, **kwargs):
 
@@ -371,38 +484,55 @@ class DataFile(DocumentTweak):
 
     def save_changes(self, final_analyse=True, *args, **kwargs):
 
-        # this is not needed for example when only pointers change
-        if final_analyse:
-            self.final_analyse()
+        with self._lock:
 
-        # set time_m
-        self._time_m = datetime.now(timezone.utc)
-        self._status = 'stored'
+            # this is not needed for example when only pointers change
+            if final_analyse:
+                self.final_analyse()
 
-        self._saving_db = True
-        try:
+            # set time_m
+            self._time_m = datetime.now(timezone.utc)
+            self._status = 'stored'
 
             try:
-                super(DataFile, self).save(*args, **kwargs)
-            except OperationError:
-                self.logger.warning(f'save_changes OperationError: trying to remove keys...')
-                super(DataFile, self).save(remove_keys=True, *args, **kwargs)
-
-        except Exception as e:
-            # something goes wrong
-            self.logger.error(f'df.save_changes error: {e}')
-            self.logger.error(str(traceback.format_exc()))
-            df_json = self.to_json()
-            file_name = f'error_df_{datetime.now(tz=timezone.utc)}.json'
-            storage_path = str(config.df_path / str(self.hash_id) / file_name)
-            with open(storage_path, 'w') as fp:
-                fp.write(df_json)
-                fp.flush()
-                os.fsync(fp)
-
-            raise e
-
-        self._saving_db = False
+
+                # slices of slices_external columns first, the df document must not point to missing slices
+                SliceStore(self).save()
+
+                try:
+                    super(DataFile, self).save(*args, **kwargs)
+                except OperationError:
+                    self.logger.warning(f'save_changes OperationError: trying to remove keys...')
+                    super(DataFile, self).save(remove_keys=True, *args, **kwargs)
+
+            except Exception as e:
+                # something goes wrong
+                self.logger.error(f'df.save_changes error: {e}')
+                self.logger.error(str(traceback.format_exc()))
+                df_json = self.to_json()
+                file_name = f'error_df_{datetime.now(tz=timezone.utc)}.json'
+                storage_path = str(config.df_path / str(self.hash_id) / file_name)
+                with open(storage_path, 'w') as fp:
+                    fp.write(df_json)
+                    fp.flush()
+                    os.fsync(fp)
+
+                raise e
+
+    def delete(self, *args, **kwargs):
+        # the slices of slices_external columns are deleted by the DataFileQuerySet
+
+        super(DataFile, self).delete(*args, **kwargs)
+        self._slice_store_ids = set()
+
+    def to_json(self, *args, **kwargs):
+
+        # the json has the slices of slices_external columns as well (e.g. for the db sync)
+        self._embed_slices = True
+        try:
+            return super(DataFile, self).to_json(*args, **kwargs)
+        finally:
+            self._embed_slices = False
 
     def update_attributes(self):
 
@@ -511,16 +641,16 @@ class DataFile(DocumentTweak):
             # first should be checked if slice is combined. for that we check if there is a col.time_slices_ref
             if col.time_slices_ref:
                 for sl_x in self.cols[col.time_slices_ref]._slices_time_rec:
-                    samples_real_x += sl_x.samples
+                    samples_real_x += sl_x.samples_real
                     values_write_pointer += sl_x.values_write_pointer
             else:
                 for sl_x in self.cols[data_type]._slices_time_rec:
-                    samples_real_x += sl_x.samples
+                    samples_real_x += sl_x.samples_real
                     values_write_pointer += sl_x.values_write_pointer
             samples_real_x_total += samples_real_x
 
             for sl_y in self.cols[data_type]._slices_y:
-                samples_real_y += sl_y.samples
+                samples_real_y += sl_y.samples_real
                 values_write_pointer += sl_y.values_write_pointer
             samples_real_y_total += samples_real_y
             values_write_pointer_total += values_write_pointer
@@ -657,18 +787,19 @@ class DataFile(DocumentTweak):
 
             for sl in all_slices:
 
+                samples_real = sl.samples_real
                 values_write_pointer_total += sl.values_write_pointer
-                samples_total += sl.samples
+                samples_total += samples_real
 
                 try:
-                    percentage_upload = round((sl.samples / sl.values_write_pointer) * 100, 1)
+                    percentage_upload = round((samples_real / sl.values_write_pointer) * 100, 1)
                 except ZeroDivisionError:
                     percentage_upload = 0.0
 
-                if sl.values_send_pointer > sl.samples * DcHelper.helper_dtype_size(sl.dtype):
-                    self.logger.error(f'slice {sl._hash}: values_send_pointer {sl.values_send_pointer} > number of real sample bytes {sl.samples * DcHelper.helper_dtype_size(sl.dtype)}')
+                if sl.values_send_pointer > samples_real * DcHelper.helper_dtype_size(sl.dtype):
+                    self.logger.error(f'slice {sl._hash}: values_send_pointer {sl.values_send_pointer} > number of real sample bytes {samples_real * DcHelper.helper_dtype_size(sl.dtype)}')
 
-                samples_str = 'ok' if sl.samples == sl.samples_meta else str(sl.samples)
+                samples_str = 'ok' if samples_real == sl.samples_meta else str(samples_real)
 
                 slice_dic = {}
                 slice_dic['hash'] = sl._hash
@@ -1048,6 +1179,7 @@ class DataFile(DocumentTweak):
         return self._afe_config
 
     # ToDo: do we still need checksum?
+    @df_locked
     def append_value(self, data_type, value, time_rec):
 
         # todo: catch too high int/float? values
@@ -1130,6 +1262,127 @@ class DataFile(DocumentTweak):
 
             self.cols[data_type].append_value(value, time_rec)
 
+    @df_locked(prepare='_prepare_append_values')
+    def append_values(self, data_type, values, time_rec):
+        # Bulk version of append_value(): values and time_rec are arrays (lists, np.ndarrays) with one entry per sample.
+        # For combined columns values has the shape (samples, len(self.combined_columns[data_type])), i.e. one row per
+        # sample like the lists of append_value(). All checks are done for the whole batch before anything is appended,
+        # so an invalid batch never ends up half appended. Can be called repeatedly (live batches) and for bulk loads.
+
+        checked = self._check_values(data_type, values, time_rec)
+        if not isinstance(checked, tuple):
+            return checked
+        data_types, columns, values, time_rec = checked
+
+        if not self._hash_id:
+            self.save()
+
+        # all data must be part of a chunk
+        if not self.chunks or self.chunks[-1].finalized:
+            self.chunk_start()
+
+        for data_type_2, column in zip(data_types, columns):
+            if data_type_2 not in self.cols:
+                self._initiate_new_col(data_type_2)
+            self.cols[data_type_2].append_values(column, time_rec)
+
+    def _prepare_append_values(self, data_type, values, time_rec):
+        # checks of append_values() before the batch is queued by the BackgroundWriter (copies, the caller may reuse the arrays)
+
+        checked = self._check_values(data_type, values, time_rec)
+        if not isinstance(checked, tuple):
+            return checked
+        data_types, columns, values, time_rec = checked
+
+        return (data_type, np.array(values, copy=True), np.array(time_rec, copy=True)), {}
+
+    def _check_values(self, data_type, values, time_rec):
+        # checks of append_values(), returns (data_types, columns, values, time_rec) as arrays or the result of
+        # append_values() for invalid batches
+
+        if not self.date_time_start and self.live_data:
+            self._date_time_start = datetime.now(timezone.utc)
+        elif not self.date_time_start:
+            self.logger.warning('To start appending data you need to specify date_time_start first (Timezone aware e.g. datetime(2020, 5, 4, 10, 55, 59, 3, tzinfo=timezone.utc)).')
+            return False
+
+        if self.status_closed:
+            self.logger.warning('This datafile has already been closed. append_values() is not possible.')
+            return
+
+        if data_type not in self.combined_columns and data_type not in config.data_types_dict:
+            self.logger.error(f'The specified data_type {data_type} does not exist. Aborting append_values()')
+            return False
+
+        try:
+            values = np.asarray(values)
+            time_rec = np.asarray(time_rec, dtype=np.float64)
+        except (TypeError, ValueError) as e:
+            self.logger.error(f'Cannot convert the values or time_rec of {data_type} to arrays ({e}). Aborting append_values()')
+            return False
+
+        if time_rec.ndim != 1:
+            self.logger.error(f'time_rec has to be one-dimensional (shape {time_rec.shape}). Aborting append_values()')
+            return False
+
+        if len(values) != len(time_rec):
+            self.logger.error(f'Length of values ({len(values)}) is not the same as length of time_rec ({len(time_rec)}). Aborting append_values()')
+            return False
+
+        if not len(time_rec):
+            self.logger.debug(f'{self.hash_id} cannot append empty values')
+            return
+
+        # check unallowed negative numbers
+        if np.any(time_rec < 0):
+            self.logger.warning(f'it is not possible to append negative time_rec values! ({data_type}, {time_rec.min()})')
+            return False
+
+        # combined cols
+        if data_type in self.combined_columns:
+            data_types = self.combined_columns[data_type]
+            if values.ndim != 2 or values.shape[1] != len(data_types):
+                self.logger.error(f'Cannot append values to combined_column. The shape of values {values.shape} must be (samples, {len(data_types)}). Aborting append_values()')
+                return False
+            columns = [values[:, i] for i in range(len(data_types))]
+
+        # normal behavior
+        else:
+            if data_type in self.combined_columns_flatten:
+                self.logger.error('This data_type is part of a combined_column. Aborting append_values()')
+                return False
+            if values.ndim != 1:
+                self.logger.error(f'values has to be one-dimensional (shape {values.shape}). Aborting append_values()')
+                return False
+            data_types = [data_type]
+            columns = [values]
+
+        # check all values before adding to avoid uneven combined_cols
+        for data_type_2, column in zip(data_types, columns):
+            dtype = config.data_types_dict[data_type_2]['dtype']
+            if not np.issubdtype(column.dtype, np.number) or np.issubdtype(column.dtype, np.complexfloating):
+                self.logger.error(f'Cannot append non-numeric values ({column.dtype}) to {data_type_2}. Aborting append_values()')
+                return False
+            if 'uint' in dtype and np.any(column < 0):
+                self.logger.error(f'Appending negative {data_type_2} values (min {column.min()}) is not allowed for {dtype}. Aborting append_values()')
+                return False
+            if 'int' in dtype and not np.issubdtype(column.dtype, np.integer) and not np.all(np.isfinite(column)):
+                self.logger.error(f'Appending nan or inf to {data_type_2} is not allowed for {dtype}. Aborting append_values()')
+                return False
+            # the slices cast the values unsafe (300 -> 44 for uint8, 1e5 -> inf for float16), append_value() raises an OverflowError
+            low, high = DcHelper.helper_dtype_range(dtype)
+            if 'int' in dtype:
+                column_min, column_max = np.rint(column.min()), np.rint(column.max())
+            else:
+                finite = column[np.isfinite(column)]
+                column_min, column_max = (finite.min(), finite.max()) if len(finite) else (0, 0)
+            if float(column_min) < low or float(column_max) > high:
+                self.logger.error(f'{data_type_2} values out of range for {dtype} (min {column_min}, max {column_max}). Aborting append_values()')
+                return False
+
+        return data_types, columns, values, time_rec
+
+    @df_locked
     def append_binary(self, data_type, byte_list, time_rec, store_immediately=True, save_changes=True, final_analyse=False):
 
         # Hint: This method has less checks built in than the normal append_value() method to increase speed.
@@ -1159,11 +1412,6 @@ class DataFile(DocumentTweak):
             self.logger.warning('This datafile has already been closed. append_binary() is not possible.')
             return
 
-        # in case sending is in progress, we hold back the append_binary task
-        while self._saving_db:
-            self.logger.debug(f'{self.hash_id}: while loop in append_binary: waiting for db save to finish')
-            time.sleep(0.1)
-
         # all data must be part of a chunk
         if not self.chunks or self.chunks[-1].finalized:
             self.chunk_start()
@@ -1190,30 +1438,32 @@ class DataFile(DocumentTweak):
         if store_immediately:
             self.write_appended_binaries(data_type=data_type, save_changes=save_changes, final_analyse=final_analyse)
 
+    @df_locked
     def write_appended_binaries(self, data_type=None, save_changes=True, final_analyse=False):
         # store all appended binaries in the slices._values_bin
 
-        while self._saving_db:
-            self.logger.debug(f'{self.hash_id}: while loop in write_appended_binaries: waiting for db save to finish')
-            time.sleep(0.1)
-
         t0 = time.monotonic()
 
-        if data_type:
-            if data_type in self.combined_columns:
-                for data_type2 in self.combined_columns[data_type]:
-                    self.cols[data_type2].write_appended_binaries()
+        with self._group_commit():
+            if data_type:
+                if data_type in self.combined_columns:
+                    for data_type2 in self.combined_columns[data_type]:
+                        self.cols[data_type2].write_appended_binaries()
+                else:
+                    self.cols[data_type].write_appended_binaries()
+            # if no data_type provided, then iterate through all data_types
             else:
-                self.cols[data_type].write_appended_binaries()
-        # if no data_type provided, then iterate through all data_types
-        else:
-            for data_type in self.cols:
-                self.cols[data_type].write_appended_binaries()
+                for data_type in self.cols:
+                    self.cols[data_type].write_appended_binaries()
 
         t1 = time.monotonic()
 
         if save_changes:
-            self.save_changes(final_analyse=final_analyse)
+            if self._writer is not None:
+                # appending never waits for the database
+                self._writer.request(final_analyse)
+            else:
+                self.save_changes(final_analyse=final_analyse)
 
         t2 = time.monotonic()
 
@@ -1223,7 +1473,7 @@ class DataFile(DocumentTweak):
     def set_values(self, data_type, value_list, time_rec_list, store=True, compression=False,
                    finalize=True):
 
-        self.logger.warning('set_values() is not yet fully implemented and can therefore not be used at the moment. Please use append_value() instead. Have a nice day.')
+        self.logger.warning('set_values() is not yet fully implemented and can therefore not be used at the moment. Please use append_values() instead. Have a nice day.')
         return False
 
         # todo
@@ -1324,12 +1574,31 @@ class DataFile(DocumentTweak):
 
         self.combined_columns[identifier] = data_type_list
 
+    def combined_values(self, data_type):
+        # x, {data_type: y} of a combined column (identifier of self.combined_columns or a list/tuple of data_types).
+        # The time_rec slices are read once for all members (x is shared and read-only, see DataColumn._shared_x())
+
+        if type(data_type) is str and data_type in self.combined_columns:
+            data_types = self.combined_columns[data_type]
+        elif type(data_type) in [list, tuple] and data_type and all(dt in self.cols for dt in data_type):
+            data_types = data_type
+        else:
+            self.logger.error(f'combined_values: {data_type} is no combined column or list of data_types of {self.hash_id}')
+            return None, None
+
+        # like _export_csv_col(): the time of the last data_type
+        x = self.cols[data_types[-1]]._shared_x()
+        y = {dt: self.cols[dt].y for dt in data_types}
+
+        return x, y
+
     def _initiate_new_col(self, data_type, time_slices_ref=None):
 
         self.cols[data_type] = DataColumn()
         self.cols[data_type].data_type = data_type
         self.cols[data_type].dtype = config.data_types_dict[data_type]['dtype']
         self.cols[data_type].time_slices_ref = time_slices_ref
+        self.cols[data_type].slices_external = config.slice_collection
         self.cols[data_type].df = self
         self.update_attributes()
 
@@ -1342,34 +1611,95 @@ class DataFile(DocumentTweak):
     def close(self, send=False, num_workers=3):
         # Call this to finish the File (eg. at the end of the day)
         # After that, it is not possible to append any more values
+        #
+        # The slices go through a pipeline (see SlicePipeline): compress -> final_analyse -> upload (send=True), each
+        # slice moves on as soon as it is ready. The df document is stored once at the end.
 
         t = time.monotonic()
 
-        # save binaries first to get the pointers right...
-        self.logger.debug(f'close: storing df {self.hash_id}, no final annalyse yet...')
+        # the rest of close() stores synchronously
+        self.stop_background_writer()
 
-        self.store(final_analyse=False)
+        with self._lock:
 
-        # todo: allow close again => change date?
-        if not self.status_closed:
-            self.status_closed = True
+            if not self._hash_id:
+                self.save(final_analyse=False)
+
+            # for compression, the binarys need to be stored on the harddrive already
+            self.logger.debug(f'close: writing the slices of df {self.hash_id}...')
+            self._write_slices()
+
+            # todo: allow close again => change date?
+            if not self.status_closed:
+                self.status_closed = True
+
+            self._check_all_chunks()
 
-        self._check_all_chunks()
+            # slice files are rewritten => fsync the slice files of the group commit first
+            if self._journal is not None:
+                self._journal.checkpoint()
 
-        # for compression, the binarys need to be stored on the harddrive already
-        self.logger.debug(f'close: compressing df {self.hash_id}...')
-        self.compress()
+            # compress must happen before final_analyse, otherwise the compressed file sizes are wrong.
+            # Only the file access + compression (and the upload) run in the pools, the slices are changed by this thread
+            stages = [('compress', self._compress_slice, lambda sl, result: sl._compress_apply(result) if result is not None else None, config.compress_workers),
+                      ('analyse', None, lambda sl, result: sl.final_analyse(), 1)]
 
-        # store + Final analyse (compress must happen before, otherwise the compressed file sizes are wrong
-        self.logger.debug(f'close: storing df {self.hash_id}...')
-        self.store()
+            upload = send and self.api_client and not self.date_time_upload and config.producer_hash == self.producer_hash
+            if upload:
+                # the slice in the upload stage is not touched by this thread (see SlicePipeline)
+                scheduler = UploadScheduler(self, num_workers=num_workers)
+                stages.append(('upload', lambda sl: functools.partial(scheduler.upload, sl), None, num_workers))
+
+            # vitals first (see UploadScheduler.priority()), the values of the slices in the pipeline are not freed
+            self.logger.debug(f'close: {", ".join(name for name, prepare, apply, workers in stages)} of df {self.hash_id}...')
+            SlicePipeline(stages).run(sorted(self.all_slices(), key=UploadScheduler.priority), slice_cache.pin, slice_cache.unpin)
+            self._status = 'compressed'
+
+            if upload:
+                scheduler.close()
+                self.upload_results = scheduler.results
+                self.upload_report = scheduler.report()
+                self.logger.debug(f'close: upload {self.hash_id}: {self.upload_report}')
+
+            if upload and self.check_all_slices_sent():
+                self.date_time_upload = datetime.now(timezone.utc)
+                self.logger.debug(f'all slices from {self} sent.')
+
+            # merge the statistics of the slices (analysed already) + store
+            self.logger.debug(f'close: storing df {self.hash_id}...')
+            self.final_analyse(analyse_slices=False)
+            self.save_changes(final_analyse=False)
+
+            # nothing is appended anymore => fsync all slice files and empty the journal
+            if self._journal is not None:
+                self._journal.close()
+
+        if upload:
+            meta_sent_status = self.send_meta()
+            if self.date_time_upload and not meta_sent_status:
+                # if the file is closed but the meta has not arrived, try another 5 times to send the meta file
+                for i in range(5):
+                    meta_sent_status = self.send_meta()
+                    if meta_sent_status:
+                        break
+                    time.sleep(0.5)
+            if not meta_sent_status:
+                self.logger.warning('send to server not successfully, last meta file not sent.!')
 
-        if send:
+        elif send:
             self.logger.debug(f'close: sending df {self.hash_id}...')
             self.send(num_workers=num_workers)
 
         self.logger.info('df {} closed in {} sec'.format(self._hash_id, round(time.monotonic() - t, 1)))
 
+    def _compress_slice(self, sl, algorithm='zstd', level=2):
+        # compress stage of close(): like sl.compress() but the journal is checkpointed once for all slices.
+        # Returns the file work for the pool (see SlicePipeline) or None
+
+        if sl._compress_prepare(algorithm, level) is not True:
+            return None
+        return functools.partial(DataSlice._compress_file, sl._path, algorithm, level, **sl._compress_args(algorithm))
+
     def _check_all_chunks(self):
         # finalize all chunks that were not correctly finalized (should not happen actually but just make sure)
         # This should only happen once when df.close()
@@ -1436,6 +1766,36 @@ class DataFile(DocumentTweak):
 
         return True
 
+    def verify(self):
+        # Expensive recount of the aggregates (samples, bin_size, compressed_size, ...), which are computed from the
+        # metadata of the slices (write pointers, *_meta) otherwise: every slice file is read. Returns a list of the
+        # slices whose real number of samples differs from the metadata (empty list: consistent).
+
+        t = time.monotonic()
+        inconsistent_slices = []
+
+        for data_type in self.cols:
+            for sl in self.cols[data_type].all_slices:
+
+                # file sizes are determined again
+                sl._file_changed()
+
+                samples = sl.samples
+                samples_real = sl.samples_real
+                if samples != samples_real:
+                    inconsistent_slices.append({
+                        'hash_long': sl.hash_long,
+                        'samples': samples,
+                        'samples_real': samples_real,
+                        'values_write_pointer': sl.values_write_pointer,
+                        'file_exists': sl.file_exists,
+                    })
+                    self.logger.warning(f'verify {self.hash_id}: slice {sl.hash_long} has {samples_real} samples, metadata: {samples}')
+
+        self.logger.info(f'verify {self.hash_id}: {len(inconsistent_slices)} inconsistent slices, in {round(time.monotonic() - t, 1)} sec')
+
+        return inconsistent_slices
+
     def find_missing_slices(self):
         # check if all slices are on the harddrive
 
@@ -1465,7 +1825,8 @@ class DataFile(DocumentTweak):
 
         return missing_slices_list
 
-    def final_analyse(self):
+    def final_analyse(self, analyse_slices=True):
+        # analyse_slices=False: the slices are analysed already (see close())
 
         t = time.monotonic()
 
@@ -1473,7 +1834,7 @@ class DataFile(DocumentTweak):
 
         for data_type in self.cols:
 
-            self.cols[data_type].final_analyse()
+            self.cols[data_type].final_analyse(analyse_slices)
             current_duration = self.cols[data_type].duration
             # filter out None
             if current_duration:
@@ -1501,7 +1862,10 @@ class DataFile(DocumentTweak):
 
         self.logger.debug('df {} final_analyse() in {} sec'.format(self._hash_id, round(time.monotonic() - t, 1)))
 
-    def compress(self, algorithm='zstd', level=2):
+    def compress(self, algorithm='zstd', level=2, num_workers=None):
+        # num_workers: number of threads compressing slices in parallel (default: config.compress_workers).
+        #   zstd / zlib release the GIL, so the slices are really compressed in parallel. The slice attributes (_path,
+        #   status_compressed, compressed_size_meta, ...) are only set by this thread (see DataSlice.compress()).
 
         t = time.monotonic()
 
@@ -1509,10 +1873,25 @@ class DataFile(DocumentTweak):
         if self._hash_id:
 
             self.logger.debug(f'compressing: {self}')
+
+            if num_workers is None:
+                num_workers = config.compress_workers
+
+            # slice files are rewritten => fsync the slice files of the group commit first
+            if self._journal is not None:
+                self._journal.checkpoint()
+
             # compress binary slices
-            for data_type in self.cols:
-                col = self.cols[data_type]
-                col.compress(algorithm=algorithm, level=level)
+            slices = [sl for sl in self.all_slices() if sl._compress_prepare(algorithm, level) is True]
+
+            if num_workers > 1 and len(slices) > 1:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+                    futures = {executor.submit(DataSlice._compress_file, sl._path, algorithm, level, **sl._compress_args(algorithm)): sl for sl in slices}
+                    for future in concurrent.futures.as_completed(futures):
+                        futures[future]._compress_apply(future.result())
+            else:
+                for sl in slices:
+                    sl._compress_apply(DataSlice._compress_file(sl._path, algorithm, level, **sl._compress_args(algorithm)))
 
             self._status = 'compressed'
 
@@ -1724,12 +2103,10 @@ class DataFile(DocumentTweak):
                 elif config.data_types_dict[data_type]['send_json']:
                     cols_to_send_list.append(col)
 
-            # send cols with threads, amount of worker defined with num_workers
-            thread_local = threading.local()
-            thread_local.session = requests.Session()
-            with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-                for col in cols_to_send_list:
-                    executor.submit(col.send, thread_local.session, partially)
+            # send the slices with num_workers threads (vitals first, see UploadScheduler)
+            scheduler = UploadScheduler(self, num_workers=num_workers, partially=partially)
+            self.upload_results = scheduler.run([sl for col in cols_to_send_list for sl in col._slices_y + col._slices_time_rec])
+            self.upload_report = scheduler.report()
 
             # send() may change the _meta of the slices. If this does not get stored, next time the file is opened,
             # this information would get lost and thus not reach the server
@@ -1928,29 +2305,42 @@ class DataFile(DocumentTweak):
 
     def get_slice(self, ds_hash):
 
-        for data_type in self.cols:
-            col = self.cols[data_type]
+        sl = self._slice_index.get(ds_hash)
+        if sl is not None:
+            return sl
 
-            # todo: are embeded listfields by standard empty lists?
-            if col._slices_y:
-                y_slices = col._slices_y
-            else:
-                y_slices = []
-            if col._slices_time_rec:
-                time_rec_slices = col._slices_time_rec
-            else:
-                time_rec_slices = []
+        # slice of a slices_external column which was not fetched yet
+        if any(col._slices_pending for col in self.cols.values()):
+            data_type = SliceStore(self).data_type(ds_hash)
+            if data_type in self.cols and self.cols[data_type]._slices_pending:
+                self.cols[data_type]._fetch_slices()
+                if ds_hash in self._slice_index:
+                    return self._slice_index[ds_hash]
 
-            all_slices = y_slices + time_rec_slices
-
-            for sl in all_slices:
+        # slices which were not registered (should not happen, see _register_slice())
+        for data_type in self.cols:
+            for sl in self.cols[data_type].all_slices:
                 if ds_hash == sl.hash:
+                    self._register_slice(sl)
                     return sl
 
         # not found...
         self.logger.warning('slice ' + ds_hash + ' not found')
         return None
 
+    def _register_slice(self, sl):
+        # called by sl._init() for new and loaded slices
+
+        self._slice_index[sl.hash] = sl
+
+    def slice_hash_exists(self, ds_hash):
+
+        if ds_hash in self._slice_index:
+            return True
+        if any(col._slices_pending for col in self.cols.values()):
+            return SliceStore(self).data_type(ds_hash) is not None
+        return False
+
     def get_slice_list(self):
         # return a list of all slice hashes of this datafile
         slice_list = []
@@ -2256,7 +2646,7 @@ class DataFile(DocumentTweak):
                 if sl._values:
                     freed_slices += 1
                     freed_samples += len(sl._values)
-                sl._values = None
+                sl.free_values()
             else:
                 loaded_slices += 1
                 if sl._values:
@@ -2271,6 +2661,7 @@ class DataFile(DocumentTweak):
 
         self.logger.debug(f'free_memory() for df {self.hash_id}: freed slices {freed_slices}, freed samples {freed_samples}, freed memory: {memory_freed} MB')
         self.logger.debug(f'free_memory() for df {self.hash_id}: loaded slices {loaded_slices}, loaded samples {loaded_samples}, current memory {memory_usage_after} MB')
+        self.logger.debug(f'free_memory(): {slice_cache}')
 
     # def from_json(self, *args, **kwargs):
     #     super(DataFile, self).from_json(*args, **kwargs)
@@ -2393,11 +2784,9 @@ class DataFile(DocumentTweak):
         if type(data_type) is str:
             # 'acc_x_y_z'
             if data_type in self.combined_columns:
-                data = {}
                 data_type_str = '_' + '_'.join(self.combined_columns[data_type])
-                for dt in self.combined_columns[data_type]:
-                    data[dt] = self.cols[dt].y
-                data['time'] = self.cols[dt].x
+                x, data = self.combined_values(data_type)
+                data['time'] = x
             # 'heart_rate'
             else:
                 data = {
@@ -2407,11 +2796,9 @@ class DataFile(DocumentTweak):
                 data_type_str = f'_{data_type}'
         # ['acc_x', 'acc_y']
         elif type(data_type) in [list, tuple]:
-            data = {}
             data_type_str = '_' + '_'.join(data_type)
-            for dt in data_type:
-                data[dt] = self.cols[dt].y
-            data['time'] = self.cols[dt].x
+            x, data = self.combined_values(data_type)
+            data['time'] = x
         else:
             self.logger.error(f'_export_csv data_type not valid: {data_type}')
 
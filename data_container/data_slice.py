@@ -13,10 +13,14 @@ import mongoengine
 
 # import package modules
 # ToDo: change anywhere import to: import .dc_helper and then use it like that: dc_helper.producer_hash
-from .dc_helper import DcHelper, AttributesContainer
+from .dc_helper import DcHelper, AttributesContainer, ValuesBuffer
+from .dc_timebase import Timebase
+from .dc_sketch import QuantileSketch
 from .odm import User, Project, Person, Receiver, Device, EventLog, Comment
 
 from . import config
+from . import slice_cache
+from . import zstd_dicts
 
 class DataSlice(EmbeddedDocument):
 
@@ -45,11 +49,20 @@ class DataSlice(EmbeddedDocument):
     max = FloatField(db_field='max', null=True)
     mean = FloatField(db_field='avg', null=True)
     last_val = FloatField(db_field='lst', null=True)
+    values_sum = FloatField(db_field='sum', null=True)
+    # QuantileSketch of the y values of box plot data types (see quantile_sketch), no weights: exact, one weight: all
+    # points have this weight
+    sketch_values = ListField(FloatField(), db_field='qsv')
+    sketch_weights = ListField(FloatField(), db_field='qsw')
     data_gaps = ListField(db_field='dgps')
     samples_meta = IntField(default=0, db_field='s')
     compressed_size_meta = IntField(default=0, db_field='cs')
     compression_ratio_meta = IntField(default=0, db_field='cr')
     bin_size_meta = IntField(default=0, db_field='bsz')
+    # trained zstd dictionary the slice is compressed with (see ZstdDicts), 0: no dictionary
+    compression_dict_id = IntField(default=0, db_field='cdi')
+    # lossless pre-transform of the compressed data (see DcHelper.precode()), None: no precoding
+    precoding = StringField(db_field='pc', null=True)
     values_write_pointer = IntField(default=0, db_field='vwp')
     values_analyse_pointer = IntField(default=0, db_field='vap')
     values_send_pointer = IntField(default=0, db_field='vsp')
@@ -66,6 +79,12 @@ class DataSlice(EmbeddedDocument):
         # self._values_bin is a buffer for appending binaries. Then it turns into a bytearray as soon as binaries are appended.
         # It is important to always distinguish between _values_bin==None and _values_bin beeing an empty bytearray!!
         self._values_bin = None
+        # key of this slice in the slice_cache (None: values not managed by the cache)
+        self._cache_key = None
+        # Timebase of time_rec slices (see timebase)
+        self._timebase = None
+        # size of the slice file (see compressed_size)
+        self._compressed_size = None
 
     def _init(self, df):
         self.df = df
@@ -73,19 +92,19 @@ class DataSlice(EmbeddedDocument):
         # check hash
         if not self._hash:
 
-            slice_list = self.df.get_slice_list()
-
             while True:
 
                 hash_gen = config.generate_hash(3)
 
                 # break if it's not a duplicate hash
-                if not hash_gen in slice_list:
+                if not self.df.slice_hash_exists(hash_gen):
                     break
 
             self.logger.debug('new DataSlice ' + self.df.hash_id + '/' + self.data_type + '.' + hash_gen + '.' + self.slice_type)
             self._hash = hash_gen
 
+        self.df._register_slice(self)
+
         df_path = config.df_path / Path(self.df.hash_id)
         if os.path.isfile(df_path / Path(self._hash + '.bin.zst')):
             self._path = df_path / Path(self._hash + '.bin.zst')
@@ -134,17 +153,34 @@ class DataSlice(EmbeddedDocument):
 
     @property
     def samples(self):
+        # from the metadata only => never causes a lazy_load (see samples_real for counting the values)
 
         if (self.df.live_data or self.df.date_time_upload) and self.status_finally_analzyed:
-            # do this to avoid unnecessary loads
             return self.samples_meta
+        # only if binaries were appended
+        elif self.binaries_appended:
+            return self.values_write_pointer
+        # normal case: len(self.values) if they are loaded, otherwise the written values
         else:
-            # only if binaries were appended (to avoid lazy_loads)
-            if self.binaries_appended:
-                return self.values_write_pointer
-            # normal case
-            else:
-                return len(self.values)
+            return self.values_count
+
+    @property
+    def samples_real(self):
+        # counts the values (+ not yet written values): reads the whole slice file if the values are not loaded
+        # (without keeping them in memory, see df.verify())
+
+        if self.binaries_appended:
+            return self.values_write_pointer
+        elif self._values is not None:
+            return len(self._values)
+        return len(self.read_values())
+
+    @property
+    def values_count(self):
+        # number of values without loading them (len(self.values) if they are loaded, otherwise the written values)
+        if self._values is not None:
+            return len(self._values)
+        return self.values_write_pointer
 
     @property
     def bin_size(self):
@@ -158,11 +194,17 @@ class DataSlice(EmbeddedDocument):
 
     @property
     def compressed_size(self):
+        # the file size is cached until the file is written again (_file_changed())
 
-        try:
-            return os.path.getsize(self._path)
-        except FileNotFoundError:
-            return self.bin_size
+        if self._compressed_size is None:
+            try:
+                self._compressed_size = os.path.getsize(self._path)
+            except FileNotFoundError:
+                return self.bin_size
+        return self._compressed_size
+
+    def _file_changed(self):
+        self._compressed_size = None
 
     @property
     def file_compressed_size(self):
@@ -179,6 +221,23 @@ class DataSlice(EmbeddedDocument):
     def dtype_size(self):
         return DcHelper.helper_dtype_size(self.dtype)
 
+    @property
+    def byteorder(self):
+        # byte order of the samples in the slice file (EEG data comes as MSB data)
+        if self.data_type and self.data_type.startswith('eeg') and self.slice_type == 'y':
+            return 'big'
+        return 'little'
+
+    @property
+    def compression_algorithm(self):
+        # derived from the file extension (None for uncompressed .bin files)
+        if str(self._path).endswith('.zst'):
+            return 'zstd'
+        elif str(self._path).endswith('.gz'):
+            return 'gzip'
+        else:
+            return None
+
     @property
     def binaries_appended(self):
         # check whether binaries have been appended to this slice during runtime
@@ -190,38 +249,62 @@ class DataSlice(EmbeddedDocument):
     def _initiate_values(self):
 
         # slice is empty or the datafile is loaded again
-        if self._values == None:
+        if self._values is None:
 
             # load binary files...
             if self.values_write_pointer > 0:
-                # todo: list? numpy arrays?? => currently conversion to list probably bad performance ... but numpy array does not support .append() method
                 # todo: sometimes (ppg uint24) values is None if file was not found. how can np.asarray([], dtype='uint32') be None?
                 #  https://stackoverflow.com/questions/54186190/why-does-numpy-ndarray-allow-for-a-none-array
                 values = self.lazy_load()
                 if values is not None:
-                    # cast to python list with python values since mongoengine and some other functions might not work with numpy datatypes
-                    self._values = values.tolist()
+                    # keep the loaded numpy array (no copy); single values are returned as python int/float by the buffer
+                    # since mongoengine and some other functions might not work with numpy datatypes
+                    self._values = ValuesBuffer.from_array(values)
                 else:
-                    self._values = []
-                    self.logger.warning(f'could not properly lazy_load() _values of slice {self.hash_long}. Returning empty list []')
+                    self._values = ValuesBuffer(self.dtype)
+                    self.logger.warning(f'could not properly lazy_load() _values of slice {self.hash_long}. Returning empty values')
             # there are no values yet ...
             else:
-                self._values = []
+                self._values = ValuesBuffer(self.dtype)
+
+            slice_cache.add(self)
+
+        else:
+            slice_cache.touch(self)
+
+    def free_values(self):
+        # free the memory of the values (they are lazy loaded again when accessing sl.values)
+
+        self._values = None
+        slice_cache.remove(self)
+        self._drop_shared_x()
+
+    def _drop_shared_x(self):
+        # the x of combined columns cached in the df (see DataColumn._shared_x()) is freed with its time_rec slices
+
+        shared_x_cache = getattr(self.df, '_shared_x_cache', None)
+        if self.slice_type == 'time_rec' and shared_x_cache:
+            for key in [key for key in shared_x_cache if key[0] == self.data_type]:
+                shared_x_cache.pop(key, None)
 
     def append(self, value):
 
         self._initiate_values()
         self._values.append(value)
+        self._timebase = None
 
     def extend(self, value):
 
         self._initiate_values()
         self._values.extend(value)
+        self._timebase = None
 
     def values_write_bin(self, value_list, store=True, compression=False):
 
         self.values_write_pointer = 0
-        self._values = value_list
+        self._timebase = None
+        self._values = ValuesBuffer(self.dtype)
+        self._values.extend(value_list)
 
         if store:
             self.write_bin()
@@ -235,7 +318,8 @@ class DataSlice(EmbeddedDocument):
         #   slice.save()
         # It is very important to use fp.flush() and os.fsync(fp) to make sure the data is immeadiately written
         # to the hard drive. Otherwise it can take up to 35 s for the data to actually be written. This would
-        # cause data loss when unplugging the device in this time period.
+        # cause data loss when unplugging the device in this time period (with df.group_commit the journal is fsynced
+        # instead, see _write_file()).
 
         if not self.df.consistent:
             # If this is not checked, the following could happen: the data file gets loaded with 150 samples (binaries are on the harddrive) but the write pointer is at 100
@@ -253,54 +337,24 @@ class DataSlice(EmbeddedDocument):
         if len(self.values) > self.values_write_pointer:
 
             if self.dtype == 'uint24':
-                slice_binary = DcHelper.int_list_to_uint24_lsb_first(self.values[self.values_write_pointer:])
+                slice_binary = DcHelper.array_to_uint24_lsb_first(self.values[self.values_write_pointer:])
 
             elif self.dtype == 'int24':
-                slice_binary = DcHelper.int_list_to_int24_lsb_first(self.values[self.values_write_pointer:])
+                slice_binary = DcHelper.array_to_int24_lsb_first(self.values[self.values_write_pointer:])
 
             else:
                 slice_binary = np.asarray(self.values[self.values_write_pointer:], dtype=self.dtype).tobytes()
 
-            if str(self._path).endswith('.zst'):
-                try:
-                    with open(str(self._path), 'rb') as fp:
-                        uncompressed_binary = zstd.ZSTD_uncompress(fp.read())
-                except FileNotFoundError:
-                    self.logger.error(f'write_bin: decompressing with zstd failed. File {self._path} not found.')
-                    # todo: ok ????? or better write to non compressed file?
-                    slice_binary = b''
-
-                with open(str(self._path), 'wb') as fp:
-                    uncompressed_binary += slice_binary
-                    compressed_binary = zstd.ZSTD_compress(uncompressed_binary, 2)
-                    fp.write(compressed_binary)
-                    fp.flush()
-                    os.fsync(fp)
+            if self.compression_algorithm:
+                if not os.path.isfile(self._path):
+                    self.logger.error(f'write_bin: compressed file {self._path} not found. Writing the new values to a new file.')
 
-            elif str(self._path).endswith('.gz'):
-                try:
-                    with open(str(self._path), 'rb') as fp:
-                        uncompressed_binary = gzip.decompress(fp.read())
-                except FileNotFoundError:
-                    self.logger.error(f'write_bin: decompressing with gz failed. File {self._path} not found.')
-                    # todo: ok ????? or better write to non compressed file?
-                    slice_binary = b''
-
-                with open(str(self._path), 'wb') as fp:
-                    uncompressed_binary += slice_binary
-                    compressed_binary = gzip.compress(uncompressed_binary, 4)
-                    fp.write(compressed_binary)
-                    fp.flush()
-                    os.fsync(fp)
+                self._write_compressed(slice_binary)
 
             else:
-                #with open(str(self._path), fp_mode) as fp:
-                with open(str(self._path), 'ab') as fp:
-                    # ToDo pretty sure this is fine; it's not possible that self.values changes length during the follwowing few steps!!!
-                    # write values with index > self._values_write_pointer
-                    fp.write(slice_binary)
-                    fp.flush()
-                    os.fsync(fp)
+                # ToDo pretty sure this is fine; it's not possible that self.values changes length during the follwowing few steps!!!
+                # write values with index > self._values_write_pointer
+                self._write_file(slice_binary)
 
             self.values_write_pointer = len(self.values)
             self.logger.debug(f'write_bin for slice {self.hash_long} to {self._path}. values_write_pointer: {self.values_write_pointer}.')
@@ -315,6 +369,53 @@ class DataSlice(EmbeddedDocument):
                 self.logger.error(f'write_bin inconsistency for slice {self.hash_long}, len(values)={len(self.values)} < values_write_pointer={self.values_write_pointer}. '
                              f'Data loss probable. Last 5 values: {self.values[-5:]}')
 
+    def _write_file(self, bin_data):
+        # append bin_data to the slice file
+
+        # group commit (see df.group_commit): the journal is fsynced once for all slices in df.store()
+        self._file_changed()
+
+        journal = self.df.journal
+        if journal is not None and journal.in_batch:
+            journal.write(self._path, bin_data)
+            return
+
+        with open(str(self._path), 'ab') as fp:
+            fp.write(bin_data)
+            fp.flush()
+            os.fsync(fp)
+
+    def _write_compressed(self, bin_data):
+        # append bin_data to a compressed slice file
+
+        # append the new values as an independent zstd frame / gzip member => the existing data does not need to be
+        # decompressed and compressed again (the frames are merged by compact() when the slice is full or closed)
+        if not self.precoding:
+            self._write_file(DcHelper.compress_bytes(bin_data, self.compression_algorithm, dict_id=self.compression_dict_id))
+            return
+
+        # precoded data cannot be continued by an independent frame => rewrite the file (rare: slices are only compressed
+        # when they are full or the file is closed)
+        self.logger.debug(f'rewriting precoded slice {self.hash_long} to append {len(bin_data)} bytes')
+        self._checkpoint_journal()
+
+        slice_binary = self.get_bin_data() or b''
+        slice_binary = DcHelper.precode(slice_binary + bytes(bin_data), self.dtype_size, self.precoding, self.byteorder)
+
+        path_tmp = Path(str(self._path) + '.tmp')
+        with open(str(path_tmp), 'wb') as fp:
+            fp.write(DcHelper.compress_bytes(slice_binary, self.compression_algorithm, dict_id=self.compression_dict_id))
+            fp.flush()
+            os.fsync(fp)
+        os.replace(path_tmp, self._path)
+        self._file_changed()
+
+    def _checkpoint_journal(self):
+        # the slice file is going to be rewritten (compress, compact) => writes of a group commit must be fsynced first
+        journal = getattr(self.df, 'journal', None)
+        if journal is not None:
+            journal.checkpoint()
+
     def append_binary(self, byte_values):
         # appends binaries to binary buffer
 
@@ -322,9 +423,10 @@ class DataSlice(EmbeddedDocument):
         if self._values_bin is None:
             self._values_bin = bytearray()
         self._values_bin += byte_values
+        self._timebase = None
 
         # reset _values to ensure that another part of the program accessing .values has always the correct values loaded
-        self._values = None
+        self.free_values()
 
     def write_appended_binaries(self):
         # writes all in the binary buffer to the hard drive
@@ -333,20 +435,17 @@ class DataSlice(EmbeddedDocument):
             self.logger.debug(f'Skipping write_append_binaries for {self.hash_long} since binary buffer is empty')
             return
 
-        if str(self._path).endswith(('.zst', '.gz')):
-            self.logger.error(f'write_appended_binaries {self.hash_long} cannot append binary to compressed file! {self._path.name}')
-            return
-
-        with open(str(self._path), 'ab') as fp:
-            fp.write(self._values_bin)
-            fp.flush()
-            os.fsync(fp)
+        # compressed files: append a new zstd frame / gzip member
+        if self.compression_algorithm:
+            self._write_compressed(self._values_bin)
+        else:
+            self._write_file(self._values_bin)
 
         self.values_write_pointer += int(len(self._values_bin) / self.dtype_size)
         # clear buffer (don't set this back to None!)
         self._values_bin = bytearray()
         # reset _values to ensure that another part of the program accessing .values has always the correct values loaded
-        self._values = None
+        self.free_values()
 
         current_slice_size = self.values_write_pointer * self.dtype_size
         if current_slice_size >= self.df.slice_max_size:
@@ -360,19 +459,10 @@ class DataSlice(EmbeddedDocument):
         # returns the binary data
 
         try:
-            if '.zst' in str(self._path):
-                with open(str(self._path), 'rb') as fp:
-                    bin = zstd.ZSTD_uncompress(fp.read())
-
-            if '.gz' in str(self._path):
-                with open(str(self._path), 'rb') as fp:
-                    bin = gzip.decompress(fp.read())
-
-            else:
-                with open(str(self._path), 'rb') as fp:
-                    bin = fp.read()
+            with open(str(self._path), 'rb') as fp:
+                bin = b''.join(DcHelper.decompress_chunks(fp, self.compression_algorithm, self.compression_dict_id))
 
-            return bin
+            return DcHelper.unprecode(bin, self.dtype_size, self.precoding, self.byteorder)
 
         except FileNotFoundError:
 
@@ -388,68 +478,147 @@ class DataSlice(EmbeddedDocument):
         #  wenn nicht => bin zippen
         #  was wenn beide nicht da??
 
+        # the compression is split into three steps to allow DataFile.compress() to run the file I/O and the actual
+        # compression in worker threads, while the slice attributes are only changed by the owning thread:
+        #   _compress_prepare(): checks (no file access)
+        #   _compress_file():    reading, compressing and writing the file (no slice attributes)
+        #   _compress_apply():   setting _path, status_compressed, compressed_size_meta, ...
+        prepared = self._compress_prepare(algorithm, level)
+        if prepared is not True:
+            return prepared
+
+        self._checkpoint_journal()
+        return self._compress_apply(DataSlice._compress_file(self._path, algorithm, level, **self._compress_args(algorithm)))
+
+    def _compress_args(self, algorithm):
+        # zstd dictionary and precoding for _compress_file()
+
+        args = {'sample_size': self.dtype_size if self.dtype else 1, 'byteorder': self.byteorder}
+
+        # already compressed: the frames are merged with the dictionary and precoding they were compressed with
+        if self.compression_algorithm:
+            args['dict_id'] = self.compression_dict_id
+            args['precoding'] = self.precoding
+            return args
+
+        args['dict_id'] = zstd_dicts.active_id(self.data_type) if algorithm == 'zstd' else 0
+        if config.precoding and self.slice_type == 'y':
+            args['precoding'] = config.data_types_dict.get(self.data_type, {}).get('precoding')
+        elif config.timebase and self.slice_type == 'time_rec' and self.dtype in ('float32', 'float64'):
+            args['precoding'] = 'timebase'
+        return args
+
+    def _compress_prepare(self, algorithm='zstd', level=2):
+        # returns True if _compress_file() needs to be called, otherwise the return value for compress()
+
+        if not (self.df.status_closed or self.status_slice_full):
+            return None
+
+        if algorithm not in ('zstd', 'gzip'):
+            self.logger.error('The compression algorithm you have specified is not valid! Choose "zstd" or "gzip" ')
+            return False
+
+        # file already compressed (_compress_file() merges frames which were appended after the compression)
+        if self.compression_algorithm == algorithm:
+            # set this attribute again (there was a case where it was necessary due to a gatway restart before the database was stored!)
+            self.status_compressed = True
+            return True
+
+        if self.compression_algorithm:
+            self.logger.warning(f'compress slice {self.hash_long} stopped. Files are already compressed with another algorithm')
+            return False
+
+        if algorithm == 'zstd' and level < 0 and level > 22:
+            self.logger.error(f'The compression level ({level}) you have specified is not valid!')
+            return False
+        if algorithm == 'gzip' and level < 0 and level > 9:
+            self.logger.error(f'The compression level ({level}) you have specified is not valid!')
+            return False
+
+        return True
+
+    @staticmethod
+    def _compress_file(path, algorithm, level=None, dict_id=0, precoding=None, sample_size=1, byteorder='little'):
+        # compresses the file at path (.bin => .bin.zst / .bin.gz) or merges the frames of an already compressed file.
+        # Only file access here, no slice attributes (this may run in a worker thread).
+        #   dict_id: zstd dictionary (see ZstdDicts), 0: no dictionary
+        #   precoding, sample_size, byteorder: see DcHelper.precode() (already compressed files are precoded already)
+
         t = time.monotonic()
+        result = {'path': path, 'path_old': path, 'compacted': False, 'frames': 1, 'bytes': 0, 'dict_id': dict_id, 'precoding': precoding,
+                  'error': None, 'time': 0}
 
-        if self.df.status_closed or self.status_slice_full:
+        try:
+            with open(str(path), 'rb') as fp:
+                bin_data = fp.read()
 
-            path_old = self._path
+            # already compressed => compact
+            if (algorithm == 'zstd' and str(path).endswith('.zst')) or (algorithm == 'gzip' and str(path).endswith('.gz')):
 
-            if algorithm == 'zstd':
-                # file already exists
-                if str(self._path).endswith('.zst'):
-                    # set this attribute again (there was a case where it was necessary due to a gatway restart before the database was stored!)
-                    self.status_compressed = True
-                    return True
-                if str(self._path).endswith('.gz'):
-                    self.logger.warning(f'compress slice {self.hash_long} stopped. Files are already compressed with another algorithm')
-                    return False
-                if level < 0 and level > 22:
-                    self.logger.error(f'The compression level ({level}) you have specified is not valid!')
-                    return False
-                # compress
-                try:
-                    bin_data_compressed = zstd.ZSTD_compress(open(str(self._path), 'rb').read(), level)
-                except FileNotFoundError:
-                    self.logger.error(f'compress slice {self.hash_long} with zstd failed. File {self._path} not found')
-                    return False
-                except zstd.Error:
-                    self.logger.error(f'compress slice {self.hash_long} with zstd failed. zstd.Error')
-                    return False
-                # change path
-                self._path = Path(str(self._path) + '.zst')
-
-            elif algorithm == 'gzip':
-                if str(self._path).endswith('.gz'):
-                    self.status_compressed = True
-                    return True
-                if str(self._path).endswith('.zst'):
-                    self.logger.warning(f'compress slice {self.hash_long}. Files are already compressed with another algorithm')
-                    return False
-                if level < 0 and level > 9:
-                    self.logger.error(f'The compression level ({level}) you have specified is not valid!')
-                    return False
-                try:
-                    bin_data_compressed = gzip.compress(open(str(self._path), 'rb').read(), level)
-                except FileNotFoundError:
-                    self.logger.error(f'compress slice {self.hash_long} with gzip failed. File {self._path} not found')
-                    return False
-                # change path
-                self._path = Path(str(self._path) + '.gz')
+                result['frames'] = DcHelper.compressed_frames(bin_data, algorithm)
+                if result['frames'] > 1:
+                    bin_data_compacted = DcHelper.compress_bytes(DcHelper.decompress_bytes(bin_data, algorithm, dict_id), algorithm, level, dict_id)
+
+                    # write to a temporary file first and replace the original one afterwards => no data loss if the device is unplugged
+                    path_tmp = Path(str(path) + '.tmp')
+                    with open(str(path_tmp), 'wb') as fp:
+                        fp.write(bin_data_compacted)
+                        fp.flush()
+                        os.fsync(fp)
+                    os.replace(path_tmp, path)
+
+                    result['compacted'] = True
+                    result['bytes'] = len(bin_data_compacted)
 
             else:
-                self.logger.error('The compression algorithm you have specified is not valid! Choose "zstd" or "gzip" ')
-                return False
+                bin_data_precoded = DcHelper.precode(bin_data, sample_size, precoding, byteorder)
+                # irregular time_rec values (many exceptions) => store the values as they are
+                if precoding == 'timebase' and len(bin_data_precoded) >= len(bin_data):
+                    bin_data_precoded = bin_data
+                    result['precoding'] = None
+                bin_data_compressed = DcHelper.compress_bytes(bin_data_precoded, algorithm, level, dict_id)
+                path_new = Path(str(path) + ('.zst' if algorithm == 'zstd' else '.gz'))
+
+                with open(str(path_new), 'wb') as fp:
+                    fp.write(bin_data_compressed)
+                    # do this to quickly write down the data to the hard drive
+                    fp.flush()
+                    os.fsync(fp)
+
+                # remove raw bin data file
+                os.remove(path)
+
+                result['path'] = path_new
+                result['bytes'] = len(bin_data_compressed)
+
+        except FileNotFoundError:
+            result['error'] = f'compress {path.name} with {algorithm} failed. File {path} not found'
+        except zstd.Error:
+            result['error'] = f'compress {path.name} with {algorithm} failed. zstd.Error'
+        except OSError as e:
+            result['error'] = f'compress {path.name} with {algorithm} failed. {e}'
+        except ValueError:
+            result['error'] = f'compress {path.name} with {algorithm} failed. Precoding {precoding} not possible'
+
+        result['time'] = time.monotonic() - t
 
-            with open(str(self._path), 'wb') as fp:
-                fp.write(bin_data_compressed)
-                # do this to quickly write down the data to the hard drive
-                fp.flush()
-                os.fsync(fp)
+        return result
 
-            # remove raw bin data file
-            os.remove(path_old)
+    def _compress_apply(self, result):
+        # apply the result of _compress_file() to this slice (owning thread)
 
+        self._file_changed()
+
+        if result['error']:
+            self.logger.error(result['error'])
+            return False
+
+        # compressed
+        if result['path'] != result['path_old']:
+            self._path = result['path']
             self.status_compressed = True
+            self.compression_dict_id = result['dict_id']
+            self.precoding = result['precoding']
             # send compressed files again
             self.status_sent_server = False
 
@@ -457,18 +626,30 @@ class DataSlice(EmbeddedDocument):
             self.compressed_size_meta = self.compressed_size
             self.compression_ratio_meta = self.compression_ratio
 
-            self.logger.debug(f'compressed slice {self.hash_long}. Old name: {path_old.name}, new name: {self._path.name}, status_compressed: {self.status_compressed}, status_sent_server: '
-                         f'{self.status_sent_server}, in {round(time.monotonic()-t, 2)} sec')
-        '''
-        # gzip
-        # level 1 ... 9 (here 4)
-        compressed = gzip.compress(data_to_compress, 4)
-        decompressed = gzip.decompress(compressed)
-        # zstd
-        # level 1 ... 22 (here 2)
-        compressed = zstd.ZSTD_compress(data_to_compress, 2)
-        decompressed = zstd.ZSTD_uncompress(data_to_compress)
-        '''
+            self.logger.debug(f'compressed slice {self.hash_long}. Old name: {result["path_old"].name}, new name: {self._path.name}, status_compressed: {self.status_compressed}, status_sent_server: '
+                         f'{self.status_sent_server}, in {round(result["time"], 2)} sec')
+            return None
+
+        # frames merged
+        if result['compacted']:
+            # the file has changed => send it again
+            self.status_sent_server = False
+            self.compressed_size_meta = self.compressed_size
+            self.compression_ratio_meta = self.compression_ratio
+
+            self.logger.debug(f'compacted slice {self.hash_long}: {result["frames"]} frames -> {result["bytes"]} bytes, in {round(result["time"], 2)} sec')
+
+        return True
+
+    def compact(self, level=None):
+        # write_bin() appends a new zstd frame / gzip member to compressed files for every write.
+        # Merge them into a single frame (typically when the slice is full or the file is closed).
+
+        if not self.compression_algorithm:
+            return True
+
+        self._checkpoint_journal()
+        return self._compress_apply(DataSlice._compress_file(self._path, self.compression_algorithm, level, **self._compress_args(self.compression_algorithm)))
 
     def send_partially_old(self, server, session):
 
@@ -662,6 +843,7 @@ class DataSlice(EmbeddedDocument):
                                            data=data_to_send,
                                            timeout=config.request_timeout,
                                            log_time=True,
+                                           session=session,
                                            attempts=self.max_upload_attempts)
 
             # not successful
@@ -691,32 +873,11 @@ class DataSlice(EmbeddedDocument):
         try:
             self.logger.debug(f'lazy_load {self.hash_long}')
 
-            with open(str(self._path), 'rb') as fp:
-                slice_binary = fp.read()
-
-            if '.zst' in str(self._path):
-                slice_binary = zstd.ZSTD_uncompress(slice_binary)
-            if '.gz' in str(self._path):
-                slice_binary = gzip.decompress(slice_binary)
-
-            if self.data_type.startswith('eeg') and self.slice_type == 'y':
-                np_array = np.asarray(DcHelper.int24_msb_first_to_int_list(slice_binary), dtype='int32')
-                # conversion of Smarting EEG data
-                vref = 4.5
-                gain = 24
-                scale_factor = (vref / (2**23 - 1)) / gain
-                np_array = np_array * scale_factor * 1e+6
-            elif self.data_type.startswith('gyro') and self.slice_type == 'y':
-                np_array = np.frombuffer(slice_binary, dtype=self.dtype)
-                # conversion of Smarting Gyroscope data
-                np_array = np_array * 250 / 32768
-            else:
-                if self.dtype == 'uint24':
-                    np_array = np.asarray(DcHelper.uint24_lsb_first_to_int_list(slice_binary), dtype='uint32')
-                elif self.dtype == 'int24':
-                    np_array = np.asarray(DcHelper.int24_lsb_first_to_int_list(slice_binary), dtype='int32')
-                else:
-                    np_array = np.frombuffer(slice_binary, dtype=self.dtype)
+            # uncompressed slices can be memory mapped instead of being read (see df.mmap_slices)
+            np_array = self._lazy_load_mmap()
+
+            if np_array is None:
+                np_array = self._read_array()
 
             # integrity check
             if len(np_array) == self.values_write_pointer:
@@ -761,6 +922,133 @@ class DataSlice(EmbeddedDocument):
             else:
                 return np.frombuffer(b'', dtype=self.dtype)
 
+    def read_values(self, count=None):
+        # returns the first count values (None: all) as numpy array. Only the necessary part of the slice file is read
+        # and decompressed if the values are not loaded yet (they are not kept in memory => no lazy load of all values).
+
+        if self._values is not None:
+            return self._values.array[:count]
+
+        try:
+            return self._read_array(count)
+        except FileNotFoundError:
+            self.logger.warning(f'read_values: slice file {str(self._path)} not found. Returning empty values.')
+            return np.empty(0, dtype=ValuesBuffer.storage_dtype(self.dtype))
+
+    @property
+    def timebase(self):
+        # the time_rec values as Timebase (segments + exceptions) for lookups without materializing the values. Slices
+        # compressed with the timebase precoding are not decoded at all, for all others it is built from the values.
+
+        if self._timebase is not None:
+            return self._timebase
+
+        if self.precoding == 'timebase' and not self.binaries_appended and (self._values is None or len(self._values) == self.values_write_pointer):
+            try:
+                with open(str(self._path), 'rb') as fp:
+                    self._timebase = Timebase.from_bytes(b''.join(DcHelper.decompress_chunks(fp, self.compression_algorithm, self.compression_dict_id)), self.dtype)
+                return self._timebase
+            except (FileNotFoundError, ValueError, zstd.Error) as e:
+                self.logger.warning(f'timebase of slice {self.hash_long} could not be read ({type(e).__name__}). Using the values.')
+
+        self._timebase = Timebase.from_array(self.read_values(), self.dtype)
+        return self._timebase
+
+    def _read_array(self, count=None):
+        # streaming decode of the slice file: the values are decoded block by block into a preallocated array
+        # (sized from values_write_pointer), so the compressed and the decompressed data are never completely in memory.
+        #   count: decode only the first count values and stop reading the file (None: all values)
+
+        sample_size = self.dtype_size
+        size = self.values_write_pointer if count is None else min(count, self.values_write_pointer)
+        np_array = np.empty(size, dtype=ValuesBuffer.storage_dtype(self.dtype))
+        pos = 0
+        # values behind values_write_pointer (inconsistent slice, see lazy_load())
+        overflow = []
+        rest = b''
+
+        with open(str(self._path), 'rb') as fp:
+            chunks = DcHelper.decompress_chunks(fp, self.compression_algorithm, self.compression_dict_id, chunk_size=sample_size * 65536)
+            # precoded slices can only be decoded completely (see DcHelper.unprecode())
+            if self.precoding:
+                chunks = [DcHelper.unprecode(b''.join(chunks), sample_size, self.precoding, self.byteorder)]
+
+            for chunk in chunks:
+
+                # incomplete sample at the end of the last chunk
+                if rest:
+                    chunk = rest + chunk
+                samples = len(chunk) // sample_size
+                rest = chunk[samples * sample_size:]
+                chunk = memoryview(chunk)
+
+                n = min(samples, size - pos)
+                if n:
+                    self._decode_into(chunk[:n * sample_size], np_array[pos:pos + n])
+                    pos += n
+                if samples > n:
+                    if count is not None:
+                        break
+                    overflow_array = np.empty(samples - n, dtype=np_array.dtype)
+                    self._decode_into(chunk[n * sample_size:samples * sample_size], overflow_array)
+                    overflow.append(overflow_array)
+
+                # stop early
+                if count is not None and pos == size:
+                    break
+
+        if rest and count is None:
+            self.logger.error(f'_read_array {self.hash_long}: {len(rest)} bytes left at the end of the file (dtype {self.dtype})')
+
+        if pos < size:
+            np_array = np_array[:pos]
+        if overflow:
+            np_array = np.concatenate([np_array] + overflow)
+
+        return self._convert_values(np_array)
+
+    def _decode_into(self, bin_data, out):
+        # decode the (uncompressed) binary data of this slice into the array out
+
+        if self.data_type.startswith('eeg') and self.slice_type == 'y':
+            DcHelper.int24_msb_first_to_array(bin_data, out=out)
+        elif self.dtype == 'uint24':
+            DcHelper.uint24_lsb_first_to_array(bin_data, out=out)
+        elif self.dtype == 'int24':
+            DcHelper.int24_lsb_first_to_array(bin_data, out=out)
+        else:
+            out[:] = np.frombuffer(bin_data, dtype=self.dtype)
+
+    def _convert_values(self, np_array):
+
+        if self.data_type.startswith('eeg') and self.slice_type == 'y':
+            # conversion of Smarting EEG data
+            vref = 4.5
+            gain = 24
+            scale_factor = (vref / (2**23 - 1)) / gain
+            np_array = np_array * scale_factor * 1e+6
+        elif self.data_type.startswith('gyro') and self.slice_type == 'y':
+            # conversion of Smarting Gyroscope data
+            np_array = np_array * 250 / 32768
+
+        return np_array
+
+    def _lazy_load_mmap(self):
+        # returns a read-only np.memmap of the slice file or None if the slice cannot be memory mapped.
+        # Only possible for uncompressed files with a numpy dtype (no 24 bit values and no converted eeg/gyro values).
+        # Appending to the values copies them into memory first (see ValuesBuffer).
+
+        if not self.df.mmap_slices or self.compression_algorithm:
+            return None
+        if self.dtype in ('uint24', 'int24') or (self.slice_type == 'y' and self.data_type.startswith(('eeg', 'gyro'))):
+            return None
+
+        try:
+            return np.memmap(str(self._path), dtype=self.dtype, mode='r')
+        # empty file or file size is not a multiple of the dtype size => read the file normally
+        except ValueError:
+            return None
+
     @property
     def file_exists(self):
 
@@ -827,16 +1115,29 @@ class DataSlice(EmbeddedDocument):
                     # convert to normal Python Int/Float because mongodb/engine cannot handle uint8 in float fields!
                     # (whereas Python int is ok in a float field)
                     if self.values:
-                        self.min = float(min(self.values))
-                        self.max = float(max(self.values))
-                        self.mean = float(sum(self.values) / self.samples_meta)
+                        values = np.asarray(self.values)
+                        self.min = float(values.min())
+                        self.max = float(values.max())
+                        self.values_sum = float(values.sum(dtype=np.float64))
+                        self.mean = self.values_sum / self.samples_meta
+                        self.sketch_values, self.sketch_weights = QuantileSketch.from_values(values).to_lists()
                     else:
                         self.min = None
                         self.max = None
+                        self.values_sum = None
                         self.mean = None
+                        self.sketch_values, self.sketch_weights = [], []
 
                 self._check_status_full_and_free_memory()
 
+    @property
+    def quantile_sketch(self):
+        # QuantileSketch of the values (stored in final_analyse(), slices analysed before there were sketches are loaded)
+
+        if self.sketch_values or not self.samples_meta:
+            return QuantileSketch.from_lists(self.sketch_values, self.sketch_weights)
+        return QuantileSketch.from_values(self.values)
+
     def _check_status_full_and_free_memory(self):
         # this method is used in final_analyze (only)
         # instead of calling check_and_set_status_slice_full() method (which depends on bin_size which was
@@ -851,7 +1152,7 @@ class DataSlice(EmbeddedDocument):
             if self.df.free_slices_when_finally_analysed and \
                     (not config.data_types_dict[self.data_type]['box_plot'] or self.slice_type == 'time_rec'):
                 freed_mem = DcHelper.file_size_str(len(self._values)*self.dtype_size) if self._values else 0
-                self._values = None
+                self.free_values()
                 self.logger.debug(f'freed {freed_mem} of memory of sl {self.hash_long} after finally analyzing it.')
 
 
@@ -35,6 +35,18 @@ class DcConfig():
         self._producer_hash = None
         self._operating_system = platform.system()
         self._numpy_size = 'optimized'
+        # byte budget of the decoded slice values of all DataFiles (see SliceCache), None: no limit
+        self._slice_cache_max_size = None
+        # number of threads for compressing the slices in df.compress() / df.close()
+        self._compress_workers = min(4, os.cpu_count() or 1)
+        # lossless pre-transform of slices before compressing them ("precoding" in data_types.json, see DcHelper.precode())
+        self._precoding = False
+        # store time_rec slices as piecewise regular timebase when compressing them (see Timebase)
+        self._timebase = False
+        # update the min/max/mean rollups of the columns in final_analyse() (see Rollup)
+        self._rollup = False
+        # store the slices of new columns in an own collection instead of the DataFile document (see SliceStore)
+        self._slice_collection = False
 
         # default logger (for initialization only)
         self.logger.setLevel(logging.DEBUG)
@@ -47,7 +59,8 @@ class DcConfig():
 
     def init(self, db_name=None, data_path=None, redis_db_index=None,
              logger_path=None, logger_config_file_path=None, logger_level=None, producer_hash=None,
-             live_data=False, SLICE_MAX_SIZE=None, numpy_size=None):
+             live_data=False, SLICE_MAX_SIZE=None, numpy_size=None, slice_cache_max_size=None,
+             compress_workers=None, precoding=False, timebase=False, rollup=False, slice_collection=False):
 
         if self._init_called:
             self.logger.error('data_container.config.init() can only be called once')
@@ -132,6 +145,31 @@ class DcConfig():
             else:
                 self.logger.warning(f'The specified numpy_size={numpy_size} is unknown')
 
+        # limit the memory of the decoded slice values (of all DataFiles)
+        if slice_cache_max_size:
+            self._slice_cache_max_size = slice_cache_max_size
+            self.logger.info(f'Using a slice cache with max size {slice_cache_max_size} bytes')
+
+        if compress_workers:
+            self._compress_workers = compress_workers
+
+        # slices compressed with precoding can only be read by data_container versions which know the precoding
+        if precoding:
+            self._precoding = True
+            self.logger.info('Using precoding for compressing slices')
+
+        if timebase:
+            self._timebase = True
+            self.logger.info('Using timebase encoding for compressing time_rec slices')
+
+        if rollup:
+            self._rollup = True
+            self.logger.info('Updating the rollups of the columns in final_analyse()')
+
+        if slice_collection:
+            self._slice_collection = True
+            self.logger.info('Storing the slices of new columns in the slice collection')
+
         # all done
         self.logger.info('init of data_container successful')
         self._init_called = True
@@ -270,6 +308,30 @@ class DcConfig():
     def numpy_size(self):
         return self._numpy_size
 
+    @property
+    def slice_cache_max_size(self):
+        return self._slice_cache_max_size
+
+    @property
+    def compress_workers(self):
+        return self._compress_workers
+
+    @property
+    def precoding(self):
+        return self._precoding
+
+    @property
+    def timebase(self):
+        return self._timebase
+
+    @property
+    def rollup(self):
+        return self._rollup
+
+    @property
+    def slice_collection(self):
+        return self._slice_collection
+
     def generate_hash(self, hash_len=None):
         """docstring description
 
@@ -7,8 +7,19 @@ import json
 from datetime import datetime
 import pytz
 import re
+import numpy as np
+import zstd
+import gzip
+import zlib
+# optional (streaming zstd decompression, see decompress_chunks())
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 from . import config
+from . import zstd_dicts
+from .dc_timebase import Timebase
 from builtins import staticmethod
 logger = config.logger
 
@@ -103,6 +114,20 @@ class DcHelper():
             logger.error('helper_dtype_size() ' + str(dtype) +' not found')
             raise ValueError
 
+    @staticmethod
+    def helper_dtype_range(dtype):
+        # (min, max) of the values which can be stored in dtype (incl. the 24 bit types)
+
+        if dtype == 'uint24':
+            return 0, 2 ** 24 - 1
+        elif dtype == 'int24':
+            return -2 ** 23, 2 ** 23 - 1
+        elif 'int' in dtype:
+            info = np.iinfo(dtype)
+        else:
+            info = np.finfo(dtype)
+        return info.min, info.max
+
     @staticmethod
     def int_to_uint24_lsb_first(int_value):
 
@@ -122,132 +147,396 @@ class DcHelper():
     @staticmethod
     def int_list_to_int24_lsb_first(int_value_list):
 
-        bin_data = bytearray()
+        return bytearray(DcHelper.array_to_int24_lsb_first(int_value_list))
+
+    @staticmethod
+    def int_list_to_int24_msb_first(int_value_list):
 
-        for int_value in int_value_list:
+        return bytearray(DcHelper.array_to_int24_msb_first(int_value_list))
 
-            if int_value > int(((2**24)/2)-1):
-                logger.error(f'int_list_to_int24_lsb_first(): too big int_value {int_value} found! Replacing it with ((2**24)/2)-1')
-                int_value = int(((2**24)/2)-1)
-            if int_value < int(-(2**24)/2):
-                logger.error(f'int_list_to_int24_lsb_first(): too small int_value {int_value} found! Replacing it with -((2**24)/2)')
-                int_value = int(-(2**24)/2)
+    @staticmethod
+    def int_list_to_uint24_lsb_first(int_value_list):
 
-            int24 = int_value.to_bytes(length=3, byteorder='little', signed=True)
+        return bytearray(DcHelper.array_to_uint24_lsb_first(int_value_list))
 
-            bin_data += int24
+    @staticmethod
+    def uint24_lsb_first_to_int_list(bin_data):
 
-        return bin_data
+        return DcHelper.uint24_lsb_first_to_array(bin_data).tolist()
 
     @staticmethod
-    def int_list_to_int24_msb_first(int_value_list):
+    def int24_lsb_first_to_int_list(bin_data):
 
-        bin_data = bytearray()
+        return DcHelper.int24_lsb_first_to_array(bin_data).tolist()
 
-        for int_value in int_value_list:
+    @staticmethod
+    def int24_msb_first_to_int_list(bin_data):
+        # e.g. EEG Data comes as MSB data
 
-            if int_value > int(((2**24)/2)-1):
-                logger.error(f'int_list_to_int24_lsb_first(): too big int_value {int_value} found! Replacing it with ((2**24)/2)-1')
-                int_value = int(((2**24)/2)-1)
-            if int_value < int(-(2**24)/2):
-                logger.error(f'int_list_to_int24_lsb_first(): too small int_value {int_value} found! Replacing it with -((2**24)/2)')
-                int_value = int(-(2**24)/2)
+        return DcHelper.int24_msb_first_to_array(bin_data).tolist()
 
-            int24 = int_value.to_bytes(length=3, byteorder='big', signed=True)
+    # ######################################################################
+    # 24 bit codec (numpy, no python loop over the samples)
 
-            bin_data += int24
+    @staticmethod
+    def _clip_int24(values, minimum, maximum, func_name):
+        # clamp all values at once and log a single error for all out of range values
 
-        return bin_data
+        values = np.asarray(values)
+        if values.dtype.kind == 'f':
+            values = np.rint(values)
+
+        too_big = values > maximum
+        too_small = values < minimum
+        if too_big.any():
+            logger.error(f'{func_name}(): {int(too_big.sum())} too big values found (max {values.max()})! Replacing them with {maximum}')
+        if too_small.any():
+            logger.error(f'{func_name}(): {int(too_small.sum())} too small values found (min {values.min()})! Replacing them with {minimum}')
+
+        return np.clip(values, minimum, maximum).astype(np.int64)
 
     @staticmethod
-    def int_list_to_uint24_lsb_first(int_value_list):
+    def _int24_to_array(bin_data, msb_first, signed, func_name, out=None):
+
+        data = np.frombuffer(bin_data, dtype=np.uint8)
+        iterations = len(data) // 3
+        if len(data) % 3:
+            logger.error(f'{func_name}() something went wrong (iterations_float)!')
+            data = data[:iterations * 3]
+        data = data.reshape(iterations, 3)
+        if msb_first:
+            data = data[:, ::-1]
+
+        # pad each 3 byte sample to 4 bytes (little endian) and view it as 32 bit integer
+        if out is None:
+            out = np.empty(iterations, dtype='<i4' if signed else '<u4')
+        padded = out.view(np.uint8).reshape(iterations, 4)
+        padded[:, :3] = data
+        if signed:
+            # sign extension: the msb of the 3rd byte is the sign bit
+            padded[:, 3] = np.where(data[:, 2] & 0x80, 0xFF, 0x00)
+        else:
+            padded[:, 3] = 0
+
+        return out
+
+    @staticmethod
+    def uint24_lsb_first_to_array(bin_data, out=None):
+
+        return DcHelper._int24_to_array(bin_data, False, False, 'uint24_lsb_first_to_array', out=out)
+
+    @staticmethod
+    def int24_lsb_first_to_array(bin_data, out=None):
+
+        return DcHelper._int24_to_array(bin_data, False, True, 'int24_lsb_first_to_array', out=out)
+
+    @staticmethod
+    def int24_msb_first_to_array(bin_data, out=None):
+        # e.g. EEG Data comes as MSB data
+
+        return DcHelper._int24_to_array(bin_data, True, True, 'int24_msb_first_to_array', out=out)
 
-        bin_data = bytearray()
+    @staticmethod
+    def array_to_uint24_lsb_first(values):
+
+        values = DcHelper._clip_int24(values, 0, 2**24-1, 'array_to_uint24_lsb_first')
+
+        return values.astype('<u4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+    @staticmethod
+    def array_to_int24_lsb_first(values):
+
+        values = DcHelper._clip_int24(values, -2**23, 2**23-1, 'array_to_int24_lsb_first')
+
+        return values.astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+    @staticmethod
+    def array_to_int24_msb_first(values):
+
+        values = DcHelper._clip_int24(values, -2**23, 2**23-1, 'array_to_int24_msb_first')
+
+        return values.astype('>i4').view(np.uint8).reshape(-1, 4)[:, 1:].tobytes()
+
+    @staticmethod
+    def concatenate_arrays(arrays, size, dtype):
+        # copies the arrays (e.g. a generator of slice values) into one array which is allocated only once.
+        #   size: expected total length (e.g. from the slice metadata). More values are possible (inconsistent slices) but
+        #   need a copy of the array.
+
+        out = np.empty(size, dtype=dtype)
+        pos = 0
+
+        for array in arrays:
+
+            array = np.asarray(array)
+            if pos + len(array) > len(out):
+                logger.warning(f'concatenate_arrays(): {pos + len(array)} values instead of {size}')
+                grown = np.empty(pos + len(array), dtype=dtype)
+                grown[:pos] = out[:pos]
+                out = grown
 
-        for int_value in int_value_list:
+            out[pos:pos + len(array)] = array
+            pos += len(array)
 
-            if int_value < 0:
-                logger.error(f'int_list_to_uint24_lsb_first(): negative int_value {int_value} found! Replacing it with 0')
-                int_value = 0
-            if int_value >= 2**24:
-                logger.error(f'int_list_to_uint24_lsb_first(): too big int_value {int_value} found! Replacing it with 2**24-1')
-                int_value = 2**24-1
+        if pos < len(out):
+            return out[:pos]
+        return out
 
-            # lsb first (byte_0 = lsb)
-            byte_2 = int_value >> 16
-            byte_1 = (int_value >> 8) & 0xFF
-            byte_0 = int_value & 0xFF
+    # ######################################################################
+    # compression (slice files can consist of several zstd frames / gzip members)
 
+    @staticmethod
+    def compress_bytes(bin_data, algorithm, level=None, dict_id=0):
+        # dict_id: trained zstd dictionary (see ZstdDicts), 0: no dictionary
+
+        if algorithm == 'zstd':
+            if dict_id:
+                return zstd_dicts.compress(bin_data, dict_id, 2 if level is None else level)
+            return zstd.ZSTD_compress(bytes(bin_data), 2 if level is None else level)
+        elif algorithm == 'gzip':
+            return gzip.compress(bin_data, 4 if level is None else level)
+        else:
+            logger.error(f'compress_bytes(): unknown compression algorithm {algorithm}')
+            raise ValueError
+
+    @staticmethod
+    def decompress_bytes(bin_data, algorithm, dict_id=0):
+
+        if algorithm == 'zstd':
+            if dict_id:
+                decompress = lambda frame: zstd_dicts.decompress(frame, dict_id)
+            else:
+                decompress = zstd.ZSTD_uncompress
+            frame_offsets = DcHelper.zstd_frame_offsets(bin_data)
+            if len(frame_offsets) == 1:
+                return decompress(bin_data)
+            return b''.join(decompress(bin_data[start:end]) for start, end in frame_offsets)
+        elif algorithm == 'gzip':
+            # gzip.decompress() handles multiple members
+            return gzip.decompress(bin_data)
+        elif algorithm is None:
+            return bin_data
+        else:
+            logger.error(f'decompress_bytes(): unknown compression algorithm {algorithm}')
+            raise ValueError
+
+    @staticmethod
+    def decompress_chunks(fp, algorithm, dict_id=0, chunk_size=262144):
+        # generator: reads the compressed data from the file object fp in blocks and yields the decompressed data in
+        # chunks of (at most) chunk_size bytes => the compressed and decompressed data is never completely in memory.
+        # Without zstandard, zstd data is read completely and decompressed frame by frame (python-zstd has no streaming).
+
+        if algorithm is None:
+            while True:
+                chunk = fp.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+        elif algorithm == 'gzip':
+            # handles multiple members
+            with gzip.GzipFile(fileobj=fp, mode='rb') as gz:
+                while True:
+                    chunk = gz.read(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        elif algorithm == 'zstd' and zstandard is not None:
+            zstd_dict = zstd_dicts.require(dict_id) if dict_id else None
             try:
-                bin_data += bytes([byte_0, byte_1, byte_2])
-            except ValueError:
-                logger.error('int_list_to_uint24_lsb_first() cast error for: ' + str(int_value) + ' -> ' + hex(int_value) + ' byte_0: ' + str(byte_0) + ' byte_1: ' + str(byte_1) + ' byte_2: ' + str(
-                    byte_2))
-                raise ValueError
+                reader = zstandard.ZstdDecompressor(dict_data=zstd_dict).stream_reader(fp, read_size=chunk_size, read_across_frames=True, closefd=False)
+                while True:
+                    chunk = reader.read(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+            except zstandard.ZstdError as e:
+                raise zstd.Error(str(e))
+
+        elif algorithm == 'zstd':
+            bin_data = fp.read()
+            for start, end in DcHelper.zstd_frame_offsets(bin_data):
+                yield DcHelper.decompress_bytes(bin_data[start:end], algorithm, dict_id)
 
-        return bin_data
+        else:
+            logger.error(f'decompress_chunks(): unknown compression algorithm {algorithm}')
+            raise ValueError
 
     @staticmethod
-    def uint24_lsb_first_to_int_list(bin_data):
+    def _samples_to_uint(bin_data, size, byteorder):
+        # bit patterns of the samples (size bytes each) as uint64
 
-        value_list = []
-        i = 0
-        iterations_float = len(bin_data)/3
-        iterations = int(iterations_float)
+        data = np.frombuffer(bin_data, dtype=np.uint8).reshape(-1, size)
+        if byteorder == 'big':
+            data = data[:, ::-1]
+        padded = np.zeros((len(data), 8), dtype=np.uint8)
+        padded[:, :size] = data
+        return padded.view('<u8').ravel()
 
-        if abs(iterations_float - iterations) > 0:
-            logger.error('to_uint24_lsb_first_to_int_list() something went wrong (iterations_float)!')
+    @staticmethod
+    def _uint_to_samples(values, size, byteorder):
 
-        for i in range(iterations):
+        data = values.astype('<u8').view(np.uint8).reshape(-1, 8)[:, :size]
+        if byteorder == 'big':
+            data = data[:, ::-1]
+        return data.tobytes()
 
-            byte_data = bin_data[3*i:3*i+3]
-            value = 0
-            for exp in range(3):
-                value = value + 0x100**exp * byte_data[exp]
-            value_list.append(value)
+    @staticmethod
+    def _check_precoding(precoding, bin_data, size, func_name):
 
-        return value_list
+        codecs = precoding.split('+')
+        if any(codec not in ('delta', 'xor', 'shuffle', 'timebase') for codec in codecs) or ('delta' in codecs and 'xor' in codecs):
+            logger.error(f'{func_name}(): unknown precoding {precoding}')
+            raise ValueError
+        if 'timebase' in codecs and (len(codecs) > 1 or size not in (4, 8)):
+            logger.error(f'{func_name}(): timebase precoding is only possible for float32 / float64 (size {size}) and cannot be combined')
+            raise ValueError
+        # the timebase is not a multiple of the sample size
+        if len(bin_data) % size and not (func_name == 'unprecode' and 'timebase' in codecs):
+            logger.error(f'{func_name}(): binary data ({len(bin_data)} bytes) is not a multiple of the sample size {size}')
+            raise ValueError
+        return codecs
 
     @staticmethod
-    def int24_lsb_first_to_int_list(bin_data):
+    def precode(bin_data, size, precoding, byteorder='little'):
+        # lossless transformation of the raw slice data (samples of size bytes) before compressing it. Smooth signals
+        # (ppg, ecg, acc, ...) compress much better this way. Codecs (combined with '+', e.g. 'delta+shuffle'):
+        #   delta:   difference to the previous sample (modulo 2**bits) with zig-zag encoding (small negative => small positive)
+        #   xor:     bit pattern xor previous bit pattern (floats)
+        #   shuffle: byte planes (all 1st bytes, all 2nd bytes, ...)
+        #   timebase: time_rec values (float32 / float64) as segments + exceptions (see Timebase, cannot be combined)
+
+        if not precoding:
+            return bin_data
+
+        codecs = DcHelper._check_precoding(precoding, bin_data, size, 'precode')
+
+        if 'timebase' in codecs:
+            return Timebase.from_array(np.frombuffer(bin_data, dtype=f'<f{size}'), f'<f{size}').to_bytes()
+
+        if 'delta' in codecs or 'xor' in codecs:
+            bits = 8 * size
+            mask = np.uint64(2**bits - 1)
+            values = DcHelper._samples_to_uint(bin_data, size, byteorder)
+            previous = np.concatenate((np.zeros(1, dtype=np.uint64), values[:-1]))
+            if 'delta' in codecs:
+                delta = (values - previous) & mask
+                sign = (delta >> np.uint64(bits - 1)) & np.uint64(1)
+                values = ((delta << np.uint64(1)) & mask) ^ (sign * mask)
+            else:
+                values = values ^ previous
+            bin_data = DcHelper._uint_to_samples(values, size, byteorder)
 
-        value_list = []
-        i = 0
-        iterations_float = len(bin_data)/3
-        iterations = int(iterations_float)
+        if 'shuffle' in codecs:
+            bin_data = np.frombuffer(bin_data, dtype=np.uint8).reshape(-1, size).T.tobytes()
 
-        if abs(iterations_float - iterations) > 0:
-            logger.error('to_int24_lsb_first_to_int_list() something went wrong (iterations_float)!')
+        return bytes(bin_data)
 
-        for i in range(iterations):
+    @staticmethod
+    def unprecode(bin_data, size, precoding, byteorder='little'):
+        # inverse of precode()
+
+        if not precoding:
+            return bin_data
+
+        codecs = DcHelper._check_precoding(precoding, bin_data, size, 'unprecode')
+
+        if 'timebase' in codecs:
+            return Timebase.from_bytes(bin_data, f'<f{size}').materialize().tobytes()
 
-            byte_data = bin_data[3*i:3*i+3]
-            value = int.from_bytes(byte_data, byteorder='little', signed=True)
-            #value = byte_data[0] << 16 | byte_data[1] << 8 | byte_data[2]
-            value_list.append(value)
+        if 'shuffle' in codecs:
+            bin_data = np.frombuffer(bin_data, dtype=np.uint8).reshape(size, -1).T.tobytes()
 
-        return value_list
+        if 'delta' in codecs or 'xor' in codecs:
+            bits = 8 * size
+            mask = np.uint64(2**bits - 1)
+            values = DcHelper._samples_to_uint(bin_data, size, byteorder)
+            if 'delta' in codecs:
+                sign = values & np.uint64(1)
+                delta = (values >> np.uint64(1)) ^ (sign * mask)
+                values = np.cumsum(delta, dtype=np.uint64) & mask
+            else:
+                values = np.bitwise_xor.accumulate(values)
+            bin_data = DcHelper._uint_to_samples(values, size, byteorder)
+
+        return bytes(bin_data)
 
     @staticmethod
-    def int24_msb_first_to_int_list(bin_data):
-        # e.g. EEG Data comes as MSB data
+    def compressed_frames(bin_data, algorithm):
+        # number of zstd frames / gzip members in bin_data
+
+        if algorithm == 'zstd':
+            return len(DcHelper.zstd_frame_offsets(bin_data))
+        elif algorithm == 'gzip':
+            frames = 0
+            while bin_data:
+                decompressor = zlib.decompressobj(wbits=31)
+                decompressor.decompress(bin_data)
+                bin_data = decompressor.unused_data
+                frames += 1
+            return frames
+        else:
+            return 1
+
+    @staticmethod
+    def zstd_frame_offsets(bin_data):
+        # returns a list of (start, end) byte offsets of all zstd frames in bin_data (only the headers are parsed)
+        # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md
 
-        value_list = []
-        i = 0
-        iterations_float = len(bin_data)/3
-        iterations = int(iterations_float)
+        frame_offsets = []
+        pos = 0
+        size = len(bin_data)
 
-        if abs(iterations_float - iterations) > 0:
-            logger.error('to_int24_lsb_first_to_int_list() something went wrong (iterations_float)!')
+        while pos < size:
 
-        for i in range(iterations):
+            start = pos
+            magic = int.from_bytes(bin_data[pos:pos + 4], byteorder='little')
 
-            byte_data = bin_data[3*i:3*i+3]
-            value = int.from_bytes(byte_data, byteorder='big', signed=True)
-            #value = byte_data[0] << 16 | byte_data[1] << 8 | byte_data[2]
-            value_list.append(value)
+            # skippable frame: magic, frame size (4 bytes), data
+            if magic & 0xFFFFFFF0 == 0x184D2A50:
+                pos += 8 + int.from_bytes(bin_data[pos + 4:pos + 8], byteorder='little')
+                continue
+
+            if magic != 0xFD2FB528:
+                logger.error(f'zstd_frame_offsets(): no valid zstd frame at byte {pos}')
+                raise ValueError
+
+            descriptor = bin_data[pos + 4]
+            fcs_flag = descriptor >> 6
+            single_segment = (descriptor >> 5) & 1
+            checksum_flag = (descriptor >> 2) & 1
+            dict_id_flag = descriptor & 3
+
+            pos += 5
+            if not single_segment:
+                pos += 1
+            pos += (0, 1, 2, 4)[dict_id_flag]
+            pos += (1 if single_segment else 0, 2, 4, 8)[fcs_flag]
+
+            # blocks: 3 byte header (last_block: bit 0, block_type: bits 1-2, block_size: bits 3-23)
+            while True:
+                if pos + 3 > size:
+                    logger.error('zstd_frame_offsets(): truncated zstd frame')
+                    raise ValueError
+                block_header = int.from_bytes(bin_data[pos:pos + 3], byteorder='little')
+                last_block = block_header & 1
+                block_type = (block_header >> 1) & 3
+                block_size = block_header >> 3
+                pos += 3 + (1 if block_type == 1 else block_size)
+                if last_block:
+                    break
+
+            if checksum_flag:
+                pos += 4
+
+            if pos > size:
+                logger.error('zstd_frame_offsets(): truncated zstd frame')
+                raise ValueError
 
-        return value_list
+            frame_offsets.append((start, pos))
+
+        return frame_offsets
 
     @staticmethod
     def datetime_validation(datetime_in, timezone=None):
@@ -462,3 +751,127 @@ class ClassContainer():
 
     def __init__(self):
         pass
+
+class ValuesBuffer():
+    # growable numpy array with a list-like interface (append, extend, slicing, len)
+    # the capacity is doubled when it is exhausted, so appending single values is amortised O(1) without boxing every
+    # sample into a Python object
+
+    _MIN_CAPACITY = 16
+
+    def __init__(self, dtype, capacity=0):
+
+        self._data = np.empty(capacity, dtype=ValuesBuffer.storage_dtype(dtype))
+        self._len = 0
+
+    @staticmethod
+    def storage_dtype(dtype):
+        # 24 bit values are kept as 32 bit integers in memory
+
+        if dtype == 'uint24':
+            return np.dtype('uint32')
+        elif dtype == 'int24':
+            return np.dtype('int32')
+        else:
+            return np.dtype(dtype)
+
+    @classmethod
+    def from_array(cls, array):
+        # wrap an existing array (e.g. from lazy_load) without copying it
+
+        buffer = cls(array.dtype)
+        buffer._data = array
+        buffer._len = len(array)
+
+        return buffer
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    @property
+    def nbytes(self):
+        return self._len * self._data.itemsize
+
+    @property
+    def array(self):
+        # view of the valid values (no copy)
+        return self._data[:self._len]
+
+    def _reserve(self, capacity):
+
+        if capacity <= len(self._data) and self._data.flags.writeable:
+            return
+
+        new_capacity = max(capacity, 2 * len(self._data), self._MIN_CAPACITY)
+        data = np.empty(new_capacity, dtype=self._data.dtype)
+        data[:self._len] = self._data[:self._len]
+        self._data = data
+
+    def append(self, value):
+
+        self._reserve(self._len + 1)
+        self._data[self._len] = value
+        self._len += 1
+
+    def extend(self, values):
+
+        values = np.asarray(values)
+        self._reserve(self._len + len(values))
+        self._data[self._len:self._len + len(values)] = values
+        self._len += len(values)
+
+    def tolist(self):
+        return self.array.tolist()
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __iter__(self):
+        return iter(self.array)
+
+    def __getitem__(self, key):
+
+        # single values are returned as Python int/float (like from a list)
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += self._len
+            if not 0 <= key < self._len:
+                raise IndexError('ValuesBuffer index out of range')
+            return self._data[key].item()
+        # slices are returned as read-only views wrapped in a ValuesBuffer (no copy). Do not return a bare ndarray here:
+        # "some_list += ndarray" is an element wise addition in numpy and not a list concatenation!
+        else:
+            view = self.array[key]
+            view.flags.writeable = False
+            return ValuesBuffer.from_array(view)
+
+    def __setitem__(self, key, value):
+
+        self._reserve(self._len)
+        self.array[key] = value
+
+    def __array__(self, dtype=None, copy=None):
+
+        if dtype is not None and dtype != self.dtype:
+            return self.array.astype(dtype)
+        elif copy:
+            return self.array.copy()
+        else:
+            return self.array
+
+    def __eq__(self, other):
+
+        if isinstance(other, (list, tuple, np.ndarray, ValuesBuffer)):
+            return len(self) == len(other) and bool(np.array_equal(self.array, np.asarray(other)))
+        return NotImplemented
+
+    def __repr__(self):
+        return f'ValuesBuffer({self.array}, dtype={self.dtype})'
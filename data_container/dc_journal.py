@@ -0,0 +1,255 @@
+import os
+import struct
+import zlib
+from pathlib import Path
+
+# optional: without fcntl (Windows) only the producer of the df replays the journal
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import config
+
+
+class SliceJournal():
+    # Group commit of the slice writes of a DataFile (see df.group_commit).
+    #
+    # Without group commit every DataSlice.write_bin() / write_appended_binaries() does its own fsync, i.e. a store() of
+    # a file with 20 live columns does 20+ fsyncs. With group commit, all writes of one store() are appended to the slice
+    # files without fsync and additionally to this journal (df.path/slices.journal). commit() fsyncs the journal once
+    # before the pointers are saved to the database, so unplugging the device loses no more data than before.
+    #
+    # On loading the DataFile, replay() writes all committed records to the slice files again (a record contains the
+    # file offset, so replaying is idempotent), fsyncs them and empties the journal. The same happens in checkpoint()
+    # when the journal gets too big or before slice files are rewritten (compress, compact).
+    #
+    # The writing df holds an exclusive lock (df.path/slices.journal.lock) from its first begin() until close(), so
+    # other processes which load the live df (server, dashboard, ...) don't replay and truncate its journal. The lock
+    # is released when the writer process dies, then the next load replays.
+    #
+    # record: type (W: write, C: commit), name length, file offset, data length, crc32 | name | data
+
+    FILE_NAME = 'slices.journal'
+    LOCK_FILE_NAME = 'slices.journal.lock'
+    HEADER = struct.Struct('<cHQII')
+    # journal size which triggers a checkpoint
+    MAX_SIZE = 1000000
+
+    def __init__(self, df):
+
+        self.logger = config.logger
+        self.df = df
+        self.path = df.path / Path(self.FILE_NAME)
+        self._fp = None
+        # lock of the writer (see _lock())
+        self._lock_fp = None
+        # slice files written since the last checkpoint (not fsynced yet)
+        self._dirty = set()
+        self._records = 0
+
+    @property
+    def in_batch(self):
+        return self._fp is not None
+
+    @staticmethod
+    def _crc(record_type, name, offset, data):
+        return zlib.crc32(data, zlib.crc32(name, zlib.crc32(record_type + offset.to_bytes(8, 'little'))))
+
+    def _record(self, record_type, name=b'', offset=0, data=b''):
+        return self.HEADER.pack(record_type, len(name), offset, len(data), self._crc(record_type, name, offset, data)) + name + data
+
+    def begin(self):
+
+        if self._fp is not None:
+            return
+
+        if self._lock_fp is None:
+            self._lock_fp = self._lock()
+            if self._lock_fp is None:
+                self.logger.warning(f'journal {self.df.hash_id}: the journal is locked by another writer')
+
+        new_file = not os.path.isfile(self.path)
+        self._fp = open(str(self.path), 'ab')
+        self._records = 0
+
+        # make the journal itself durable (only once)
+        if new_file:
+            self._fsync_dir()
+
+    def write(self, path, data):
+        # append data to the slice file at path (without fsync) and log it in the journal
+
+        path = Path(path)
+        with open(str(path), 'ab') as fp:
+            offset = fp.tell()
+            fp.write(data)
+
+        self._fp.write(self._record(b'W', path.name.encode(), offset, bytes(data)))
+        self._dirty.add(path)
+        self._records += 1
+
+    def commit(self):
+        # one fsync for all writes since begin()
+
+        if self._fp is None:
+            return
+
+        if self._records:
+            self._fp.write(self._record(b'C'))
+            self._fp.flush()
+            os.fsync(self._fp)
+        size = self._fp.tell()
+        self._fp.close()
+        self._fp = None
+
+        self.logger.debug(f'journal commit {self.df.hash_id}: {self._records} writes, journal size {size}')
+
+        if size > self.MAX_SIZE:
+            self.checkpoint()
+
+    def checkpoint(self):
+        # fsync all written slice files and empty the journal
+
+        if self._fp is not None:
+            self.logger.error(f'journal checkpoint {self.df.hash_id} not possible during a commit')
+            return False
+
+        for path in self._dirty:
+            try:
+                with open(str(path), 'rb') as fp:
+                    os.fsync(fp)
+            # compressed in the meantime (the .bin file was fsynced before it was removed)
+            except FileNotFoundError:
+                pass
+        self._dirty = set()
+
+        self._truncate()
+        return True
+
+    def close(self):
+        self.commit()
+        self.checkpoint()
+
+        if self._lock_fp is not None:
+            self._lock_fp.close()
+            self._lock_fp = None
+
+    def _lock(self):
+        # exclusive lock of the journal (non-blocking), returns the open lock file or None if another writer has it
+
+        lock_fp = open(str(self.df.path / Path(self.LOCK_FILE_NAME)), 'a')
+        if fcntl is None:
+            return lock_fp
+
+        try:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_fp.close()
+            return None
+        return lock_fp
+
+    def replay(self):
+        # apply all committed records to the slice files. Returns the number of replayed writes (None: the journal is
+        # used by a live writer).
+
+        if not os.path.isfile(self.path) or not os.path.getsize(self.path):
+            return 0
+
+        if self._lock_fp is not None:
+            return self._replay()
+
+        if fcntl is None and config.producer_hash != self.df.producer_hash:
+            return None
+        lock_fp = self._lock()
+        if lock_fp is None:
+            self.logger.debug(f'journal replay {self.df.hash_id}: skipped, the df is written by another process')
+            return None
+
+        try:
+            return self._replay()
+        finally:
+            lock_fp.close()
+
+    def _replay(self):
+
+        try:
+            with open(str(self.path), 'rb') as fp:
+                journal = fp.read()
+        except FileNotFoundError:
+            return 0
+
+        if not journal:
+            return 0
+
+        writes = []
+        batch = []
+        pos = 0
+        while pos + self.HEADER.size <= len(journal):
+            record_type, name_len, offset, data_len, crc = self.HEADER.unpack_from(journal, pos)
+            start = pos + self.HEADER.size
+            name = journal[start:start + name_len]
+            data = journal[start + name_len:start + name_len + data_len]
+            # torn record at the end (not committed)
+            if len(data) != data_len or crc != self._crc(record_type, name, offset, data):
+                break
+            pos = start + name_len + data_len
+
+            if record_type == b'W':
+                batch.append((name.decode(), offset, data))
+            elif record_type == b'C':
+                writes += batch
+                batch = []
+
+        if batch:
+            self.logger.warning(f'journal replay {self.df.hash_id}: ignoring {len(batch)} uncommitted writes')
+
+        replayed = set()
+        for i, (name, offset, data) in enumerate(writes):
+            path = self.df.path / Path(name)
+            # already compressed => the data was fsynced before compressing
+            if os.path.isfile(str(path) + '.zst') or os.path.isfile(str(path) + '.gz'):
+                continue
+
+            # the file is shorter than the write (data before it is missing) => the write would leave a gap of zeros.
+            # Stop at the first write which doesn't line up, the file stays as it is
+            size = os.path.getsize(path) if os.path.isfile(path) else 0
+            if size < offset:
+                self.logger.error(f'journal replay {self.df.hash_id}: {name} is shorter ({size}) than the journal offset {offset}, '
+                                  f'replay stopped ({len(writes) - i} writes not replayed)')
+                writes = writes[:i]
+                break
+
+            with open(str(path), 'r+b' if os.path.isfile(path) else 'wb') as fp:
+                fp.seek(offset)
+                fp.write(data)
+            replayed.add(path)
+
+        self._dirty |= replayed
+        self.checkpoint()
+
+        self.logger.info(f'journal replay {self.df.hash_id}: {len(writes)} writes to {len(replayed)} slice files')
+        return len(writes)
+
+    def _truncate(self):
+
+        if not os.path.isfile(self.path):
+            return
+        with open(str(self.path), 'r+b') as fp:
+            fp.truncate(0)
+            fp.flush()
+            os.fsync(fp)
+
+    def _fsync_dir(self):
+
+        # not possible on Windows
+        try:
+            fd = os.open(str(self.path.parent), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
@@ -0,0 +1,121 @@
+import time
+import threading
+import concurrent.futures
+
+from . import config
+
+
+class SlicePipeline():
+    # Runs every slice through a sequence of stages, e.g. compress -> analyse -> upload in df.close(). Every stage has an
+    # own thread pool (bounded concurrency per stage) and a slice moves on to the next stage as soon as its previous
+    # stage is done, so the duration is bounded by the slowest stage instead of the sum of all stages.
+    #
+    # stages: [(name, prepare, apply, workers), ...]
+    #   prepare(sl): called by the thread of run(), returns the work of the stage (a function without arguments which
+    #                runs in the pool of the stage, e.g. file I/O and compression) or None (nothing to do in the pool).
+    #                The work must not change the slice.
+    #   apply(sl, result): called by the thread of run() with the result of the work (None without work), returns the
+    #                result of the stage (apply None: the result of the work is the result of the stage)
+    # So the slice attributes are only changed by the thread of run() (like DataFile.compress(), see
+    # DataSlice.compress()). An exception stops the slice (logged, result: the exception).
+    #
+    # start(sl) / done(sl) of run() are called when a slice enters / leaves the pipeline (e.g. pin it in the slice cache),
+    # done() also for the slices in progress if run() fails
+
+    def __init__(self, stages):
+
+        self.logger = config.logger
+        self.stages = stages
+        # busy time of the work of every stage in seconds (sum over all slices)
+        self.stage_time = {name: 0 for name, prepare, apply, workers in stages}
+        self._lock = threading.Lock()
+
+    def _work(self, i, work):
+
+        name = self.stages[i][0]
+        t = time.monotonic()
+        try:
+            return work()
+        finally:
+            with self._lock:
+                self.stage_time[name] += time.monotonic() - t
+
+    def run(self, slices, start=None, done=None):
+        # returns {slice hash: {stage name: result}}
+
+        t = time.monotonic()
+        results = {sl.hash: {} for sl in slices}
+        executors = [concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) for name, prepare, apply, workers in self.stages]
+        futures = {}
+        started = {}  # id(sl): sl of the slices in progress
+
+        def finish(sl, i, result):
+            # result of stage i, returns False if the slice stops
+
+            name, prepare, apply, workers = self.stages[i]
+            if not isinstance(result, Exception) and apply is not None:
+                try:
+                    result = apply(sl, result)
+                except Exception as e:
+                    result = e
+            if isinstance(result, Exception):
+                self.logger.error(f'{name} of slice {sl.hash_long} failed: {result}')
+            results[sl.hash][name] = result
+            return not isinstance(result, Exception)
+
+        def advance(sl, i):
+            # run the stages from i on until a stage has work for its pool
+
+            while i < len(self.stages):
+                name, prepare, apply, workers = self.stages[i]
+                try:
+                    work = prepare(sl) if prepare is not None else None
+                except Exception as e:
+                    work, result = None, e
+                else:
+                    result = None
+                    if work is not None:
+                        futures[executors[i].submit(self._work, i, work)] = (i, sl)
+                        return
+
+                if not finish(sl, i, result):
+                    break
+                i += 1
+
+            del started[id(sl)]
+            if done is not None:
+                done(sl)
+
+        try:
+            for sl in slices:
+                if start is not None:
+                    start(sl)
+                started[id(sl)] = sl
+                advance(sl, 0)
+
+            while futures:
+                completed, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in completed:
+                    i, sl = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = e
+
+                    if finish(sl, i, result):
+                        advance(sl, i + 1)
+                    else:
+                        del started[id(sl)]
+                        if done is not None:
+                            done(sl)
+
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True)
+            if done is not None:
+                for sl in started.values():
+                    done(sl)
+
+        self.logger.debug(f'pipeline of {len(slices)} slices in {round(time.monotonic() - t, 2)} sec, busy time of the stages: ' +
+                          ', '.join(f'{name} {round(seconds, 2)} sec' for name, seconds in self.stage_time.items()))
+        return results
@@ -0,0 +1,217 @@
+import os
+import struct
+import threading
+import contextlib
+from pathlib import Path
+import numpy as np
+
+# optional: without fcntl (Windows) update() is only locked within the process
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import config
+
+
+class Rollup():
+    # Multi-resolution min/max/mean/count buckets of a column (for overviews without reading the raw slices).
+    #
+    # Every level is a file next to the slices (df.path/<data_type>.rollup_<level>.bin) with a header (number of samples
+    # of the column which are rolled up already, number of closed buckets, the open last bucket) and one record per
+    # closed bucket. update() only reads the samples after this pointer and merges them into the open bucket / appends
+    # the closed buckets, so it is cheap to call it on every final_analyse(). The files can be deleted at any time, they
+    # are rebuilt from the slices with the next update().
+    #
+    # Closed buckets are never overwritten: update() writes the new closed buckets behind the ones of the header, fsync,
+    # then the header, fsync. After a crash in between the next update() overwrites them, so no sample is counted twice.
+    # update() holds a lock file (df.path/<data_type>.rollup.lock) for concurrent updates of other processes / threads.
+    #
+    # bucket: time (start of the bucket in seconds relative to df.date_time_start), count, min, max, sum
+
+    LEVELS = {'1s': 1, '1min': 60, '15min': 900}
+    DTYPE = np.dtype([('time', '<f8'), ('count', '<u4'), ('min', '<f8'), ('max', '<f8'), ('sum', '<f8')])
+    # samples, closed buckets, the open bucket (count 0: none)
+    HEADER = struct.Struct(f'<QQ{DTYPE.itemsize}s')
+    # returned by read()
+    DTYPE_READ = np.dtype([('time', '<f8'), ('count', '<u4'), ('min', '<f8'), ('max', '<f8'), ('mean', '<f8')])
+    # samples read from the slices at once
+    BLOCK_SIZE = 1000000
+    # update() of the process (fallback without fcntl)
+    _lock = threading.Lock()
+
+    def __init__(self, col):
+
+        self.logger = config.logger
+        self.col = col
+
+    def path(self, level):
+        return self.col.df.path / Path(f'{self.col.data_type}.rollup_{level}.bin')
+
+    def _header(self, fp):
+        # (samples, closed buckets, open bucket) of the file
+
+        header = fp.read(self.HEADER.size)
+        if len(header) != self.HEADER.size:
+            return 0, 0, np.zeros(0, dtype=self.DTYPE)
+
+        samples, records, last = self.HEADER.unpack(header)
+        last = np.frombuffer(last, dtype=self.DTYPE)
+        return samples, records, last[last['count'] > 0]
+
+    def samples(self, level):
+        # number of samples rolled up in this level
+
+        try:
+            with open(str(self.path(level)), 'rb') as fp:
+                return self._header(fp)[0]
+        except FileNotFoundError:
+            return 0
+
+    @contextlib.contextmanager
+    def _locked(self):
+
+        if fcntl is None:
+            with self._lock:
+                yield
+            return
+
+        with open(str(self.col.df.path / Path(f'{self.col.data_type}.rollup.lock')), 'a') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def update(self):
+        # roll up all samples which were appended since the last update. Returns the number of new samples.
+
+        if not self.col.df or not self.col.df._hash_id:
+            return 0
+
+        with self._locked():
+            return self._update()
+
+    def _update(self):
+
+        time_col = self.col if self.col.time_slices_ref is None else self.col.df.cols[self.col.time_slices_ref]
+        samples = min(sum(sl.values_count for sl in self.col._slices_y), sum(sl.values_count for sl in time_col._slices_time_rec))
+
+        pointers = {level: self.samples(level) for level in self.LEVELS}
+        sample_start = min(pointers.values())
+        if sample_start >= samples:
+            return 0
+
+        for block_start in range(sample_start, samples, self.BLOCK_SIZE):
+            block_end = min(block_start + self.BLOCK_SIZE, samples)
+            x = self.col._read_samples(time_col._slices_time_rec, block_start, block_end, 'float64')
+            y = self.col._read_samples(self.col._slices_y, block_start, block_end, 'float64')
+
+            for level, seconds in self.LEVELS.items():
+                if pointers[level] >= block_end:
+                    continue
+                i_start = max(pointers[level] - block_start, 0)
+                self._append(level, self.buckets(x[i_start:], y[i_start:], seconds), block_end)
+
+        self.logger.debug(f'rollup {self.col.hash_long}: {samples - sample_start} new samples')
+        return samples - sample_start
+
+    @classmethod
+    def buckets(cls, x, y, seconds):
+        # buckets of the samples (x: time_rec, y: values) sorted by time
+
+        if not len(x):
+            return np.zeros(0, dtype=cls.DTYPE)
+
+        keys = np.floor(np.asarray(x, dtype=np.float64) / seconds)
+        y = np.asarray(y, dtype=np.float64)
+
+        # usual case: time is increasing => contiguous buckets
+        if np.all(keys[1:] >= keys[:-1]):
+            starts = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+            buckets = np.zeros(len(starts), dtype=cls.DTYPE)
+            buckets['time'] = keys[starts] * seconds
+            buckets['count'] = np.diff(np.append(starts, len(keys)))
+            buckets['min'] = np.minimum.reduceat(y, starts)
+            buckets['max'] = np.maximum.reduceat(y, starts)
+            buckets['sum'] = np.add.reduceat(y, starts)
+            return buckets
+
+        unique, inverse = np.unique(keys, return_inverse=True)
+        buckets = np.zeros(len(unique), dtype=cls.DTYPE)
+        buckets['time'] = unique * seconds
+        buckets['count'] = np.bincount(inverse, minlength=len(unique))
+        buckets['min'] = np.inf
+        buckets['max'] = -np.inf
+        mins, maxs = buckets['min'].copy(), buckets['max'].copy()
+        np.minimum.at(mins, inverse, y)
+        np.maximum.at(maxs, inverse, y)
+        buckets['min'], buckets['max'] = mins, maxs
+        buckets['sum'] = np.bincount(inverse, weights=y, minlength=len(unique))
+        return buckets
+
+    @classmethod
+    def merge(cls, buckets):
+        # combine buckets with the same time (sorted by time)
+
+        if not len(buckets) or np.all(buckets['time'][1:] > buckets['time'][:-1]):
+            return buckets
+
+        unique, inverse = np.unique(buckets['time'], return_inverse=True)
+        merged = np.zeros(len(unique), dtype=cls.DTYPE)
+        merged['time'] = unique
+        merged['count'] = np.bincount(inverse, weights=buckets['count'], minlength=len(unique))
+        mins, maxs = np.full(len(unique), np.inf), np.full(len(unique), -np.inf)
+        np.minimum.at(mins, inverse, buckets['min'])
+        np.maximum.at(maxs, inverse, buckets['max'])
+        merged['min'], merged['max'] = mins, maxs
+        merged['sum'] = np.bincount(inverse, weights=buckets['sum'], minlength=len(unique))
+        return merged
+
+    def _append(self, level, buckets, samples):
+        # merge the buckets into the file of level and set its pointer to samples (update() holds the lock)
+
+        path = self.path(level)
+        with open(str(path), 'r+b' if os.path.isfile(path) else 'w+b') as fp:
+
+            _, records, last = self._header(fp)
+
+            # the open bucket might get more samples, the last bucket stays open
+            buckets = self.merge(np.concatenate((last, buckets)))
+            closed, last = buckets[:-1], buckets[-1:]
+
+            # closed buckets first (behind the ones of the header, a crash leaves the file as it was) ...
+            fp.seek(self.HEADER.size + records * self.DTYPE.itemsize)
+            fp.write(closed.tobytes())
+            fp.truncate()
+            fp.flush()
+            os.fsync(fp)
+
+            # ... then the header which commits them
+            fp.seek(0)
+            fp.write(self.HEADER.pack(samples, records + len(closed), last.tobytes() if len(last) else bytes(self.DTYPE.itemsize)))
+            fp.flush()
+            os.fsync(fp)
+
+    def read(self, level, start=None, end=None):
+        # buckets of level which overlap start <= time_rec <= end (None: no limit)
+
+        # header first: the closed buckets of the header are never changed by a running update()
+        try:
+            with open(str(self.path(level)), 'rb') as fp:
+                _, records, last = self._header(fp)
+                buckets = np.frombuffer(fp.read(records * self.DTYPE.itemsize), dtype=self.DTYPE)
+        except FileNotFoundError:
+            records, buckets, last = 0, np.zeros(0, dtype=self.DTYPE), np.zeros(0, dtype=self.DTYPE)
+
+        buckets = self.merge(np.concatenate((buckets[:records], last)))
+        if start is not None:
+            buckets = buckets[buckets['time'] + self.LEVELS[level] > start]
+        if end is not None:
+            buckets = buckets[buckets['time'] <= end]
+
+        result = np.zeros(len(buckets), dtype=self.DTYPE_READ)
+        for field in ('time', 'count', 'min', 'max'):
+            result[field] = buckets[field]
+        result['mean'] = buckets['sum'] / np.maximum(buckets['count'], 1)
+        return result
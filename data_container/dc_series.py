@@ -0,0 +1,169 @@
+import numpy as np
+
+from . import config
+from .dc_helper import DcHelper
+
+
+class ChunkedSeries():
+    # Lazy array over the slices of a column (see DataColumn.series()). Nothing is loaded when it is created:
+    # indexing, iteration and the reductions only read the slices they touch (sl.read_values(), the values are not
+    # kept in memory), so streaming over a multi-gigabyte EEG/ECG column needs the memory of one slice.
+    #
+    #   len(series), series[i], series[1000:2000], series[::10], series[[1, 5, 7]], series[mask]
+    #   for values in series.iter_slices(): ...     values of one slice after the other
+    #   np.asarray(series)                           materializes all values (like col.y)
+    #   series.min(), max(), sum(), mean()           computed slice by slice (None for an empty series)
+    #
+    # The length is fixed when the series is created (values appended later are not part of it).
+
+    def __init__(self, slices, dtype):
+
+        self.logger = config.logger
+        self._slices = list(slices)
+        self.dtype = np.dtype(dtype)
+        # index of the first sample of every slice (+ total number of samples)
+        self._offsets = np.concatenate(([0], np.cumsum([sl.values_count for sl in self._slices], dtype=np.int64)))
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def __str__(self):
+        return f'ChunkedSeries(samples={len(self)}, slices={len(self._slices)}, dtype={self.dtype.name})'
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    @property
+    def slices(self):
+        return len(self._slices)
+
+    def _read(self, i, i_end=None):
+        # values of slice i (up to i_end)
+
+        sl = self._slices[i]
+        count = int(self._offsets[i + 1] - self._offsets[i]) if i_end is None else i_end
+        values = np.asarray(sl.read_values(count)[:count])
+        # loaded values are returned as view => must not be changed
+        if sl._values is not None:
+            values = values.view()
+            values.flags.writeable = False
+        return values
+
+    def _read_range(self, start, stop, step=1):
+        # values start:stop:step (step > 0) of the slices between start and stop
+
+        arrays = []
+        first = int(np.searchsorted(self._offsets, start, side='right')) - 1
+
+        for i in range(max(first, 0), len(self._slices)):
+            offset = int(self._offsets[i])
+            if offset >= stop:
+                break
+            end = int(self._offsets[i + 1])
+            if end <= start:
+                continue
+
+            # first sample of the step grid in this slice
+            if offset < start:
+                i_start = start - offset
+            else:
+                i_start = (start - offset) % step
+            i_end = min(stop, end) - offset
+            if i_start < i_end:
+                arrays.append(self._read(i, i_end)[i_start:i_end:step])
+
+        return self._concatenate(arrays)
+
+    def _concatenate(self, arrays):
+
+        size = sum(len(array) for array in arrays)
+        return DcHelper.concatenate_arrays(arrays, size, self.dtype)
+
+    def __getitem__(self, key):
+
+        if isinstance(key, (int, np.integer)):
+            index = int(key)
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError(f'ChunkedSeries index {key} out of range ({len(self)} samples)')
+            i = int(np.searchsorted(self._offsets, index, side='right')) - 1
+            local = index - int(self._offsets[i])
+            return self._read(i, local + 1)[local].astype(self.dtype)
+
+        if isinstance(key, slice):
+            indices = range(*key.indices(len(self)))
+            if not len(indices):
+                return np.asarray([], dtype=self.dtype)
+            if indices.step > 0:
+                return self._read_range(indices.start, indices.stop, indices.step)
+            # negative step: read the same samples forwards and reverse them
+            indices = indices[::-1]
+            return self._read_range(indices.start, indices.stop, indices.step)[::-1]
+
+        return self._take(key)
+
+    def _take(self, key):
+        # fancy indexing (integer arrays or a boolean mask), every slice is read once
+
+        key = np.asarray(key)
+        if key.dtype == bool:
+            if key.shape != (len(self),):
+                raise IndexError(f'ChunkedSeries boolean index of shape {key.shape} does not match {len(self)} samples')
+            indices = np.flatnonzero(key)
+        elif np.issubdtype(key.dtype, np.integer) or not len(key):
+            indices = key.astype(np.int64).ravel()
+        else:
+            raise IndexError(f'ChunkedSeries cannot be indexed with {key.dtype}')
+
+        indices = np.where(indices < 0, indices + len(self), indices)
+        if len(indices) and (indices.min() < 0 or indices.max() >= len(self)):
+            raise IndexError(f'ChunkedSeries index out of range ({len(self)} samples)')
+
+        out = np.empty(len(indices), dtype=self.dtype)
+        slice_indices = np.searchsorted(self._offsets, indices, side='right') - 1
+        for i in np.unique(slice_indices):
+            positions = np.flatnonzero(slice_indices == i)
+            local = indices[positions] - self._offsets[i]
+            out[positions] = self._read(int(i), int(local.max()) + 1)[local]
+
+        return out.reshape(key.shape) if key.dtype != bool else out
+
+    def iter_slices(self):
+        # the values of one slice after the other (as numpy arrays)
+
+        for i in range(len(self._slices)):
+            if self._offsets[i + 1] > self._offsets[i]:
+                yield self._read(i).astype(self.dtype, copy=False)
+
+    def __iter__(self):
+        for values in self.iter_slices():
+            yield from values
+
+    def __array__(self, dtype=None, copy=None):
+
+        values = self._concatenate(list(self.iter_slices()))
+        return values if dtype is None else values.astype(dtype)
+
+    def _reduce(self, function):
+        # function of the values of every slice (None for empty series)
+
+        results = [function(values) for values in self.iter_slices()]
+        return results if results else None
+
+    def min(self):
+        results = self._reduce(np.min)
+        return None if results is None else min(results).item()
+
+    def max(self):
+        results = self._reduce(np.max)
+        return None if results is None else max(results).item()
+
+    def sum(self):
+        results = self._reduce(lambda values: values.sum(dtype=np.float64))
+        return None if results is None else float(np.sum(results))
+
+    def mean(self):
+        total = self.sum()
+        return None if total is None else total / len(self)
@@ -0,0 +1,106 @@
+import numpy as np
+
+
+class QuantileSketch():
+    # Mergeable quantile summary of the y values of a slice (see DataSlice.final_analyse()).
+    #
+    # The sketch is a sorted list of points (value, weight). Up to MAX_POINTS samples every sample is a point with
+    # weight 1, i.e. the quantiles are exact and the same as indexing the sorted values (like the column statistics did
+    # before). Bigger sketches are compressed to MAX_POINTS points of equal weight at equally spaced ranks, so the rank
+    # error of a quantile is about 1 / MAX_POINTS per compression.
+    #
+    # Merging the sketches of all slices (DataColumn.final_analyse()) costs O(slices * MAX_POINTS) instead of sorting
+    # all values of a recording.
+    #
+    # Error bound: a compressed point stands for total / MAX_POINTS samples, so the rank of a quantile is off by at most
+    # 1 / MAX_POINTS of the samples per compression. Merging sketches keeps the (weighted) error of its inputs, so the
+    # column quantiles (compression of the slices + compression of the merge) have a rank error <= 2 / MAX_POINTS and
+    # are exact as long as the column has at most MAX_POINTS samples.
+    #
+    # Stored as sketch_values / sketch_weights of the slices: weights [] (exact) or [weight] (compressed, all points
+    # have the same weight).
+
+    MAX_POINTS = 1024
+
+    def __init__(self, values=None, weights=None):
+
+        self.values = np.asarray(values if values is not None else [], dtype=np.float64)
+        self.weights = np.asarray(weights if weights is not None else np.ones(len(self.values)), dtype=np.float64)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __str__(self):
+        return f'QuantileSketch(points={len(self)}, count={self.count}, exact={self.exact})'
+
+    @property
+    def count(self):
+        return int(round(self.weights.sum()))
+
+    @property
+    def exact(self):
+        return bool(np.all(self.weights == 1))
+
+    @classmethod
+    def from_values(cls, values):
+
+        sketch = cls(np.sort(np.asarray(values, dtype=np.float64)))
+        sketch._compress()
+        return sketch
+
+    @classmethod
+    def from_lists(cls, values, weights):
+        # stored sketch (see to_lists()), no weights: all weights are 1, one weight: the weight of all points
+
+        if not weights:
+            return cls(values)
+        if len(weights) == 1:
+            return cls(values, np.full(len(values), weights[0]))
+        return cls(values, weights)
+
+    @classmethod
+    def merge(cls, sketches):
+
+        sketches = [sketch for sketch in sketches if len(sketch)]
+        if not sketches:
+            return cls()
+
+        values = np.concatenate([sketch.values for sketch in sketches])
+        weights = np.concatenate([sketch.weights for sketch in sketches])
+        order = np.argsort(values, kind='stable')
+
+        sketch = cls(values[order], weights[order])
+        sketch._compress()
+        return sketch
+
+    def to_lists(self):
+        # (values, weights) as Python lists for the database (weights are omitted for exact sketches, one weight if all
+        # points have the same weight)
+
+        if self.exact:
+            return self.values.tolist(), []
+        if len(self) and np.all(self.weights == self.weights[0]):
+            return self.values.tolist(), [float(self.weights[0])]
+        return self.values.tolist(), self.weights.tolist()
+
+    def _compress(self):
+
+        if len(self) <= self.MAX_POINTS:
+            return
+
+        total = self.weights.sum()
+        ranks = (np.arange(self.MAX_POINTS) + 0.5) * total / self.MAX_POINTS
+        indices = np.searchsorted(np.cumsum(self.weights), ranks, side='right')
+
+        self.values = self.values[np.minimum(indices, len(self) - 1)]
+        self.weights = np.full(self.MAX_POINTS, total / self.MAX_POINTS)
+
+    def quantile(self, q):
+        # value at rank int(count * q) of the sorted values (None for an empty sketch)
+
+        if not len(self):
+            return None
+
+        rank = int(self.weights.sum() * q)
+        index = int(np.searchsorted(np.cumsum(self.weights), rank, side='right'))
+        return float(self.values[min(index, len(self) - 1)])
@@ -0,0 +1,216 @@
+import threading
+import weakref
+from collections import OrderedDict
+
+from . import config
+
+
+class SliceCache():
+    # Process wide cache of the decoded values of all DataSlices (of all DataFiles), keyed by the slice object (id(sl)):
+    # two loaded instances of the same DataFile have own values, both are counted.
+    #
+    # The values stay referenced by the slice (sl._values) but the cache decides how long: if the total size of all
+    # loaded values exceeds max_size (bytes), the least recently used slices are freed (sl._values = None) and lazy
+    # loaded again on the next access of sl.values.
+    # Slices which are still being written are pinned and never freed:
+    #   - values which are not yet written to the hard drive (len(sl._values) > sl.values_write_pointer)
+    #   - slices which are not full yet (unless the df is closed)
+    #   - slices pinned explicitly with pin()
+
+    def __init__(self, max_size=None):
+
+        self.logger = config.logger
+        self._max_size = max_size
+        # key -> weakref of the slice (the cache must not keep DataFiles alive)
+        self._slices = OrderedDict()
+        # key -> size in bytes
+        self._sizes = {}
+        self._size = 0
+        self._pinned = set()
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_size(self):
+        # None: no limit (nothing is freed by the cache)
+        if self._max_size is not None:
+            return self._max_size
+        return config.slice_cache_max_size
+
+    @max_size.setter
+    def max_size(self, max_size):
+        with self._lock:
+            self._max_size = max_size
+            self._evict()
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._slices)
+
+    def __str__(self):
+        return f'SliceCache(slices={len(self)}, size={self.size}, max_size={self.max_size}, hits={self.hits}, misses={self.misses}, evictions={self.evictions})'
+
+    @staticmethod
+    def _key(sl):
+        return id(sl)
+
+    def _entry(self, sl):
+        # key of a slice which is in the cache (None: not managed by the cache)
+
+        key = sl._cache_key
+        if key is None:
+            return None
+        # the id of a slice which does not exist anymore might be reused
+        ref = self._slices.get(key)
+        if ref is None or ref() is not sl:
+            return None
+        return key
+
+    @staticmethod
+    def _values_size(sl):
+        if sl._values is None:
+            return 0
+        # ValuesBuffer or list
+        return getattr(sl._values, 'nbytes', len(sl._values) * sl.dtype_size)
+
+    def stats(self):
+
+        return {
+            'slices': len(self),
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def reset_stats(self):
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def add(self, sl):
+        # register slice values which were just loaded (or created)
+
+        with self._lock:
+            self.misses += 1
+            key = self._key(sl)
+            # pinned slice which does not exist anymore with the same id
+            if key in self._slices and self._slices[key]() is None:
+                self._pinned.discard(key)
+            sl._cache_key = key
+            self._slices[key] = weakref.ref(sl)
+            self._slices.move_to_end(key)
+            self._update_size(key, sl)
+            self._evict(current=sl)
+
+    def touch(self, sl):
+        # access of already loaded values: mark as most recently used and update the size (values may have been appended)
+
+        # slices with values which were not set via sl.values (e.g. in tests) are not managed by the cache
+        if sl._cache_key is None:
+            return
+
+        with self._lock:
+            key = self._entry(sl)
+            if key is None:
+                return
+            self.hits += 1
+            self._slices.move_to_end(key)
+            # nothing to free if the values did not grow (e.g. reading)
+            if self._update_size(key, sl) > 0:
+                self._evict(current=sl)
+
+    def remove(self, sl):
+
+        if sl._cache_key is None:
+            return
+
+        with self._lock:
+            key = self._entry(sl)
+            if key is not None:
+                self._remove_key(key)
+                self._pinned.discard(key)
+            sl._cache_key = None
+
+    def pin(self, sl):
+        # never free the values of this slice (until unpin() is called)
+        with self._lock:
+            self._pinned.add(self._key(sl))
+
+    def unpin(self, sl):
+        with self._lock:
+            self._pinned.discard(self._key(sl))
+            self._evict()
+
+    def clear(self):
+        # free the values of all slices which are not pinned
+
+        with self._lock:
+            self._evict(max_size=0)
+
+    def _update_size(self, key, sl):
+
+        # returns the growth in bytes
+
+        size = self._values_size(sl)
+        growth = size - self._sizes.get(key, 0)
+        self._size += growth
+        self._sizes[key] = size
+        return growth
+
+    def _remove_key(self, key):
+
+        self._slices.pop(key, None)
+        self._size -= self._sizes.pop(key, 0)
+
+    def _is_pinned(self, key, sl):
+
+        if key in self._pinned:
+            return True
+        # not yet written to the hard drive
+        if len(sl._values) > sl.values_write_pointer:
+            return True
+        # still being filled
+        if not sl.status_slice_full and not sl.df.status_closed:
+            return True
+
+        return False
+
+    def _evict(self, current=None, max_size=None):
+        # free least recently used values until the cache fits into max_size again
+
+        if max_size is None:
+            max_size = self.max_size
+        if max_size is None or self._size <= max_size:
+            return
+
+        for key in list(self._slices):
+
+            if self._size <= max_size:
+                break
+
+            sl = self._slices[key]()
+
+            # slice (or its DataFile) does not exist anymore (its id might be reused by a new slice)
+            if sl is None or sl._values is None:
+                self._remove_key(key)
+                if sl is None:
+                    self._pinned.discard(key)
+                continue
+
+            if sl is current or self._is_pinned(key, sl):
+                continue
+
+            self._remove_key(key)
+            sl._values = None
+            sl._cache_key = None
+            sl._drop_shared_x()
+            self.evictions += 1
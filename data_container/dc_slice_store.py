@@ -0,0 +1,120 @@
+import time
+from mongoengine.queryset import QuerySet
+
+from . import config
+from .document_tweak import AppendListField
+
+
+class SliceListField(AppendListField):
+    # slice list of a DataColumn. The slices of columns with slices_external are fetched from the SliceStore with the
+    # first access (see DataColumn._fetch_slices())
+
+    def __get__(self, instance, owner):
+
+        if instance is not None and getattr(instance, '_slices_pending', False):
+            instance._fetch_slices()
+        return super(SliceListField, self).__get__(instance, owner)
+
+
+class DataFileQuerySet(QuerySet):
+    # queryset of DataFile: deleting DataFiles (df.delete(), DataFile.objects(...).delete()) deletes their slices in the
+    # SliceStore as well
+
+    def delete(self, *args, **kwargs):
+
+        hash_ids = list(self.clone().scalar('_hash_id'))
+        deleted = super(DataFileQuerySet, self).delete(*args, **kwargs)
+
+        # after the df documents, they must not point to missing slices
+        if hash_ids:
+            self._document._get_db()[SliceStore.COLLECTION].delete_many({'df': {'$in': hash_ids}})
+        return deleted
+
+
+class SliceStore():
+    # Slice metadata of the columns with slices_external (config.slice_collection) in an own collection instead of the
+    # lists cols.<data_type>.s_y / s_tr of the DataFile document. Multi-day raw recordings with thousands of slices don't
+    # grow the DataFile document towards the 16 MB limit of MongoDB and loading a DataFile only deserializes the slices
+    # of the columns which are used.
+    #
+    # one document per slice: the fields of DataSlice with _id "<df hash_id>/<slice hash>", df and pos (index in the
+    # slice list of the column), indexed by (df, d_ty, sl_t, sto)
+
+    COLLECTION = 'data_slice'
+    INDEX = [('df', 1), ('d_ty', 1), ('sl_t', 1), ('sto', 1)]
+    # databases with the index (created once per process)
+    _indexed = set()
+
+    def __init__(self, df):
+
+        self.logger = config.logger
+        self.df = df
+
+    @property
+    def collection(self):
+
+        db = self.df._get_db()
+        collection = db[self.COLLECTION]
+        if db.name not in SliceStore._indexed:
+            collection.create_index(self.INDEX)
+            SliceStore._indexed.add(db.name)
+        return collection
+
+    def _id(self, sl_hash):
+        return f'{self.df.hash_id}/{sl_hash}'
+
+    def load(self, col):
+        # {slice_type: [DataSlice]} of the column (not initiated yet)
+
+        DataSlice = col._fields['_slices_y'].field.document_type
+        slices = {'y': [], 'time_rec': []}
+
+        docs = self.collection.find({'df': self.df.hash_id, 'd_ty': col.data_type})
+        for doc in sorted(docs, key=lambda doc: doc['pos']):
+            doc_id = doc['_id']
+            son = {key: value for key, value in doc.items() if key not in ('df', 'pos')}
+            son['_id'] = doc_id.split('/', 1)[1]
+            sl = DataSlice._from_son(son)
+            slices[sl.slice_type].append(sl)
+            self.df._slice_store_ids.add(doc_id)
+
+        return slices
+
+    def save(self):
+        # upsert the slices of the external columns which are new or changed since they were loaded / saved
+
+        docs = {}
+        for col in self.df.cols.values():
+            if not col.slices_external or col._slices_pending:
+                continue
+
+            for slices in (col._slices_y, col._slices_time_rec):
+                for pos, sl in enumerate(slices):
+                    doc_id = self._id(sl.hash)
+                    # only the dirty slices are serialized (usually the last slices of the columns)
+                    if doc_id in self.df._slice_store_ids and not sl._get_changed_fields():
+                        continue
+                    doc = sl.to_mongo()
+                    doc['_id'] = doc_id
+                    doc['df'] = self.df.hash_id
+                    doc['pos'] = pos
+                    docs[doc_id] = (sl, doc)
+
+        if not docs:
+            return 0
+
+        time_start = time.perf_counter()
+        collection = self.collection
+        for doc_id, (sl, doc) in docs.items():
+            collection.replace_one({'_id': doc_id}, doc, upsert=True)
+            self.df._slice_store_ids.add(doc_id)
+            sl._clear_changed_fields()
+        self.logger.debug(f'SliceStore {self.df.hash_id}: {len(docs)} slices saved in {(time.perf_counter() - time_start) * 1000:.1f} ms')
+
+        return len(docs)
+
+    def data_type(self, sl_hash):
+        # data_type of a stored slice (None: unknown hash)
+
+        doc = self.collection.find_one({'_id': self._id(sl_hash)}, {'d_ty': 1})
+        return doc['d_ty'] if doc else None
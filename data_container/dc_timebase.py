@@ -0,0 +1,225 @@
+import struct
+import numpy as np
+
+from . import config
+
+
+class Timebase():
+    # Piecewise regular time_rec values: segments (start, sampling rate, count) + exceptions.
+    #
+    # The sensors sample with an (almost) constant rate, i.e. within a segment time_rec[i] = start + i / rate. A new
+    # segment starts at gaps, at rate changes and where the time is not increasing. Samples which are not exactly (bit
+    # by bit) on the grid of their segment (jitter, rounding) are stored as exceptions (index, value) => lossless.
+    #
+    # A 200 Hz time_rec slice of 360000 float64 values (2.88 MB) typically becomes a few segments and exceptions, and
+    # value(), first_index() and last_index() need O(segments) without materializing the values.
+    #
+    # binary format (see to_bytes(), little endian):
+    #   header: flags (uint8, 1: monotonic), number of segments (uint32), number of exceptions (uint32)
+    #   segments: start (float64), rate (float64), count (uint32)
+    #   exception indices (uint32), exception values (dtype)
+
+    HEADER = struct.Struct('<BII')
+    SEGMENT_DTYPE = np.dtype([('start', '<f8'), ('rate', '<f8'), ('count', '<u4')])
+    FLAG_MONOTONIC = 1
+    # relative deviation of the sample interval which starts a new segment (bigger deviations are gaps)
+    MAX_JITTER = 0.5
+
+    def __init__(self, dtype='float64', segments=None, exception_indices=None, exception_values=None, monotonic=True):
+
+        self.logger = config.logger
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.segments = segments if segments is not None else np.zeros(0, dtype=self.SEGMENT_DTYPE)
+        self.exception_indices = exception_indices if exception_indices is not None else np.zeros(0, dtype='<u4')
+        self.exception_values = exception_values if exception_values is not None else np.zeros(0, dtype=self.dtype)
+        self.monotonic = monotonic
+        # index of the first sample of every segment (+ total number of samples)
+        self._offsets = np.concatenate(([0], np.cumsum(self.segments['count'], dtype=np.int64)))
+        self._lasts = None
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def __str__(self):
+        return f'Timebase(samples={len(self)}, segments={len(self.segments)}, exceptions={len(self.exception_indices)}, dtype={self.dtype.name})'
+
+    @classmethod
+    def from_array(cls, values, dtype='float64'):
+
+        dtype = np.dtype(dtype).newbyteorder('<')
+        values = np.asarray(values, dtype=dtype)
+        if not len(values):
+            return cls(dtype)
+
+        diffs = np.diff(values.astype(np.float64))
+        positive = diffs[diffs > 0]
+        step = np.median(positive) if len(positive) else 0
+
+        # segment boundaries: gaps, rate changes, time not increasing
+        if step > 0:
+            breaks = np.flatnonzero((diffs < step * (1 - cls.MAX_JITTER)) | (diffs > step * (1 + cls.MAX_JITTER))) + 1
+        else:
+            breaks = np.arange(1, len(values))
+        bounds = np.concatenate(([0], breaks, [len(values)]))
+
+        segments = np.zeros(len(bounds) - 1, dtype=cls.SEGMENT_DTYPE)
+        exception_indices = []
+        for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+
+            segment_values = values[start:end]
+            rate = cls._fit_rate(segment_values, dtype)
+            segments[i] = (segment_values[0], rate, end - start)
+
+            grid = cls._grid(segment_values[0], rate, end - start, dtype)
+            # compare the bit patterns (-0.0, nan, ...)
+            mismatch = np.flatnonzero(grid.view(f'<u{dtype.itemsize}') != segment_values.view(f'<u{dtype.itemsize}'))
+            if len(mismatch):
+                exception_indices.append(mismatch + start)
+
+        exception_indices = np.concatenate(exception_indices).astype('<u4') if exception_indices else np.zeros(0, dtype='<u4')
+
+        return cls(dtype, segments, exception_indices, values[exception_indices], monotonic=bool(np.all(diffs >= 0)))
+
+    @classmethod
+    def from_bytes(cls, bin_data, dtype='float64'):
+
+        dtype = np.dtype(dtype).newbyteorder('<')
+        flags, n_segments, n_exceptions = cls.HEADER.unpack_from(bin_data)
+
+        pos = cls.HEADER.size
+        segments = np.frombuffer(bin_data, dtype=cls.SEGMENT_DTYPE, count=n_segments, offset=pos)
+        pos += segments.nbytes
+        exception_indices = np.frombuffer(bin_data, dtype='<u4', count=n_exceptions, offset=pos)
+        pos += exception_indices.nbytes
+        exception_values = np.frombuffer(bin_data, dtype=dtype, count=n_exceptions, offset=pos)
+        if pos + exception_values.nbytes != len(bin_data):
+            raise ValueError(f'timebase: {len(bin_data)} bytes do not match {n_segments} segments and {n_exceptions} exceptions')
+
+        return cls(dtype, segments, exception_indices, exception_values, monotonic=bool(flags & cls.FLAG_MONOTONIC))
+
+    @classmethod
+    def concatenate(cls, timebases, dtype='float64'):
+        # one timebase of consecutive timebases (e.g. of all time_rec slices of a column)
+
+        timebases = [tb for tb in timebases if len(tb)]
+        if not timebases:
+            return cls(dtype)
+
+        offsets = np.cumsum([0] + [len(tb) for tb in timebases[:-1]])
+        monotonic = all(tb.monotonic for tb in timebases)
+        monotonic = monotonic and all(previous.value(len(previous) - 1) <= tb.value(0) for previous, tb in zip(timebases[:-1], timebases[1:]))
+
+        return cls(timebases[0].dtype,
+                   np.concatenate([tb.segments for tb in timebases]),
+                   np.concatenate([tb.exception_indices.astype(np.int64) + offset for offset, tb in zip(offsets, timebases)]).astype('<u4'),
+                   np.concatenate([tb.exception_values for tb in timebases]).astype(timebases[0].dtype),
+                   monotonic=monotonic)
+
+    @staticmethod
+    def _grid(start, rate, count, dtype):
+        # the values of a segment without exceptions (rate 0: single sample or constant time)
+        if rate == 0:
+            return np.full(count, start, dtype=np.float64).astype(dtype)
+        return (np.float64(start) + np.arange(count, dtype=np.float64) / np.float64(rate)).astype(dtype)
+
+    @staticmethod
+    def _grid_value(start, rate, index, dtype):
+        # single value of _grid() (same floating point operations => same result)
+        if rate == 0:
+            return np.asarray(start, dtype=np.float64).astype(dtype)
+        return np.asarray(np.float64(start) + np.float64(index) / np.float64(rate)).astype(dtype)
+
+    @staticmethod
+    def _fit_rate(values, dtype):
+        # sampling rate with the least exceptions (the timestamps are often calculated with a rounded rate)
+
+        if len(values) < 2 or values[-1] == values[0]:
+            return 0.0
+
+        rate = (len(values) - 1) / (float(values[-1]) - float(values[0]))
+        if not np.isfinite(rate):
+            return 0.0
+        candidates = [candidate for candidate in (rate, round(rate, 6), float(round(rate))) if candidate]
+
+        best_rate, best_mismatches = rate, None
+        for candidate in candidates:
+            mismatches = np.count_nonzero(Timebase._grid(values[0], candidate, len(values), dtype) != values)
+            if best_mismatches is None or mismatches < best_mismatches:
+                best_rate, best_mismatches = candidate, mismatches
+
+        return best_rate
+
+    def to_bytes(self):
+
+        flags = self.FLAG_MONOTONIC if self.monotonic else 0
+        return (self.HEADER.pack(flags, len(self.segments), len(self.exception_indices)) + self.segments.astype(self.SEGMENT_DTYPE).tobytes() +
+                self.exception_indices.astype('<u4').tobytes() + self.exception_values.astype(self.dtype).tobytes())
+
+    def materialize(self):
+        # all values as numpy array
+
+        values = np.empty(len(self), dtype=self.dtype)
+        for (start, rate, count), offset in zip(self.segments, self._offsets):
+            values[offset:offset + count] = self._grid(start, rate, count, self.dtype)
+        values[self.exception_indices] = self.exception_values
+        return values
+
+    def value(self, index):
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f'timebase index {index} out of range ({len(self)} samples)')
+
+        i = np.searchsorted(self.exception_indices, index)
+        if i < len(self.exception_indices) and self.exception_indices[i] == index:
+            return float(self.exception_values[i])
+
+        segment = int(np.searchsorted(self._offsets, index, side='right')) - 1
+        start, rate, _ = self.segments[segment]
+        return float(self._grid_value(start, rate, index - self._offsets[segment], self.dtype))
+
+    def first_index(self, value):
+        # index of the first sample >= value (len(self) if there is none)
+
+        if not self.monotonic:
+            indices = np.flatnonzero(self.materialize() >= value)
+            return int(indices[0]) if len(indices) else len(self)
+
+        return self._search(value, side='left')
+
+    def last_index(self, value):
+        # index after the last sample <= value (0 if there is none)
+
+        if not self.monotonic:
+            indices = np.flatnonzero(self.materialize() <= value)
+            return int(indices[-1]) + 1 if len(indices) else 0
+
+        return self._search(value, side='right')
+
+    def _search(self, value, side):
+        # like np.searchsorted(self.materialize(), value, side) for monotonic values
+
+        if self._lasts is None:
+            self._lasts = np.asarray([self.value(int(offset) - 1) for offset in self._offsets[1:]])
+
+        segment = int(np.searchsorted(self._lasts, value, side=side))
+        if segment == len(self.segments):
+            return len(self)
+
+        start, rate, count = self.segments[segment]
+        offset = int(self._offsets[segment])
+
+        def before(index):
+            # sample index is left of the insertion point
+            sample = self.value(offset + index)
+            return sample < value if side == 'left' else sample <= value
+
+        # estimate from the sampling rate and correct the jitter
+        index = int(np.clip(np.ceil((value - start) * rate), 0, count)) if rate else 0
+        while index > 0 and not before(index - 1):
+            index -= 1
+        while index < count and before(index):
+            index += 1
+
+        return offset + index
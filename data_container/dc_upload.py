@@ -0,0 +1,139 @@
+import time
+import queue
+import threading
+import concurrent.futures
+import requests
+
+from . import config
+
+
+class UploadScheduler():
+    # Uploads single slices to the server (df.send() and df.close(send=True)) instead of whole columns, so one raw column
+    # with many slices is spread over all workers. Every worker thread has an own requests.Session, i.e. a keep-alive
+    # connection to the server which is reused for all slices of this worker.
+    #
+    # The slices are uploaded by priority: data types with send_json (vitals) before the raw data, then by
+    # slice_time_offset. upload() returns a result per slice (also collected in results), report() sums them up.
+
+    def __init__(self, df, num_workers=3, partially=False):
+
+        self.logger = config.logger
+        self.df = df
+        self.num_workers = max(num_workers or 1, 1)
+        self.partially = partially
+        self.results = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sessions = []
+        self._time_start = None
+        self._time_end = None
+
+    @staticmethod
+    def priority(sl):
+        # vitals first (lower is earlier)
+
+        vitals = config.data_types_dict.get(sl.data_type, {}).get('send_json', False)
+        return (0 if vitals else 1, sl.slice_time_offset or 0)
+
+    def ready(self, sl):
+        # slices which sl.send() would upload (not sent yet, full or df closed, not compressed when sending partially)
+
+        if sl.status_sent_server:
+            return False
+        if self.partially:
+            return not sl.status_compressed
+        return self.df.status_closed or sl.check_and_set_status_slice_full()
+
+    @property
+    def session(self):
+        # session of the current worker thread
+
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+            with self._lock:
+                self._sessions.append(self._local.session)
+        return self._local.session
+
+    def upload(self, sl):
+        # upload one slice, returns its result (None: not ready)
+
+        if not self.ready(sl):
+            return None
+
+        with self._lock:
+            if self._time_start is None:
+                self._time_start = time.monotonic()
+
+        t = time.monotonic()
+        send_pointer = sl.values_send_pointer
+        result = {'hash_long': sl.hash_long, 'data_type': sl.data_type, 'slice_type': sl.slice_type, 'success': False,
+                  'bytes': 0, 'seconds': 0, 'error': None}
+
+        try:
+            result['success'] = sl.send(self.session, self.partially) is not False
+            if result['success']:
+                if self.partially:
+                    result['bytes'] = sl.values_send_pointer - send_pointer
+                elif sl.status_sent_server:
+                    result['bytes'] = sl.compressed_size
+        except Exception as e:
+            self.logger.error(f'upload of slice {sl.hash_long} failed: {e}')
+            result['error'] = str(e)
+
+        result['seconds'] = time.monotonic() - t
+        with self._lock:
+            self.results.append(result)
+            self._time_end = time.monotonic()
+
+        return result
+
+    def run(self, slices):
+        # upload the slices which are ready, returns the results
+
+        tasks = queue.PriorityQueue()
+        for i, sl in enumerate(slices):
+            if self.ready(sl):
+                tasks.put((self.priority(sl), i, sl))
+
+        def worker():
+            while True:
+                try:
+                    _, _, sl = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                self.upload(sl)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [executor.submit(worker) for _ in range(min(self.num_workers, tasks.qsize()))]
+            for future in concurrent.futures.as_completed(futures):
+                # upload() catches the errors of the slices => only unexpected errors of the worker
+                if future.exception():
+                    self.logger.error(f'upload worker of {self.df.hash_id} failed: {future.exception()}')
+
+        self.close()
+        self.logger.debug(f'upload {self.df.hash_id}: {self.report()}')
+        return self.results
+
+    def close(self):
+        # close the connections of the workers
+
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+
+    def report(self):
+        # aggregated results: slices, successful / failed slices, bytes, seconds and throughput (bytes/s)
+
+        with self._lock:
+            results = list(self.results)
+            seconds = self._time_end - self._time_start if results else 0
+
+        uploaded = sum(result['bytes'] for result in results)
+        successful = sum(1 for result in results if result['success'])
+        return {'slices': len(results),
+                'successful': successful,
+                'failed': len(results) - successful,
+                'bytes': uploaded,
+                'seconds': round(seconds, 3),
+                'throughput': round(uploaded / seconds, 1) if seconds > 0 else None}
@@ -0,0 +1,222 @@
+import threading
+import functools
+from collections import deque
+import numpy as np
+
+from . import config
+
+
+def df_locked(method=None, prepare=None):
+    # DataFile methods which change the df run under df._lock. With a BackgroundWriter they don't wait for a running
+    # store() but are queued (see BackgroundWriter.run_or_defer()).
+    #
+    # prepare: name of a df method which checks the arguments before the call is queued (without df._lock). It returns
+    # the result of method for invalid arguments or the checked (args, kwargs) to queue. Without prepare the arguments
+    # are queued as copies.
+
+    if method is None:
+        return functools.partial(df_locked, prepare=prepare)
+
+    @functools.wraps(method)
+    def wrapper(df, *args, **kwargs):
+        if df._writer is not None and not df._writer.active:
+            return df._writer.run_or_defer(method, df, args, kwargs, getattr(df, prepare) if prepare else None)
+        with df._lock:
+            return method(df, *args, **kwargs)
+
+    return wrapper
+
+
+class BackgroundWriter():
+    # Owned writer thread of a DataFile (see df.start_background_writer()): df.store() only requests a store and returns
+    # immediately, the writer thread does the store (write_bin, final_analyse, save_changes) under df._lock.
+    #
+    # Store requests are coalesced: while a store is running, all new requests become one pending store (with
+    # final_analyse if any of them wanted it). Appends (append_value(s), append_binary, write_appended_binaries) never
+    # wait for the database: while the writer holds df._lock they are queued and applied in order by the next thread
+    # which gets the lock. The queue is bounded by max_pending, then the appending thread waits for the lock. Queued
+    # calls get copies of their arguments, append_values() checks the batch before it is queued and returns the result.
+    # A queued call which fails has returned already: its exception is raised by the next df.wait() / flush() /
+    # stop_background_writer().
+    #
+    #   ticket = df.store()     request a store
+    #   df.wait(ticket)         until this store (or a later one) is done
+    #   df.flush()              request a store and wait for it (durability point)
+
+    def __init__(self, df, max_pending=10000):
+
+        self.logger = config.logger
+        self.df = df
+        self.max_pending = max_pending
+        self._lock = df._lock
+        self._condition = threading.Condition()
+        self._local = threading.local()
+        # queued appends: (method, args, kwargs)
+        self._pending = deque()
+        # store requests: last requested and last done ticket, final_analyse of the pending store (None: no request)
+        self._ticket_requested = 0
+        self._ticket_done = 0
+        self._final_analyse = None
+        # exception of the last store (None: successful)
+        self._error = None
+        # exception of the first queued call which failed since the last check() (None: all successful)
+        self._append_error = None
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='df_background_writer', daemon=True)
+
+    def __str__(self):
+        return f'BackgroundWriter(df={self.df.hash_id}, requested={self._ticket_requested}, done={self._ticket_done}, pending={len(self._pending)})'
+
+    def start(self):
+        self._thread.start()
+
+    @property
+    def active(self):
+        # the current thread holds df._lock for the writer (no queueing / requesting)
+        return getattr(self._local, 'active', False)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    @property
+    def error(self):
+        return self._error
+
+    def request(self, final_analyse=True):
+        # request a store, returns the ticket for wait()
+
+        with self._condition:
+            self._ticket_requested += 1
+            self._final_analyse = bool(self._final_analyse) or final_analyse
+            self._condition.notify_all()
+            return self._ticket_requested
+
+    def wait(self, ticket=None, timeout=None):
+        # wait until the store of ticket (None: the last request) is done. Returns False on timeout or store errors
+
+        with self._condition:
+            if ticket is None:
+                ticket = self._ticket_requested
+            done = self._condition.wait_for(lambda: self._ticket_done >= ticket or not self._thread.is_alive(), timeout)
+
+            self.check()
+            if not done or self._ticket_done < ticket:
+                self.logger.warning(f'{self.df.hash_id}: store {ticket} is not done yet (done: {self._ticket_done})')
+                return False
+            return self._error is None
+
+    def check(self):
+        # raise the exception of a failed queued call (once)
+
+        with self._condition:
+            error, self._append_error = self._append_error, None
+        if error is not None:
+            raise error
+
+    def stop(self, timeout=None):
+        # finish the requested stores and the queued appends, then stop the thread (failed queued calls: see check())
+
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        self._drain()
+
+    def run_or_defer(self, method, df, args, kwargs, prepare=None):
+        # call method under df._lock or queue it while the lock is held by the writer. A queued call returns the result
+        # of prepare for invalid arguments and None else (like the successful appends)
+
+        if len(self._pending) >= self.max_pending:
+            self.logger.debug(f'{self.df.hash_id}: {len(self._pending)} queued appends, waiting for the store')
+            self._lock.acquire()
+        elif not self._lock.acquire(blocking=False):
+            # the caller may reuse its buffers => only owned copies are queued
+            if prepare is None:
+                args, kwargs = self._copy(args), self._copy(kwargs)
+            else:
+                prepared = prepare(*args, **kwargs)
+                if not isinstance(prepared, tuple):
+                    return prepared
+                args, kwargs = prepared
+            self._pending.append((method, (df,) + tuple(args), kwargs))
+            # the writer might have released the lock in the meantime
+            self._drain()
+            return None
+
+        try:
+            self._local.active = True
+            self._apply_pending()
+            return method(df, *args, **kwargs)
+        finally:
+            self._local.active = False
+            self._lock.release()
+            self._drain()
+
+    @staticmethod
+    def _copy(value):
+        # copy of the arrays, buffers and lists (also nested) of queued arguments
+
+        if isinstance(value, np.ndarray):
+            return np.array(value, copy=True)
+        elif isinstance(value, (bytearray, memoryview)):
+            return bytes(value)
+        elif isinstance(value, (list, tuple)):
+            return type(value)(BackgroundWriter._copy(item) for item in value)
+        elif isinstance(value, dict):
+            return {key: BackgroundWriter._copy(item) for key, item in value.items()}
+        return value
+
+    def _apply_pending(self):
+        # df._lock must be held
+
+        while self._pending:
+            method, args, kwargs = self._pending.popleft()
+            try:
+                method(*args, **kwargs)
+            except Exception as e:
+                self.logger.error(f'{self.df.hash_id}: queued {method.__name__} failed: {e}')
+                with self._condition:
+                    if self._append_error is None:
+                        self._append_error = e
+
+    def _drain(self):
+        # apply the queued appends if nobody holds df._lock
+
+        while self._pending and self._lock.acquire(blocking=False):
+            try:
+                self._local.active = True
+                self._apply_pending()
+            finally:
+                self._local.active = False
+                self._lock.release()
+
+    def _run(self):
+
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._final_analyse is not None or self._stop)
+                if self._final_analyse is None:
+                    break
+                ticket, final_analyse = self._ticket_requested, self._final_analyse
+                self._final_analyse = None
+
+            error = None
+            self._lock.acquire()
+            try:
+                self._local.active = True
+                self._apply_pending()
+                self.df.store(final_analyse=final_analyse)
+            except Exception as e:
+                error = e
+                self.logger.error(f'{self.df.hash_id}: background store failed: {e}')
+            finally:
+                self._local.active = False
+                self._lock.release()
+                self._drain()
+
+            with self._condition:
+                self._ticket_done = ticket
+                self._error = error
+                self._condition.notify_all()
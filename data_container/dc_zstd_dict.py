@@ -0,0 +1,201 @@
+import os
+import json
+import threading
+from pathlib import Path
+import zstd
+
+# optional: the zstd module has no dictionary support (pip install zstandard)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from . import config
+
+
+class ZstdDicts():
+    # Trained zstd dictionaries per data_type. Low rate data types (heart_rate, spo2, temperature, ...) produce many tiny
+    # slices which zstd compresses poorly without a dictionary.
+    #
+    # The dictionaries are versioned by their dict_id (stored in the dictionary and in every frame header):
+    #   data/zstd_dicts/<dict_id>.zdict     dictionary content
+    #   data/zstd_dicts/index.json          {data_type: [dict_id, ...]}, the last dict_id is the active one
+    # Old dictionaries are never removed since slices compressed with them (sl.compression_dict_id) still need them.
+    #
+    # Training runs offline (see train() and scripts/train_zstd_dicts.py). Slices are compressed with the active
+    # dictionary of their data_type (if there is one and zstandard is installed).
+
+    # data types which produce many tiny slices (default of scripts/train_zstd_dicts.py)
+    LOW_RATE_DATA_TYPES = ('heart_rate', 'spo2', 'temperature', 'battery', 'quality')
+
+    def __init__(self, path=None):
+
+        self.logger = config.logger
+        self._path = path
+        self._index = None
+        # dict_id -> zstandard.ZstdCompressionDict
+        self._dicts = {}
+        self._lock = threading.RLock()
+
+    @property
+    def available(self):
+        return zstandard is not None
+
+    @property
+    def path(self):
+        # default: data/zstd_dicts (config.init() must be called before)
+        if self._path is not None:
+            return Path(self._path)
+        if config.data_path is None:
+            return None
+        return Path(config.data_path) / Path('zstd_dicts')
+
+    @path.setter
+    def path(self, path):
+        with self._lock:
+            self._path = path
+            self._index = None
+            self._dicts = {}
+
+    @property
+    def index(self):
+
+        with self._lock:
+            if self._index is None:
+                self._index = {}
+                if self.path is not None:
+                    try:
+                        with open(str(self.path / Path('index.json'))) as fp:
+                            self._index = json.load(fp)
+                    except FileNotFoundError:
+                        pass
+                    except json.JSONDecodeError:
+                        self.logger.error(f'zstd dictionary index {self.path / Path("index.json")} is corrupt')
+            return self._index
+
+    def active_id(self, data_type):
+        # dict_id used to compress new slices of this data_type, 0: no dictionary
+
+        if not self.available:
+            return 0
+        dict_ids = self.index.get(data_type)
+        if not dict_ids:
+            return 0
+        # dictionary file missing => compress without a dictionary
+        if self.get(dict_ids[-1]) is None:
+            return 0
+        return dict_ids[-1]
+
+    def get(self, dict_id):
+        # returns the zstandard.ZstdCompressionDict of dict_id or None
+
+        if not dict_id or not self.available:
+            return None
+
+        with self._lock:
+            if dict_id not in self._dicts:
+                try:
+                    with open(str(self.path / Path(f'{dict_id}.zdict')), 'rb') as fp:
+                        self._dicts[dict_id] = zstandard.ZstdCompressionDict(fp.read())
+                except (FileNotFoundError, TypeError):
+                    self.logger.error(f'zstd dictionary {dict_id} not found in {self.path}')
+                    return None
+            return self._dicts[dict_id]
+
+    def require(self, dict_id):
+        # like get() but raises zstd.Error if the dictionary is not available
+
+        if not self.available:
+            raise zstd.Error(f'zstd dictionary {dict_id} needed but zstandard is not installed')
+        zstd_dict = self.get(dict_id)
+        if zstd_dict is None:
+            raise zstd.Error(f'zstd dictionary {dict_id} not found')
+        return zstd_dict
+
+    def compress(self, bin_data, dict_id, level):
+        # one zstd frame compressed with dictionary dict_id (raises zstd.Error like the zstd module)
+
+        zstd_dict = self.require(dict_id)
+        try:
+            return zstandard.ZstdCompressor(level=level, dict_data=zstd_dict).compress(bytes(bin_data))
+        except zstandard.ZstdError as e:
+            raise zstd.Error(str(e))
+
+    def decompress(self, bin_data, dict_id):
+        # decompress a single zstd frame (frames without a dictionary are decompressed as well)
+
+        zstd_dict = self.require(dict_id)
+        try:
+            return zstandard.ZstdDecompressor(dict_data=zstd_dict).decompress(bin_data)
+        except zstandard.ZstdError as e:
+            raise zstd.Error(str(e))
+
+    def add(self, data_type, dict_data):
+        # store a new dictionary version for data_type (and make it the active one). Returns the dict_id.
+
+        zstd_dict = zstandard.ZstdCompressionDict(dict_data)
+        dict_id = zstd_dict.dict_id()
+
+        with self._lock:
+            os.makedirs(str(self.path), exist_ok=True)
+            path_dict = self.path / Path(f'{dict_id}.zdict')
+            if not os.path.isfile(path_dict):
+                with open(str(path_dict), 'wb') as fp:
+                    fp.write(dict_data)
+                    fp.flush()
+                    os.fsync(fp)
+
+            index = dict(self.index)
+            dict_ids = [i for i in index.get(data_type, []) if i != dict_id]
+            index[data_type] = dict_ids + [dict_id]
+
+            # write to a temporary file first => the index is never corrupt
+            path_index = self.path / Path('index.json')
+            path_tmp = Path(str(path_index) + '.tmp')
+            with open(str(path_tmp), 'w') as fp:
+                json.dump(index, fp, indent=2)
+                fp.flush()
+                os.fsync(fp)
+            os.replace(path_tmp, path_index)
+
+            self._index = index
+            self._dicts[dict_id] = zstd_dict
+
+        self.logger.info(f'zstd dictionary {dict_id} for {data_type} stored ({len(dict_data)} bytes)')
+        return dict_id
+
+    def train(self, data_type, data_files=None, dict_size=16384, sample_size=4096, level=2):
+        # train a new dictionary for data_type from the slices of data_files (default: all DataFiles in the database)
+        # and make it the active one. Returns the dict_id or None.
+        #   sample_size: bigger slices are split into samples of sample_size bytes (new slices are compressed in small
+        #   frames as well, see DataSlice.write_bin())
+
+        if not self.available:
+            self.logger.error('train zstd dictionary: zstandard is not installed (pip install zstandard)')
+            return None
+
+        if data_files is None:
+            from .data_file import DataFile
+            data_files = DataFile.objects()
+
+        samples = []
+        for df in data_files:
+            if data_type not in df.cols:
+                continue
+            for sl in df.cols[data_type].all_slices:
+                bin_data = sl.get_bin_data()
+                if not bin_data:
+                    continue
+                samples += [bin_data[i:i + sample_size] for i in range(0, len(bin_data), sample_size)]
+
+        if not samples:
+            self.logger.warning(f'train zstd dictionary: no slices of {data_type} found')
+            return None
+
+        try:
+            zstd_dict = zstandard.train_dictionary(dict_size, samples, level=level)
+        except zstandard.ZstdError as e:
+            self.logger.error(f'train zstd dictionary for {data_type} with {len(samples)} samples failed: {e}')
+            return None
+
+        return self.add(data_type, zstd_dict.as_bytes())
@@ -1,9 +1,10 @@
-from mongoengine import Document, StringField
+from mongoengine import Document, StringField, EmbeddedDocumentListField
 from . import config
 logger = config.logger
 import re
 import pymongo
 
+from mongoengine.base.datastructures import EmbeddedDocumentList
 from mongoengine.connection import DEFAULT_CONNECTION_NAME, get_db
 from mongoengine import signals
 from mongoengine.context_managers import set_write_concern
@@ -17,6 +18,44 @@ from mongoengine.queryset import NotUniqueError, OperationError, transform
 #  - $unset?
 #  - save()?
 
+class AppendList(EmbeddedDocumentList):
+    # list of an AppendListField which records its appended items: mongoengine marks the whole list as changed by
+    # append() and sets it completely with the next save (e.g. all slices of a column when one slice is appended).
+    # append() / extend() only mark the new items as changed (<list>.<index>), so the other items are still updated
+    # field by field and DocumentTweak pushes the new ones (see DocumentTweak._push_appended()).
+
+    def __init__(self, list_items, instance, name):
+
+        super(AppendList, self).__init__(list_items, instance, name)
+        # id() of the items appended since the last save
+        self._appended = set()
+
+    def append(self, item):
+        self.extend([item])
+
+    def extend(self, items):
+
+        start = len(self)
+        list.extend(self, items)
+        for index in range(start, len(self)):
+            self._appended.add(id(list.__getitem__(self, index)))
+            self._mark_as_changed(index)
+
+
+class AppendListField(EmbeddedDocumentListField):
+    # EmbeddedDocumentListField with an AppendList
+
+    def __get__(self, instance, owner):
+
+        value = super(AppendListField, self).__get__(instance, owner)
+        if instance is not None and isinstance(value, list) and not isinstance(value, AppendList):
+            dereferenced = value._dereferenced
+            value = AppendList(value, instance, self.name)
+            value._dereferenced = dereferenced
+            instance._data[self.name] = value
+        return value
+
+
 # based on mongoengine 0.20.0
 class DocumentTweak(Document):
 
@@ -207,6 +246,9 @@ class DocumentTweak(Document):
                     update_doc['$set'].pop(key, None)
                 logger.warning(f'_save_changes: removed keys {keys_to_remove}')
 
+            # appended items are pushed (see AppendList)
+            update_doc = self._push_appended(update_doc)
+
             upsert = save_condition is None
             with set_write_concern(collection, write_concern) as wc_collection:
                 last_error = wc_collection.update_one(
@@ -226,6 +268,51 @@ class DocumentTweak(Document):
 
         return object_id, created
 
+    def _lookup_db_key(self, key):
+        # value at the db key (e.g. cols.heart_rate.s_y) of this document
+
+        value = self
+        for part in key.split('.'):
+            if isinstance(value, list):
+                value = value[int(part)]
+            elif isinstance(value, dict):
+                value = value.get(part)
+            elif value is not None:
+                value = getattr(value, value._reverse_db_field_map.get(part, part), None)
+        return value
+
+    def _push_appended(self, update_doc):
+        # The items appended to an AppendList are set by their index (<list>.<index>). They are pushed ($push) in the
+        # same update instead, unless other items of the list are updated as well: MongoDB rejects $push and $set on
+        # the same path in one update, so these are still set by their index (appending them as well).
+
+        appended = {}
+        for key in update_doc.get('$set', {}):
+            list_key, _, index = key.rpartition('.')
+            if not index.isdigit():
+                continue
+            items = self._lookup_db_key(list_key)
+            if isinstance(items, AppendList) and id(list.__getitem__(items, int(index))) in items._appended:
+                appended.setdefault(list_key, (items, []))[1].append(key)
+
+        push = {}
+        for list_key, (items, keys) in appended.items():
+            items._appended.clear()
+
+            prefix = list_key + '.'
+            keys_item_changes = [key for operator in update_doc for key in update_doc[operator] if key.startswith(prefix)]
+            if len(keys_item_changes) > len(keys):
+                continue
+
+            keys.sort(key=lambda key: int(key.rpartition('.')[2]))
+            push[list_key] = {'$each': [update_doc['$set'].pop(key) for key in keys]}
+
+        if push:
+            update_doc['$push'] = push
+            if not update_doc['$set']:
+                del update_doc['$set']
+        return update_doc
+
     @classmethod
     def _get_db(cls):
         """Some Model using other db_alias"""
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# Train a new zstd dictionary version per data_type from the slices of all DataFiles in the database (offline, e.g. on
+# the server). Copy data/zstd_dicts to every device and server which reads or writes the slices.
+#
+#   python3 train_zstd_dicts.py <db_name> [data_type ...] [--data_path PATH] [--dict_size BYTES]
+import sys
+import os
+import argparse
+from pathlib import Path
+###########################################################################################################
+file_path = Path(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(str(file_path.parents[1]))
+
+import data_container as dc
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='train zstd dictionaries for the slices of low rate data types')
+    parser.add_argument('db_name')
+    parser.add_argument('data_types', nargs='*', default=list(dc.ZstdDicts.LOW_RATE_DATA_TYPES))
+    parser.add_argument('--data_path', default=None)
+    parser.add_argument('--dict_size', type=int, default=16384)
+    args = parser.parse_args()
+
+    dc.config.init(db_name=args.db_name, data_path=args.data_path)
+
+    for data_type in args.data_types:
+        dict_id = dc.zstd_dicts.train(data_type, dict_size=args.dict_size)
+        print(f'{data_type}: {dict_id if dict_id else "no dictionary trained"}')
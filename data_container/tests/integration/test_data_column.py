@@ -1,5 +1,12 @@
 import pytest
+import numpy as np
+from datetime import datetime, timedelta
 from data_container import config
+from data_container.data_slice import DataSlice
+from data_container.dc_rollup import Rollup
+from data_container.dc_sketch import QuantileSketch
+import os
+import threading
 
 @pytest.mark.parametrize(
              'os, numpy_size, data_type, dtype_x, dtype_y',
@@ -41,3 +48,281 @@ def test_dtype_of_x_and_y_depending_on_operating_system_and_config_setting(
     assert df.cols[data_type].x.dtype == dtype_x
     assert df.cols[data_type].y.dtype == dtype_y
 
+
+
+def test_window_reads_only_the_slices_in_the_time_window(fixture_reduce_slice_size_288, fixture_empty_df, monkeypatch):
+
+    df = fixture_empty_df
+    time_rec = np.arange(2000) / 10
+    for i, t in enumerate(time_rec):
+        df.append_value('ppg_ir', i, float(t))
+    df.store()
+
+    col = df.cols['ppg_ir']
+    for sl in col.all_slices:
+        sl.free_values()
+
+    read_slices = []
+    read_values = DataSlice.read_values
+
+    def read_values_spy(sl, count=None):
+        read_slices.append(sl)
+        return read_values(sl, count)
+
+    monkeypatch.setattr(DataSlice, 'read_values', read_values_spy)
+
+    x, y = col.window(50, 60)
+    in_window = (time_rec >= 50) & (time_rec <= 60)
+    assert x.tolist() == time_rec[in_window].tolist()
+    assert y.tolist() == np.flatnonzero(in_window).tolist()
+
+    # 101 samples: 4 of 56 time_rec slices (36 samples) and 2 of 21 y slices (96 samples)
+    assert len(set(sl.hash for sl in read_slices)) == 6
+    assert all(sl._values is None for sl in col.all_slices)
+    assert x.dtype == col.x.dtype and y.dtype == col.y.dtype
+
+    assert col.window(50, duration=10)[0].tolist() == x.tolist()
+    assert col.window_datetime(df.date_time_start + timedelta(seconds=50), df.date_time_start + timedelta(seconds=60))[1].tolist() == y.tolist()
+    chunk = df.chunks[0]
+    assert col.window_chunk(chunk, 50, 60)[1].tolist() == col.window(chunk.time_offset + 50, chunk.time_offset + 60)[1].tolist()
+    assert col.window_datetime(datetime.now(), datetime.now()) is None
+
+    assert col.window(199.9)[1].tolist() == [1999]
+    assert col.window(end=0.25)[1].tolist() == [0, 1, 2]
+    assert col.window(300, 400)[0].tolist() == []
+    assert col.window(50.01, 50.09)[1].tolist() == []
+    assert len(col.window()[1]) == 2000
+
+
+@pytest.mark.parametrize('data_type', ['heart_rate', 'temperature'])
+def test_final_analyse_merges_the_statistics_of_the_slices(fixture_reduce_slice_size_24, fixture_empty_df, data_type):
+
+    df = fixture_empty_df
+    values = np.random.default_rng(0).integers(0, 200, 500)
+    # with a zero (the old statistics skipped min = 0)
+    values[250] = 0
+    df.append_values(data_type, values, np.arange(500))
+    df.store()
+
+    col = df.cols[data_type]
+    y = np.sort(col.y.astype(np.float64))
+    assert len(col._slices_y) > 10
+    assert all(sl.sketch_values for sl in col._slices_y)
+
+    assert col.samples_meta == 500
+    assert col.min == 0
+    assert col.max == round(float(y[-1]), 2)
+    assert col.mean == round(float(y.mean()), 2)
+    assert col.median == round(float(y[250]), 2)
+    assert col.lower_quartile == round(float(y[125]), 2)
+    assert col.upper_quartile == round(float(y[375]), 2)
+
+    # slices analysed before there were sketches
+    for sl in col._slices_y:
+        sl.sketch_values = []
+    median = col.median
+    col.median = None
+    col.final_analyse()
+    assert col.median == median
+
+
+def test_samples_and_bin_size_count_the_full_slices_once(fixture_reduce_slice_size_24, fixture_empty_df):
+
+    df = fixture_empty_df
+    df.append_values('heart_rate', np.arange(100) % 200, np.arange(100))
+    col = df.cols['heart_rate']
+    slices = col._slices_y + col._slices_time_rec
+
+    assert col.samples == 100
+    assert col.bin_size == sum(sl.bin_size for sl in slices)
+    # the full slices are counted once
+    count, last, samples, bin_size = col._full_slices['y']
+    assert count == len(col._slices_y) - 1 and last is col._slices_y[-2]
+
+    df.append_values('heart_rate', np.arange(100, 150) % 200, np.arange(100, 150))
+    assert col.samples == 150
+    assert col._full_slices['y'][0] > count
+
+    # the counters are reset if the counted slices changed
+    col._slices_y.pop(0)
+    assert col.samples == sum(sl.samples for sl in col._slices_y) < 150
+
+
+def test_final_analyse_quantiles_of_one_large_slice(fixture_empty_df):
+
+    df = fixture_empty_df
+    # one day of temperature in one slice
+    df.append_values('temperature', np.random.default_rng(0).normal(36.5, 0.5, 86400), np.arange(86400))
+    df.store()
+
+    col = df.cols['temperature']
+    assert len(col._slices_y) == 1
+    assert len(col._slices_y[0].sketch_weights) == 1
+    y = col.y.astype(np.float64)
+    # rank error <= 2 / MAX_POINTS (see QuantileSketch), rounded to 2 decimals
+    error = 2 / QuantileSketch.MAX_POINTS
+    for q, value in [(1 / 4, col.lower_quartile), (1 / 2, col.median), (3 / 4, col.upper_quartile)]:
+        assert np.quantile(y, q - error) - 0.005 <= value <= np.quantile(y, q + error) + 0.005
+        assert abs(value - np.quantile(y, q)) < 0.01
+
+
+def expected_buckets(x, y, seconds):
+
+    keys = np.floor(x / seconds)
+    return [(key * seconds, np.count_nonzero(keys == key), y[keys == key].min(), y[keys == key].max(), y[keys == key].mean()) for key in np.unique(keys)]
+
+
+def test_rollups_are_updated_incrementally_and_match_the_raw_data(fixture_reduce_slice_size_288, fixture_empty_df, monkeypatch):
+
+    monkeypatch.setattr(config, '_rollup', True)
+    monkeypatch.setattr(Rollup, 'BLOCK_SIZE', 1000)
+
+    df = fixture_empty_df
+    df.add_combined_columns(['ppg_red', 'ppg_ir'], 'ppg')
+
+    rng = np.random.default_rng(0)
+    x = np.arange(20000) / 10
+    y_hr = rng.integers(40, 180, len(x))
+    y_ppg = rng.integers(0, 2 ** 24, (len(x), 2))
+
+    # live batches with a store (=> rollup update) in between
+    for i in range(0, len(x), 3333):
+        df.append_values('heart_rate', y_hr[i:i + 3333], x[i:i + 3333])
+        df.append_values('ppg', y_ppg[i:i + 3333], x[i:i + 3333])
+        df.store()
+        assert Rollup(df.cols['heart_rate']).samples('1s') == min(i + 3333, len(x))
+
+    for data_type, y in [('heart_rate', y_hr), ('ppg_ir', y_ppg[:, 1])]:
+        col = df.cols[data_type]
+        for level, seconds in Rollup.LEVELS.items():
+            rollup = col.rollup(level)
+            assert rollup.tolist() == pytest.approx(expected_buckets(x, y.astype(np.float64), seconds))
+
+    # time window: buckets overlapping 100 s <= time_rec <= 300 s
+    rollup = df.cols['heart_rate'].rollup('1min', 100, 300)
+    assert rollup['time'].tolist() == [60, 120, 180, 240, 300]
+
+    # deleted rollups are rebuilt
+    os.remove(Rollup(df.cols['heart_rate']).path('15min'))
+    assert df.cols['heart_rate'].rollup('15min').tolist() == pytest.approx(expected_buckets(x, y_hr.astype(np.float64), 900))
+
+    assert df.cols['heart_rate'].rollup('1h') is None
+
+
+def test_rollups_survive_a_crash_before_the_header_and_concurrent_updates(fixture_reduce_slice_size_288, fixture_empty_df):
+
+    df = fixture_empty_df
+    x = np.arange(3000) / 10
+    y = np.arange(3000) % 200
+
+    df.append_values('heart_rate', y[:1500], x[:1500])
+    df.store()
+    col = df.cols['heart_rate']
+    rollup = Rollup(col)
+    rollup.update()
+    path = rollup.path('1min')
+    with open(path, 'rb') as fp:
+        header = fp.read(Rollup.HEADER.size)
+
+    # crash after the buckets were written, before the header: the next update() merges the samples again
+    df.append_values('heart_rate', y[1500:], x[1500:])
+    rollup.update()
+    with open(path, 'r+b') as fp:
+        fp.write(header)
+    assert rollup.samples('1min') == 1500
+
+    # concurrent updates (e.g. a dashboard) don't count samples twice
+    threads = [threading.Thread(target=rollup.update) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert rollup.samples('1min') == 3000
+    assert col.rollup('1min').tolist() == pytest.approx(expected_buckets(x, y.astype(np.float64), 60))
+
+
+def test_combined_columns_read_the_shared_time_slices_once(fixture_reduce_slice_size_288, fixture_empty_df, monkeypatch):
+
+    df = fixture_empty_df
+    df.add_combined_columns(['acc_x', 'acc_y', 'acc_z'], 'acc')
+
+    x = np.arange(1000) / 25
+    y = np.random.default_rng(0).normal(0, 1, (1000, 3))
+    df.append_values('acc', y, x)
+    df.store()
+
+    read_slices = []
+    lazy_load = DataSlice.lazy_load
+    monkeypatch.setattr(DataSlice, 'lazy_load', lambda sl: read_slices.append(sl._hash) or lazy_load(sl))
+    # values are lazy loaded again
+    for sl in df.cols['acc_x']._slices_time_rec:
+        sl.free_values()
+
+    x_shared, ys = df.combined_values('acc')
+    time_hashes = [sl._hash for sl in df.cols['acc_x']._slices_time_rec]
+    assert sorted(h for h in read_slices if h in time_hashes) == sorted(time_hashes)
+    assert not x_shared.flags.writeable
+    assert np.array_equal(x_shared, x.astype(x_shared.dtype))
+    for i, data_type in enumerate(['acc_x', 'acc_y', 'acc_z']):
+        assert np.allclose(ys[data_type], y[:, i].astype(ys[data_type].dtype))
+
+    # the members share the cached time array (x is a writeable copy)
+    read_slices.clear()
+    for data_type in ['acc_x', 'acc_y', 'acc_z']:
+        x_col = df.cols[data_type].x
+        assert x_col.flags.writeable and np.array_equal(x_col, x_shared)
+    assert not read_slices
+
+    # freeing the time_rec slices frees the cached time array as well
+    df.cols['acc_x']._slices_time_rec[0].free_values()
+    assert not df._shared_x_cache
+
+    # new values => the cache is updated
+    df.append_values('acc', y[:10], x[:10] + 40)
+    assert len(df.cols['acc_z'].x) == 1010
+
+    assert df.combined_values('quatsch') == (None, None)
+
+
+def test_series_reads_only_the_slices_it_touches(fixture_reduce_slice_size_288, fixture_empty_df, monkeypatch):
+
+    df = fixture_empty_df
+    y = np.random.default_rng(0).integers(0, 2 ** 24, 5000)
+    df.append_values('ppg_ir', y, np.arange(5000) / 100)
+    df.store()
+
+    col = df.cols['ppg_ir']
+    for sl in col.all_slices:
+        sl.free_values()
+
+    read_slices = []
+    read_values = DataSlice.read_values
+    monkeypatch.setattr(DataSlice, 'read_values', lambda sl, count=None: read_slices.append(sl._hash) or read_values(sl, count))
+
+    series = col.series()
+    assert len(series) == 5000 and series.slices == len(col._slices_y) > 50
+    assert not read_slices
+
+    # 96 samples per slice (288 bytes, uint24)
+    assert series[100] == y[100] and series[-1] == y[-1]
+    assert np.array_equal(series[1000:1100], y[1000:1100])
+    assert len(set(read_slices)) == 4
+
+    for key in [slice(None, None, 7), slice(4999, 10, -13), slice(70, 75), slice(10, 10), [3, 4999, 3, -2], np.asarray([[1, 2], [300, 4]]), y > 2 ** 23]:
+        assert np.array_equal(series[key], y[key])
+
+    with pytest.raises(IndexError):
+        series[5000]
+
+    assert np.array_equal(np.asarray(series), y)
+    assert np.array_equal(np.concatenate(list(series.iter_slices())), y)
+    assert list(series)[:3] == y[:3].tolist()
+    assert series.min() == y.min() and series.max() == y.max()
+    assert series.sum() == y.sum() and series.mean() == pytest.approx(y.mean())
+    # nothing was kept in memory
+    assert all(sl._values is None for sl in col._slices_y)
+
+    x = col.series('time_rec')
+    assert np.array_equal(x[::100], col.x[::100])
+    assert col.series('quatsch') is None
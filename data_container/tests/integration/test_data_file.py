@@ -2,6 +2,8 @@ import pytest
 from data_container.tests.conftest import new_df
 from data_container.tests.testing_helper_functions import eeg_scale_factor
 from data_container import DataFile
+from data_container.data_slice import DataSlice
+from data_container.dc_slice_store import SliceStore
 from data_container.dc_helper import DcHelper
 from data_container import config
 from data_container.odm import Person, Project
@@ -11,6 +13,7 @@ import numpy as np
 import logging
 import json
 import os
+import threading
 
 logger = config.logger
 logger.setLevel('DEBUG')
@@ -242,6 +245,73 @@ def test_append_values_to_a_closed_df(fixture_empty_df):
     assert np.allclose(y, df.c.heart_rate.y)
 
 
+@pytest.mark.parametrize('batch_size', [1, 7, 100, 1000])
+def test_append_values_in_batches_fills_the_slices_like_append_value(fixture_reduce_slice_size_24, fixture_empty_df, batch_size):
+
+    df_single = fixture_empty_df
+    df_bulk = new_df()
+    for df in [df_single, df_bulk]:
+        df.add_combined_columns(['ppg_red', 'ppg_ir'], 'ppg')
+
+    rng = np.random.default_rng(batch_size)
+    x = np.arange(1000) / 10
+    y_hr = rng.integers(0, 2 ** 8, 1000)
+    y_temp = rng.uniform(30, 40, 1000)
+    y_ppg = rng.integers(0, 2 ** 24, (1000, 2))
+
+    for i in range(1000):
+        df_single.append_value('heart_rate', int(y_hr[i]), x[i])
+        df_single.append_value('temperature', y_temp[i], x[i])
+        df_single.append_value('ppg', y_ppg[i].tolist(), x[i])
+
+    # live batches (batch_size 1000: one bulk load)
+    for i in range(0, 1000, batch_size):
+        df_bulk.append_values('heart_rate', y_hr[i:i + batch_size], x[i:i + batch_size])
+        df_bulk.append_values('temperature', y_temp[i:i + batch_size], x[i:i + batch_size])
+        df_bulk.append_values('ppg', y_ppg[i:i + batch_size], x[i:i + batch_size])
+
+    assert len(df_bulk.chunks) == 1
+    assert df_bulk.columns == df_single.columns == 4
+    for data_type in df_single.cols:
+        col_single = df_single.cols[data_type]
+        col_bulk = df_bulk.cols[data_type]
+        assert np.array_equal(col_single.x, col_bulk.x)
+        assert np.array_equal(col_single.y, col_bulk.y)
+        for slices_single, slices_bulk in [(col_single._slices_y, col_bulk._slices_y), (col_single._slices_time_rec, col_bulk._slices_time_rec)]:
+            assert [sl.samples for sl in slices_single] == [sl.samples for sl in slices_bulk]
+            assert [sl.slice_time_offset for sl in slices_single] == [sl.slice_time_offset for sl in slices_bulk]
+    assert not df_bulk.cols['ppg_ir']._slices_time_rec
+
+    df_bulk.store()
+    df_bulk = DataFile.objects(_hash_id=df_bulk.hash_id).first()
+    assert np.array_equal(df_bulk.c.ppg_ir.y, y_ppg[:, 1])
+    assert np.array_equal(df_bulk.c.heart_rate.y, y_hr)
+
+
+@pytest.mark.parametrize('data_type, values, time_rec', [
+    ('heart_rate', [1, 2, 3], [0, 1]),
+    ('heart_rate', [1, -2, 3], [0, 1, 2]),
+    ('heart_rate', [1, 2, 3], [0, -1, 2]),
+    ('heart_rate', [1, np.nan, 3], [0, 1, 2]),
+    ('heart_rate', ['a', 'b', 'c'], [0, 1, 2]),
+    ('heart_rate', [1, 300, 3], [0, 1, 2]),
+    ('heart_rate', [1, 255.6, 3], [0, 1, 2]),
+    ('temperature', [36.5, 1e5, 37.0], [0, 1, 2]),
+    ('ppg', [[1, 2], [3, 2 ** 24]], [0, 1]),
+    ('ppg', [[1, 2], [3, -4]], [0, 1]),
+    ('ppg', [1, 2], [0, 1]),
+    ('ppg_ir', [1, 2], [0, 1]),
+    ('quatsch', [1, 2], [0, 1]),
+])
+def test_append_values_rejects_invalid_batches_completely(fixture_empty_df, data_type, values, time_rec):
+
+    df = fixture_empty_df
+    df.add_combined_columns(['ppg_red', 'ppg_ir'], 'ppg')
+
+    assert df.append_values(data_type, values, time_rec) is False
+    assert df.samples == 0
+
+
 # def test_df_empty_columns():
 #
 #     df = new_df(CLIENT_TEST_DB)
@@ -285,6 +355,250 @@ def test_double_appearance_of_slice_names(fixture_reduce_slice_size_4, fixture_e
         assert False, 'duplicate hash was found in slice list! Hashes not unique'
 
 
+def test_save_changes_only_sends_the_changes_of_the_slice_lists(fixture_reduce_slice_size_24, fixture_empty_df, monkeypatch):
+
+    df = fixture_empty_df
+    for i in range(3):
+        df.append_values('heart_rate', np.arange(i * 30, (i + 1) * 30) % 200, np.arange(i * 30, (i + 1) * 30))
+        df.store()
+
+    updates = []
+    push_appended = DataFile._push_appended
+
+    def push_appended_spy(self, update_doc):
+        updates.append(push_appended(self, update_doc))
+        return updates[-1]
+    monkeypatch.setattr(DataFile, '_push_appended', push_appended_spy)
+
+    time_rec_stored = len(df.c.heart_rate._slices_time_rec)
+    df.append_values('heart_rate', np.arange(90, 120) % 200, np.arange(90, 120))
+    df.store()
+
+    update_doc = updates[-1]
+    assert 'cols.heart_rate.s_y' not in update_doc['$set'] and 'cols.heart_rate.s_tr' not in update_doc['$set']
+    # the new time_rec slices are pushed
+    assert len(update_doc['$push']['cols.heart_rate.s_tr']['$each']) == len(df.c.heart_rate._slices_time_rec) - time_rec_stored
+    # the last slice of the previous store() got new values => the new slices are set by their index in the same update
+    assert update_doc['$set']['cols.heart_rate.s_y.3.vwp'] == df.c.heart_rate._slices_y[3].values_write_pointer
+    assert 'cols.heart_rate.s_y.4' in update_doc['$set'] and 'cols.heart_rate.s_y' not in update_doc['$push']
+
+    # the db has the same state as a complete save
+    db_doc = DataFile._get_collection().find_one({'_id': df.hash_id})
+    assert db_doc['cols'] == df.to_mongo().to_dict()['cols']
+
+
+def test_slices_of_external_columns_are_stored_in_the_slice_collection(fixture_reduce_slice_size_24, fixture_empty_df, monkeypatch):
+
+    monkeypatch.setattr(config, '_slice_collection', True)
+    df = fixture_empty_df
+    df.append_values('heart_rate', np.arange(100) % 200, np.arange(100))
+    df.append_values('ppg_red', np.arange(100), np.arange(100))
+    df.store()
+    hash_id = df.hash_id
+    slices = len(df.all_slices())
+
+    db_doc = DataFile._get_collection().find_one({'_id': hash_id})
+    assert db_doc['cols']['ppg_red']['s_ext'] is True
+    assert 's_y' not in db_doc['cols']['ppg_red'] and 's_tr' not in db_doc['cols']['ppg_red']
+    assert SliceStore(df).collection.count_documents({'df': hash_id}) == slices
+    # nothing changed => nothing to save
+    assert SliceStore(df).save() == 0
+
+    # the slices of a column are only fetched when they are used
+    df = DataFile.objects(_hash_id=hash_id).first()
+    assert df.c.heart_rate._slices_pending and df.c.ppg_red._slices_pending
+    assert np.array_equal(df.c.heart_rate.y, np.arange(100) % 200)
+    assert np.array_equal(df.c.heart_rate.x, np.arange(100))
+    assert not df.c.heart_rate._slices_pending and df.c.ppg_red._slices_pending
+    sl = df.c.ppg_red._slices_y[2]
+    assert df.get_slice(sl.hash) is sl
+
+    # the db sync gets the slices embedded
+    df_json = json.loads(DataFile.objects(_hash_id=hash_id).first().to_json())
+    assert len(df_json['cols']['ppg_red']['s_y']) == len(df.c.ppg_red._slices_y)
+    assert df.samples == 200 and len(df.all_slices()) == slices
+
+    # only the new and changed slices are serialized
+    to_mongo = DataSlice.to_mongo
+    serialized = []
+    monkeypatch.setattr(DataSlice, 'to_mongo', lambda sl, *args, **kwargs: serialized.append(sl) or to_mongo(sl, *args, **kwargs))
+    df.append_values('heart_rate', np.arange(100, 110), np.arange(100, 110))
+    df.store(final_analyse=False)
+    assert serialized and len(serialized) < len(df.c.heart_rate._slices_y)
+    assert SliceStore(df).collection.count_documents({'df': hash_id}) == len(df.all_slices())
+    monkeypatch.setattr(DataSlice, 'to_mongo', to_mongo)
+
+    # deleting the df (or the dfs of a query) deletes its slices
+    df.delete()
+    assert SliceStore(df).collection.count_documents({'df': hash_id}) == 0
+
+
+def test_background_writer_stores_without_blocking_the_appends(fixture_reduce_slice_size_24, fixture_empty_df, monkeypatch):
+
+    df = fixture_empty_df
+    df.append_values('heart_rate', np.arange(10), np.arange(10))
+    df.store()
+    df.start_background_writer()
+
+    # slow database
+    saving, release = threading.Event(), threading.Event()
+    calls = []
+    save_changes = DataFile.save_changes
+
+    def save_changes_slow(self, *args, **kwargs):
+        calls.append(1)
+        saving.set()
+        release.wait(10)
+        return save_changes(self, *args, **kwargs)
+    monkeypatch.setattr(DataFile, 'save_changes', save_changes_slow)
+
+    ticket = df.store()
+    assert saving.wait(10)
+
+    # the writer holds the df => appends are queued, store requests are coalesced
+    for i in range(10, 20):
+        df.append_value('heart_rate', i, i)
+    assert df._writer.pending == 10
+    assert df.store() == ticket + 1 and df.store() == ticket + 2
+
+    release.set()
+    assert df.wait(ticket + 2, timeout=10)
+    assert len(calls) == 2 and df._writer.pending == 0
+    assert df.flush(timeout=10) and len(calls) == 3
+
+    assert df.stop_background_writer(timeout=10)
+    assert df._writer is None
+    df = DataFile.objects(_hash_id=df.hash_id).first()
+    assert np.array_equal(df.c.heart_rate.y, np.arange(20))
+    assert np.array_equal(df.c.heart_rate.x, np.arange(20))
+
+
+def test_background_writer_queues_copies_of_reused_buffers(fixture_reduce_slice_size_24, fixture_empty_df, monkeypatch):
+
+    df = fixture_empty_df
+    df.append_values('heart_rate', np.arange(10), np.arange(10))
+    df.store()
+    df.start_background_writer()
+
+    saving, release = threading.Event(), threading.Event()
+    save_changes = DataFile.save_changes
+
+    def save_changes_slow(self, *args, **kwargs):
+        saving.set()
+        release.wait(10)
+        return save_changes(self, *args, **kwargs)
+    monkeypatch.setattr(DataFile, 'save_changes', save_changes_slow)
+
+    df.store()
+    assert saving.wait(10)
+
+    # acquisition loop which refills one buffer per batch
+    values, time_rec = np.zeros(5), np.zeros(5)
+    for i in (10, 15):
+        values[:] = np.arange(i, i + 5)
+        time_rec[:] = np.arange(i, i + 5)
+        assert df.append_values('heart_rate', values, time_rec) is None
+    # invalid batches are rejected before they are queued
+    assert df.append_values('heart_rate', [1, 300], [20, 21]) is False
+    assert df._writer.pending == 2
+
+    release.set()
+    assert df.stop_background_writer(timeout=10)
+    assert np.array_equal(df.c.heart_rate.y, np.arange(20))
+    assert np.array_equal(df.c.heart_rate.x, np.arange(20))
+
+
+def test_background_writer_raises_the_error_of_a_queued_append(fixture_reduce_slice_size_24, fixture_empty_df, monkeypatch):
+
+    df = fixture_empty_df
+    df.append_values('heart_rate', np.arange(10), np.arange(10))
+    df.store()
+    df.start_background_writer()
+
+    saving, release = threading.Event(), threading.Event()
+    save_changes = DataFile.save_changes
+
+    def save_changes_slow(self, *args, **kwargs):
+        saving.set()
+        release.wait(10)
+        return save_changes(self, *args, **kwargs)
+    monkeypatch.setattr(DataFile, 'save_changes', save_changes_slow)
+
+    df.store()
+    assert saving.wait(10)
+
+    # queued => the append returns before it fails (unknown data_type)
+    assert df.append_value('no_data_type', 1, 10) is None
+    df.append_value('heart_rate', 10, 10)
+    release.set()
+
+    with pytest.raises(KeyError):
+        df.flush(timeout=10)
+    # raised once, the other appends are stored
+    assert df.flush(timeout=10)
+    assert np.array_equal(df.c.heart_rate.y, np.arange(11))
+
+    # failed while the writer stops
+    saving.clear()
+    release.clear()
+    df.store()
+    assert saving.wait(10)
+    df.append_value('no_data_type', 1, 11)
+    release.set()
+    with pytest.raises(KeyError):
+        df.stop_background_writer(timeout=10)
+    assert df._writer is None
+
+
+def test_close_compresses_and_analyses_the_slices_and_stores_once(fixture_reduce_slice_size_24, fixture_empty_df, monkeypatch):
+
+    df = fixture_empty_df
+    df.append_values('heart_rate', np.arange(100) % 200, np.arange(100))
+    df.append_values('ppg_red', np.arange(100), np.arange(100))
+
+    calls = []
+    save_changes = DataFile.save_changes
+    analysed = []
+    final_analyse = DataSlice.final_analyse
+
+    def save_changes_spy(self, final_analyse=True, *args, **kwargs):
+        calls.append(final_analyse)
+        return save_changes(self, final_analyse, *args, **kwargs)
+    monkeypatch.setattr(DataFile, 'save_changes', save_changes_spy)
+
+    def final_analyse_spy(self):
+        analysed.append((self.hash, threading.get_ident()))
+        return final_analyse(self)
+    monkeypatch.setattr(DataSlice, 'final_analyse', final_analyse_spy)
+
+    df.close()
+
+    # the slices are analysed once, by the closing thread, and the df is not analysed again when it is stored
+    assert calls == [False]
+    assert sorted(analysed) == sorted((sl.hash, threading.get_ident()) for sl in df.all_slices())
+    assert all(sl.status_compressed and sl.samples_meta == sl.values_analyse_pointer > 0 for sl in df.all_slices())
+    df = DataFile.objects(_hash_id=df.hash_id).first()
+    assert df.status_closed
+    assert all(sl.status_compressed and sl._path.suffix == '.zst' for sl in df.all_slices())
+    assert np.array_equal(df.c.heart_rate.y, np.arange(100) % 200)
+    assert np.array_equal(df.c.ppg_red.x, np.arange(100))
+    assert df.c.heart_rate.samples_meta == 100
+
+
+def test_get_slice_uses_the_slice_index(fixture_reduce_slice_size_24, fixture_empty_df):
+
+    df = fixture_empty_df
+    df.append_values('heart_rate', np.arange(100) % 200, np.arange(100))
+    df.append_values('ppg_red', np.arange(100), np.arange(100))
+    df.store()
+
+    for df in (df, DataFile.objects(_hash_id=df.hash_id).first()):
+        slices = [sl for col in df.cols.values() for sl in col.all_slices]
+        assert sorted(df._slice_index) == sorted(df.get_slice_list())
+        assert all(df.get_slice(sl.hash) is sl for sl in slices)
+        assert df.get_slice('---') is None
+
+
 @pytest.mark.parametrize('close', [
     (False),
     (True),
@@ -917,10 +1231,11 @@ def test_chunks_created_by_appended_binaries_must_not_provoke_a_lazy_load(fixtur
 
 
 @pytest.mark.parametrize('size', (None, 24))
-def test_set_and_check_slice_max_size_attribute_of_df_before_and_after_loading(fixture_empty_df, size):
+def test_set_and_check_slice_max_size_attribute_of_df_before_and_after_loading(fixture_empty_df, monkeypatch, size):
 
     if size:
-        config._SLICE_MAX_SIZE = size
+        # restored after the test (otherwise all following tests use tiny slices)
+        monkeypatch.setattr(config, '_SLICE_MAX_SIZE', size)
     else:
         size = config.SLICE_MAX_SIZE
 
@@ -967,4 +1282,345 @@ def test_avoid_lazy_load_for_appended_binaries(fixture_empty_df, fixture_reduce_
         else:
             y_ref = y1*eeg_scale_factor()
             assert np.allclose(y_ref, sl._values)
-            assert sl._values_bin is None
\ No newline at end of file
+            assert sl._values_bin is None
+@pytest.mark.parametrize('algorithm', ('zstd', 'gzip'))
+def test_write_bin_appends_frames_to_compressed_slices_and_compact_merges_them(fixture_empty_df, algorithm):
+    # writing to a compressed slice must not decompress and compress the whole file again
+
+    df = fixture_empty_df
+    for i in range(10):
+        df.append_value('heart_rate', i, i)
+    df.store()
+
+    sl = df.c.heart_rate._slices_y[0]
+    sl.status_slice_full = True
+    sl.compress(algorithm=algorithm)
+    assert sl.compression_algorithm == algorithm
+
+    for i in range(2):
+        sl.extend([20 + i, 30 + i])
+        sl.write_bin()
+
+    with open(sl._path, 'rb') as fp:
+        assert DcHelper.compressed_frames(fp.read(), algorithm) == 3
+
+    # lazy load must read all frames
+    sl._values = None
+    assert sl.values == list(range(10)) + [20, 30, 21, 31]
+
+    sl.compact()
+    with open(sl._path, 'rb') as fp:
+        assert DcHelper.compressed_frames(fp.read(), algorithm) == 1
+    sl._values = None
+    assert sl.values == list(range(10)) + [20, 30, 21, 31]
+
+def test_mmap_slices_lazy_loads_read_only_memmaps_and_copies_on_append(fixture_empty_df):
+
+    df = fixture_empty_df
+    df.mmap_slices = True
+    for i in range(10):
+        df.append_value('heart_rate', i, i)
+    df.store()
+
+    sl = df.c.heart_rate._slices_y[0]
+    sl._values = None
+    assert isinstance(sl.values.array, np.memmap)
+    assert np.array_equal(df.c.heart_rate.y, np.arange(10))
+    assert not df.c.heart_rate.y.flags.writeable
+
+    # appending must not write to the memory mapped file
+    df.append_value('heart_rate', 10, 10)
+    assert not isinstance(sl.values.array, np.memmap)
+    df.store()
+
+    sl._values = None
+    assert sl.values == list(range(11))
+
+def test_slice_cache_frees_finished_slices_and_lazy_loads_them_again(fixture_reduce_slice_size_24, fixture_empty_df):
+
+    from data_container import slice_cache
+
+    df = fixture_empty_df
+    slice_cache.max_size = 100
+    try:
+        for i in range(100):
+            df.append_value('heart_rate', i, i)
+            if i % 10 == 0:
+                df.store()
+        df.store()
+
+        # full slices were freed by the cache, the last (unfinished) slice is pinned
+        assert any(sl._values is None for sl in df.c.heart_rate._slices_y)
+        assert df.c.heart_rate._slices_y[-1]._values is not None
+        assert slice_cache.evictions > 0
+        assert np.array_equal(df.c.heart_rate.y, np.arange(100))
+    finally:
+        slice_cache.max_size = None
+
+@pytest.mark.parametrize('num_workers', (1, 4))
+def test_compress_slices_in_parallel(fixture_reduce_slice_size_24, fixture_empty_df, num_workers):
+
+    df = fixture_empty_df
+    for i in range(100):
+        df.append_value('heart_rate', i, i)
+    df.store()
+    df.status_closed = True
+
+    df.compress(num_workers=num_workers)
+
+    for sl in df.all_slices():
+        assert sl.status_compressed is True
+        assert str(sl._path).endswith('.bin.zst')
+        assert sl.compressed_size_meta == os.path.getsize(sl._path)
+        sl.free_values()
+    assert np.array_equal(df.c.heart_rate.y, np.arange(100))
+
+def test_compress_slices_with_trained_zstd_dictionary(fixture_reduce_slice_size_24, fixture_empty_df, tmp_path):
+
+    zstandard = pytest.importorskip('zstandard')
+    from data_container import zstd_dicts
+
+    df = fixture_empty_df
+    values = [60 + i % 7 for i in range(2000)]
+    for i, value in enumerate(values):
+        df.append_value('heart_rate', value, i)
+    df.store()
+
+    zstd_dicts.path = tmp_path
+    try:
+        dict_id = zstd_dicts.train('heart_rate', data_files=[df], dict_size=1024, sample_size=16)
+        assert dict_id
+        assert zstd_dicts.active_id('heart_rate') == dict_id
+        assert zstd_dicts.active_id('spo2') == 0
+
+        df.status_closed = True
+        df.compress()
+
+        for sl in df.c.heart_rate.all_slices:
+            assert sl.compression_dict_id == dict_id
+            # the dict_id is stored in the frame header as well
+            with open(sl._path, 'rb') as fp:
+                assert zstandard.get_frame_parameters(fp.read()).dict_id == dict_id
+            sl.free_values()
+        assert df.c.heart_rate.y.tolist() == values
+
+        # a new dictionary version does not affect slices compressed with the old one
+        dict_id_2 = zstd_dicts.train('heart_rate', data_files=[df], dict_size=2048, sample_size=16)
+        assert zstd_dicts.index['heart_rate'] == [dict_id, dict_id_2]
+        df.c.heart_rate._slices_y[0].free_values()
+        assert df.c.heart_rate.y.tolist() == values
+    finally:
+        zstd_dicts.path = None
+
+def test_group_commit_fsyncs_once_per_store_and_replays_the_journal_on_load(fixture_empty_df, monkeypatch):
+
+    df = fixture_empty_df
+    df.group_commit = True
+    for i in range(10):
+        df.append_value('heart_rate', 60 + i, i)
+        df.append_value('spo2', 90 + i % 5, i)
+        df.append_value('temperature', 36 + i % 3, i)
+    df.store()
+
+    fsyncs = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: fsyncs.append(fd) or fsync(fd))
+    for i in range(10, 20):
+        df.append_value('heart_rate', 60 + i, i)
+        df.append_value('spo2', 90 + i % 5, i)
+        df.append_value('temperature', 36 + i % 3, i)
+    df.store()
+    # 6 slices (y and time_rec of 3 columns) written, only the journal is fsynced
+    assert len(fsyncs) == 1
+    assert df.journal.path.stat().st_size > 0
+
+    # a reader of the live df (e.g. a dashboard) doesn't touch the journal of the writer
+    df_reader = DataFile.objects(_hash_id=df.hash_id).first()
+    assert df.journal.path.stat().st_size > 0
+    assert df_reader.c.heart_rate.y.tolist() == [60 + i for i in range(20)]
+
+    # unplugged before the slice files were written to the hard drive (the lock of the writer is gone)
+    sl = df.c.heart_rate._slices_y[0]
+    with open(sl._path, 'r+b') as fp:
+        fp.truncate(5)
+    df.journal._lock_fp.close()
+
+    df = DataFile.objects(_hash_id=df.hash_id).first()
+    assert df.c.heart_rate.y.tolist() == [60 + i for i in range(20)]
+    assert df.c.spo2.y.tolist() == [90 + i % 5 for i in range(20)]
+    assert (df.path / 'slices.journal').stat().st_size == 0
+
+
+def test_journal_replay_stops_at_a_write_behind_the_end_of_a_truncated_file(fixture_empty_df):
+
+    df = fixture_empty_df
+    df.group_commit = True
+    for i in range(10):
+        df.append_value('heart_rate', 60 + i, i)
+    df.store()
+    df.journal.checkpoint()
+
+    # the journal only has the writes behind the first 10 values
+    for i in range(10, 20):
+        df.append_value('heart_rate', 60 + i, i)
+    df.store()
+    assert df.journal.path.stat().st_size > 0
+
+    # the first values got lost => the journal can't be replayed without a gap
+    sl = df.c.heart_rate._slices_y[0]
+    with open(sl._path, 'r+b') as fp:
+        fp.truncate(5)
+    df.journal._lock_fp.close()
+
+    df = DataFile.objects(_hash_id=df.hash_id).first()
+    assert os.path.getsize(df.c.heart_rate._slices_y[0]._path) == 5
+    assert 0 not in df.c.heart_rate._slices_y[0].read_values()
+    assert (df.path / 'slices.journal').stat().st_size == 0
+
+@pytest.mark.parametrize('data_type, compression', [
+    ('heart_rate', None),
+    ('heart_rate', 'zstd'),
+    ('ppg_ir', 'gzip'),
+    ('ppg_ir', 'zstd'),
+])
+def test_read_values_decodes_slices_in_blocks_and_stops_early(fixture_empty_df, data_type, compression):
+
+    df = fixture_empty_df
+    values = [randint(0, 200) for _ in range(300000)]
+    df.append_value(data_type, values[0], 0)
+    sl = df.cols[data_type]._slices_y[0]
+    # more values than one block of the streaming decoder
+    sl.extend(values[1:])
+    df.store()
+
+    if compression:
+        sl.status_slice_full = True
+        sl.compress(algorithm=compression)
+    sl.free_values()
+
+    first = sl.read_values(10)
+    assert first.tolist() == values[:10]
+    # values are not loaded by read_values()
+    assert sl._values is None
+    assert sl.read_values().tolist() == values[:sl.values_write_pointer]
+    assert sl.values == values[:sl.values_write_pointer]
+
+@pytest.mark.parametrize('data_type', ['ppg_ir', 'ppg_green', 'acc_x', 'ecg', 'eeg_1'])
+def test_precoding_is_lossless_and_improves_compression(fixture_empty_df, monkeypatch, data_type):
+
+    df = fixture_empty_df
+    signal = np.sin(np.arange(5000) / 40)
+    if data_type == 'acc_x':
+        values = np.round(signal, 2).tolist()
+    else:
+        values = np.round(signal * 30000 + 100000).astype(int).tolist()
+    # eeg data comes as MSB first binaries
+    eeg = data_type.startswith('eeg')
+    if eeg:
+        df.append_binary(data_type, DcHelper.array_to_int24_msb_first(values), list(range(len(values))))
+        sl = df.cols[data_type]._slices_y[0]
+    else:
+        df.append_value(data_type, values[0], 0)
+        sl = df.cols[data_type]._slices_y[0]
+        sl.extend(values[1:])
+    df.store()
+    expected = sl.values.tolist()
+
+    sl.status_slice_full = True
+    compressed_size = len(DcHelper.compress_bytes(sl.get_bin_data(), 'zstd'))
+
+    monkeypatch.setattr(config, '_precoding', True)
+    sl.compress()
+    assert sl.precoding == config.data_types_dict[data_type]['precoding']
+    assert sl.compressed_size < compressed_size
+    sl.free_values()
+    assert sl.values.tolist() == expected
+
+    # appending to a precoded slice rewrites the file
+    if eeg:
+        sl.append_binary(DcHelper.array_to_int24_msb_first(values[:10]))
+        sl.write_appended_binaries()
+    else:
+        sl.extend(values[:10])
+        sl.write_bin()
+    sl.free_values()
+    assert sl.values.tolist() == expected + expected[:10]
+    assert DcHelper.compressed_frames(open(sl._path, 'rb').read(), 'zstd') == 1
+
+def test_timebase_encoding_of_time_rec_slices(fixture_empty_df, monkeypatch):
+
+    df = fixture_empty_df
+    # 200 Hz with a gap of 3.3 s
+    time_rec = np.arange(20000) / 200
+    time_rec[12000:] += 3.3
+    # irregular
+    time_rec_hr = np.sort(np.random.default_rng(0).random(300) * 100).astype('float32')
+
+    for data_type, times in (('ppg_ir', time_rec), ('heart_rate', time_rec_hr)):
+        df.append_value(data_type, 60, float(times[0]))
+        df.cols[data_type]._slices_y[0].extend([60] * (len(times) - 1))
+        df.cols[data_type]._slices_time_rec[0].extend(times[1:].tolist())
+    df.store()
+
+    monkeypatch.setattr(config, '_timebase', True)
+    for col in df.cols.values():
+        sl = col._slices_time_rec[0]
+        sl.status_slice_full = True
+        sl.compress()
+        sl.free_values()
+
+    sl = df.cols['ppg_ir']._slices_time_rec[0]
+    assert sl.precoding == 'timebase'
+    assert sl.compressed_size < len(DcHelper.compress_bytes(time_rec.tobytes(), 'zstd')) / 4
+    # the timebase is bigger than irregular values
+    assert df.cols['heart_rate']._slices_time_rec[0].precoding is None
+
+    # lookups without loading the values
+    assert sl.timebase.first_index(time_rec[15000]) == 15000
+    assert df.cols['ppg_ir'].timebase.last_index(61) == np.searchsorted(time_rec, 61, side='right')
+    assert sl._values is None
+
+    assert df.cols['ppg_ir'].x.tolist() == time_rec.tolist()
+    assert df.cols['heart_rate'].x.tolist() == time_rec_hr.tolist()
+
+    df.add_labelled_chunk(label='timebase', time_start=55, time_end=65)
+    assert len(df.chunks_labelled[-1].cols['ppg_ir'].x) == np.count_nonzero((time_rec >= 55) & (time_rec <= 65))
+
+
+def test_aggregates_never_lazy_load_and_verify_recounts(fixture_reduce_slice_size_24, fixture_empty_df, monkeypatch):
+
+    df = fixture_empty_df
+    df.append_values('heart_rate', np.arange(100) % 200, np.arange(100))
+    df.append_values('ppg_red', np.arange(100), np.arange(100))
+    df.store()
+    hash_id = df.hash_id
+
+    df = DataFile.objects(_hash_id=hash_id).first()
+
+    def lazy_load(sl):
+        raise AssertionError(f'lazy_load of {sl.hash_long}')
+    monkeypatch.setattr(DataSlice, 'lazy_load', lazy_load)
+
+    str(df)
+    assert df.samples == 200
+    assert df.bin_size == 100 * (1 + 4) + 100 * (3 + 8)
+    assert df.slices == len(df.c.heart_rate.all_slices) + len(df.c.ppg_red.all_slices)
+    assert df.compressed_size == df.bin_size
+    assert df.compression_ratio == 1
+    assert df.c.ppg_red.samples == 100 and df.c.ppg_red.bin_size == 1100
+
+    # the cached file size is updated when the slice file changes
+    df.compress()
+    assert df.compressed_size == sum(os.path.getsize(sl._path) for col in df.cols.values() for sl in col.all_slices)
+    monkeypatch.undo()
+
+    assert df.verify() == []
+
+    # data loss
+    sl = df.c.ppg_red._slices_y[-1]
+    sl.free_values()
+    with open(sl._path, 'wb') as fp:
+        fp.write(b'')
+    assert df.samples == 200
+    inconsistent_slices = df.verify()
+    assert [(s['hash_long'], s['samples_real']) for s in inconsistent_slices] == [(sl.hash_long, 0)]
@@ -1,5 +1,6 @@
 import pytest
-from data_container.dc_helper import DcHelper
+import numpy as np
+from data_container.dc_helper import DcHelper, ValuesBuffer
 from random import randint
 
 @pytest.mark.skip
@@ -38,3 +39,125 @@ def test_convert_positive_and_negative_numbers_to_int24_and_back():
     # negative values must turn 0
     assert [-2**23, -2*23, -1, 0, 1, 2**23-1, 2**23-1, 2**23-1] == back_converted_list
 
+
+def test_array_codec_matches_list_codec():
+
+    int_value_list = [randint(-2**23, 2**23-1) for _ in range(1000)] + [-2**23, -1, 0, 1, 2**23-1]
+
+    for encode, decode, byteorder in [
+        (DcHelper.array_to_int24_lsb_first, DcHelper.int24_lsb_first_to_array, 'little'),
+        (DcHelper.array_to_int24_msb_first, DcHelper.int24_msb_first_to_array, 'big'),
+    ]:
+        bin_data = encode(int_value_list)
+        assert bin_data == b''.join(v.to_bytes(length=3, byteorder=byteorder, signed=True) for v in int_value_list)
+        assert decode(bin_data).tolist() == int_value_list
+
+    uint_value_list = [randint(0, 2**24-1) for _ in range(1000)] + [0, 2**24-1]
+    bin_data = DcHelper.array_to_uint24_lsb_first(uint_value_list)
+    assert bin_data == b''.join(v.to_bytes(length=3, byteorder='little') for v in uint_value_list)
+    assert DcHelper.uint24_lsb_first_to_array(bin_data).tolist() == uint_value_list
+
+def test_array_codec_rounds_floats_and_handles_empty_data():
+
+    assert DcHelper.int24_lsb_first_to_array(DcHelper.array_to_int24_lsb_first([1.4, -1.6, 2.5])).tolist() == [1, -2, 2]
+    assert DcHelper.array_to_uint24_lsb_first([]) == b''
+    assert len(DcHelper.uint24_lsb_first_to_array(b'')) == 0
+
+def test_values_buffer_behaves_like_a_list():
+
+    buffer = ValuesBuffer('uint24')
+    assert buffer.dtype == 'uint32'
+    assert not buffer
+
+    for i in range(100):
+        buffer.append(i)
+    buffer.extend([100, 101, 102])
+
+    assert len(buffer) == 103
+    assert buffer.capacity >= 103
+    assert buffer == list(range(103))
+    assert buffer[-1] == 102 and type(buffer[-1]) is int
+
+    # slices must concatenate to lists (and not be added element wise like numpy arrays)
+    values_list = [1000]
+    values_list += buffer[:3]
+    assert values_list == [1000, 0, 1, 2]
+
+    # appending to a slice must not change the original buffer
+    buffer_slice = buffer[:3]
+    buffer_slice.append(5)
+    assert buffer[3] == 3
+
+def test_values_buffer_from_read_only_array():
+
+    # e.g. a lazy loaded slice (np.frombuffer is read-only)
+    buffer = ValuesBuffer.from_array(np.frombuffer(bytes([1, 2, 3]), dtype='uint8'))
+    buffer.append(4)
+    buffer[0] = 10
+
+    assert buffer.tolist() == [10, 2, 3, 4]
+
+@pytest.mark.parametrize('algorithm, streaming', [
+    (None, True),
+    ('gzip', True),
+    ('zstd', True),
+    ('zstd', False),
+])
+def test_decompress_chunks_of_multiple_frames(monkeypatch, algorithm, streaming):
+
+    import io
+    from data_container import dc_helper
+    if not streaming:
+        monkeypatch.setattr(dc_helper, 'zstandard', None)
+    elif algorithm == 'zstd' and dc_helper.zstandard is None:
+        pytest.skip('zstandard is not installed')
+
+    frames = [bytes(range(256)) * 40, b'abc' * 1000]
+    if algorithm:
+        bin_data = b''.join(DcHelper.compress_bytes(frame, algorithm) for frame in frames)
+    else:
+        bin_data = b''.join(frames)
+
+    chunks = list(DcHelper.decompress_chunks(io.BytesIO(bin_data), algorithm, chunk_size=1000))
+    assert b''.join(chunks) == b''.join(frames)
+    if streaming:
+        assert max(len(chunk) for chunk in chunks) <= 1000
+
+@pytest.mark.parametrize('dtype, precoding, byteorder', [
+    ('uint8', 'delta', 'little'),
+    ('int16', 'delta+shuffle', 'little'),
+    ('uint24', 'delta+shuffle', 'little'),
+    ('int24', 'delta+shuffle', 'big'),
+    ('int32', 'delta+shuffle', 'little'),
+    ('float16', 'xor+shuffle', 'little'),
+    ('float64', 'xor', 'little'),
+    ('uint16', 'shuffle', 'little'),
+])
+def test_precode_and_unprecode_are_lossless(dtype, precoding, byteorder):
+
+    size = DcHelper.helper_dtype_size(dtype)
+    # random bytes including overflows of the differences
+    bin_data = np.random.default_rng(1).integers(0, 256, size * 1000, dtype=np.uint8).tobytes()
+
+    precoded = DcHelper.precode(bin_data, size, precoding, byteorder)
+    assert len(precoded) == len(bin_data)
+    assert DcHelper.unprecode(precoded, size, precoding, byteorder) == bin_data
+    assert DcHelper.precode(b'', size, precoding) == b''
+
+def test_delta_precoding_maps_small_differences_to_small_values():
+
+    bin_data = np.asarray([100, 101, 99, 99], dtype='<i2').tobytes()
+    assert np.frombuffer(DcHelper.precode(bin_data, 2, 'delta'), dtype='<u2').tolist() == [200, 2, 3, 0]
+    with pytest.raises(ValueError):
+        DcHelper.precode(bin_data, 2, 'delta+xor')
+
+def test_concatenate_arrays_into_a_preallocated_array():
+
+    arrays = [np.arange(3, dtype='uint32'), [], np.arange(4, dtype='uint32')]
+    out = DcHelper.concatenate_arrays(iter(arrays), 7, 'uint64')
+    assert out.dtype == 'uint64' and out.tolist() == [0, 1, 2, 0, 1, 2, 3]
+
+    # less or more values than expected
+    assert DcHelper.concatenate_arrays(iter(arrays), 10, 'uint64').tolist() == out.tolist()
+    assert DcHelper.concatenate_arrays(iter(arrays), 5, 'uint64').tolist() == out.tolist()
+    assert DcHelper.concatenate_arrays([], 0, 'float64').dtype == 'float64'
@@ -0,0 +1,90 @@
+import threading
+import time
+from data_container.dc_pipeline import SlicePipeline
+
+
+class FakeSlice():
+
+    def __init__(self, i):
+        self.hash = f'sl{i}'
+        self.hash_long = f'df/sl{i}'
+        self.stages = []
+
+
+def test_slices_move_through_the_stages_independently():
+
+    slices = [FakeSlice(i) for i in range(6)]
+    running = {'a': 0, 'b': 0}
+    max_running = {'a': 0, 'b': 0}
+    lock = threading.Lock()
+    # the first slice is done with stage b before the last slice got through stage a
+    first_done = threading.Event()
+    caller = threading.get_ident()
+
+    def prepare(name, seconds):
+        def function(sl):
+            def work():
+                with lock:
+                    running[name] += 1
+                    max_running[name] = max(max_running[name], running[name])
+                time.sleep(seconds)
+                if name == 'a' and sl is slices[-1]:
+                    assert first_done.wait(5)
+                with lock:
+                    running[name] -= 1
+                return name
+            return work
+        return function
+
+    def apply(sl, result):
+        # the slices are only changed by the thread of run()
+        assert threading.get_ident() == caller
+        sl.stages.append(result)
+        if result == 'b' and sl is slices[0]:
+            first_done.set()
+        return result
+
+    started, done = [], []
+    results = SlicePipeline([('a', prepare('a', 0.01), apply, 2), ('b', prepare('b', 0.01), apply, 1)]).run(slices, started.append, done.append)
+
+    assert results == {sl.hash: {'a': 'a', 'b': 'b'} for sl in slices}
+    assert all(sl.stages == ['a', 'b'] for sl in slices)
+    assert max_running == {'a': 2, 'b': 1}
+    assert started == slices and sorted(done, key=slices.index) == slices
+
+
+def test_a_stage_without_work_runs_on_the_caller():
+
+    slices = [FakeSlice(i) for i in range(3)]
+    caller = threading.get_ident()
+
+    def apply(sl, result):
+        assert result is None and threading.get_ident() == caller
+        return sl.hash
+
+    results = SlicePipeline([('a', None, apply, 2), ('b', lambda sl: lambda: 'b', None, 2)]).run(slices)
+
+    assert results == {sl.hash: {'a': sl.hash, 'b': 'b'} for sl in slices}
+
+
+def test_an_exception_stops_the_slice():
+
+    slices = [FakeSlice(i) for i in range(3)]
+
+    def fail(sl):
+        if sl is slices[1]:
+            raise ValueError('broken slice')
+        return True
+
+    def fail_apply(sl, result):
+        if sl is slices[2]:
+            raise ValueError('broken apply')
+        return 'b'
+
+    done = []
+    results = SlicePipeline([('a', lambda sl: lambda: fail(sl), None, 2), ('b', None, fail_apply, 2)]).run(slices, done=done.append)
+
+    assert isinstance(results['sl1']['a'], ValueError) and 'b' not in results['sl1']
+    assert results['sl2']['a'] is True and isinstance(results['sl2']['b'], ValueError)
+    assert results['sl0'] == {'a': True, 'b': 'b'}
+    assert sorted(done, key=slices.index) == slices
@@ -0,0 +1,62 @@
+import pytest
+import numpy as np
+from data_container.dc_sketch import QuantileSketch
+
+
+def sorted_quantile(values, q):
+    # the column statistics before there were sketches
+    return float(np.sort(values)[int(len(values) * q)])
+
+
+@pytest.mark.parametrize('samples', [1, 2, 5, 100, QuantileSketch.MAX_POINTS])
+def test_small_sketches_are_exact(samples):
+
+    values = np.random.default_rng(samples).integers(40, 180, samples)
+    sketch = QuantileSketch.from_values(values)
+
+    assert sketch.exact and sketch.count == samples
+    assert sketch.to_lists()[1] == []
+    for q in [0, 1 / 4, 1 / 2, 3 / 4]:
+        assert sketch.quantile(q) == sorted_quantile(values, q)
+
+
+def test_merged_sketches_of_small_slices_are_exact():
+
+    values = np.random.default_rng(0).uniform(30, 40, 600)
+    sketch = QuantileSketch.merge([QuantileSketch.from_lists(*QuantileSketch.from_values(values[i:i + 100]).to_lists()) for i in range(0, 600, 100)] + [QuantileSketch()])
+
+    assert sketch.exact and sketch.count == 600
+    for q in [1 / 4, 1 / 2, 3 / 4]:
+        assert sketch.quantile(q) == sorted_quantile(values, q)
+
+
+def test_big_merged_sketches_have_a_small_rank_error():
+
+    values = np.random.default_rng(1).normal(70, 10, 200000)
+    sketch = QuantileSketch.merge([QuantileSketch.from_values(values[i:i + 5000]) for i in range(0, len(values), 5000)])
+
+    assert len(sketch) == QuantileSketch.MAX_POINTS
+    assert not sketch.exact and sketch.count == len(values)
+    for q in [1 / 4, 1 / 2, 3 / 4]:
+        rank = np.count_nonzero(values < sketch.quantile(q)) / len(values)
+        assert abs(rank - q) < 2 / QuantileSketch.MAX_POINTS
+
+
+def test_empty_sketch():
+
+    assert QuantileSketch.from_values([]).quantile(0.5) is None
+    assert QuantileSketch.merge([]).count == 0
+
+
+
+def test_compressed_sketches_are_stored_with_one_weight():
+
+    values = np.random.default_rng(2).normal(70, 10, 200000)
+    stored = [QuantileSketch.from_values(values[i:i + 5000]).to_lists() for i in range(0, len(values), 5000)]
+    assert all(len(sketch_values) == QuantileSketch.MAX_POINTS and len(sketch_weights) == 1 for sketch_values, sketch_weights in stored)
+
+    sketch = QuantileSketch.merge([QuantileSketch.from_lists(*lists) for lists in stored])
+    assert sketch.count == len(values)
+    for q in [1 / 4, 1 / 2, 3 / 4]:
+        rank = np.count_nonzero(values < sketch.quantile(q)) / len(values)
+        assert abs(rank - q) <= 2 / QuantileSketch.MAX_POINTS
@@ -0,0 +1,101 @@
+import pytest
+from data_container.data_slice import DataSlice
+from data_container.dc_slice_cache import SliceCache
+from data_container.dc_helper import ValuesBuffer
+from data_container.tests.testing_helper_functions import EmptyClass
+
+
+def new_slice(sl_hash, samples, written=True, full=True):
+    # slice with loaded uint8 values (1 byte per sample)
+
+    sl = DataSlice()
+    sl.df = EmptyClass()
+    sl.df.hash_id = 'DF'
+    sl.df.status_closed = False
+    sl._hash = sl_hash
+    sl.dtype = 'uint8'
+    sl.status_slice_full = full
+    sl._values = ValuesBuffer('uint8')
+    sl._values.extend(range(samples))
+    sl.values_write_pointer = samples if written else 0
+
+    return sl
+
+
+def test_slice_cache_evicts_least_recently_used_slices():
+
+    cache = SliceCache(max_size=25)
+    slices = [new_slice(sl_hash, 10) for sl_hash in ['A', 'B', 'C']]
+
+    cache.add(slices[0])
+    cache.add(slices[1])
+    # A is used again => B is the least recently used one
+    cache.touch(slices[0])
+    cache.add(slices[2])
+
+    assert slices[1]._values is None
+    assert slices[0]._values is not None and slices[2]._values is not None
+    assert cache.size == 20
+    assert cache.stats() == {'slices': 2, 'size': 20, 'max_size': 25, 'hits': 1, 'misses': 3, 'evictions': 1}
+
+
+@pytest.mark.parametrize('written, full, pinned', [
+    (False, True, False),  # values not yet written to the hard drive
+    (True, False, False),  # slice is still being filled
+    (True, True, True),    # pinned explicitly
+])
+def test_slice_cache_does_not_evict_pinned_slices(written, full, pinned):
+
+    cache = SliceCache(max_size=15)
+    sl_pinned = new_slice('A', 10, written=written, full=full)
+    cache.add(sl_pinned)
+    if pinned:
+        cache.pin(sl_pinned)
+    sl = new_slice('B', 10)
+    cache.add(sl)
+
+    cache.clear()
+
+    assert sl_pinned._values is not None
+    assert sl._values is None
+
+
+def test_slice_cache_without_max_size_does_not_evict():
+
+    cache = SliceCache()
+    slices = [new_slice(str(i), 1000) for i in range(10)]
+    for sl in slices:
+        cache.add(sl)
+
+    assert cache.size == 10000
+    assert cache.evictions == 0
+
+
+def test_slice_cache_counts_the_slices_of_two_instances_of_a_df():
+
+    cache = SliceCache(max_size=100)
+    # the same slice of two loaded instances of one DataFile
+    sl_a, sl_b = new_slice('A', 10), new_slice('A', 10)
+    cache.add(sl_a)
+    cache.add(sl_b)
+    assert cache.size == 20 and len(cache) == 2
+
+    cache.remove(sl_a)
+    assert cache.size == 10 and len(cache) == 1
+    cache.touch(sl_b)
+    assert cache.hits == 1
+
+
+def test_slice_cache_touch_evicts_only_if_the_values_grew(monkeypatch):
+
+    cache = SliceCache(max_size=5)
+    sl = new_slice('A', 10, full=False)
+    cache.add(sl)
+
+    evictions = []
+    monkeypatch.setattr(cache, '_evict', lambda *args, **kwargs: evictions.append(1))
+    cache.touch(sl)
+    assert not evictions
+    sl._values.extend(range(5))
+    cache.touch(sl)
+    assert len(evictions) == 1 and cache.size == 15
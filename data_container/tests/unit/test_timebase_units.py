@@ -0,0 +1,81 @@
+import pytest
+import numpy as np
+from data_container.dc_timebase import Timebase
+
+
+def time_rec_with_gap_and_jitter():
+
+    time_rec = 1.7e9 + np.arange(20000) / 200
+    # gap of 3.3 s
+    time_rec[12000:] += 3.3
+    # jitter
+    time_rec[5000:5010] += np.random.default_rng(0).normal(0, 1e-4, 10)
+
+    return time_rec
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_timebase_of_regular_time_rec_is_one_segment(dtype):
+
+    time_rec = (np.arange(5000) / 100).astype(dtype)
+    timebase = Timebase.from_array(time_rec, dtype)
+
+    assert len(timebase.segments) == 1 and len(timebase.exception_indices) == 0
+    assert timebase.segments[0]['rate'] == 100
+    assert len(timebase.to_bytes()) < 50
+    assert Timebase.from_bytes(timebase.to_bytes(), dtype).materialize().tobytes() == time_rec.tobytes()
+
+
+@pytest.mark.parametrize('time_rec', [
+    time_rec_with_gap_and_jitter(),
+    np.asarray([0., 1, 2, 1.5, 3, 4, -0.0, np.nan]),
+    np.sort(np.random.default_rng(1).random(500)),
+    np.asarray([5.]),
+    np.asarray([]),
+])
+def test_timebase_is_lossless(time_rec):
+
+    timebase = Timebase.from_bytes(Timebase.from_array(time_rec).to_bytes())
+
+    assert len(timebase) == len(time_rec)
+    assert timebase.materialize().tobytes() == time_rec.tobytes()
+    for i in range(0, len(time_rec), 97):
+        assert timebase.value(i) == pytest.approx(time_rec[i], nan_ok=True)
+
+
+def test_timebase_lookups_match_a_linear_search():
+
+    time_rec = time_rec_with_gap_and_jitter()
+    timebase = Timebase.from_array(time_rec)
+
+    assert len(timebase.segments) == 2
+    assert timebase.monotonic
+
+    for value in [0, time_rec[0], time_rec[5003], time_rec[5003] + 1e-9, time_rec[11999] + 1, time_rec[12000], time_rec[-1], 2e9]:
+        assert timebase.first_index(value) == np.searchsorted(time_rec, value, side='left')
+        assert timebase.last_index(value) == np.searchsorted(time_rec, value, side='right')
+
+
+def test_timebase_lookups_of_time_rec_which_is_not_increasing():
+
+    time_rec = np.asarray([0., 1, 2, 1.5, 3, 4])
+    timebase = Timebase.from_array(time_rec)
+
+    assert not timebase.monotonic
+    assert timebase.first_index(1.7) == 2
+    assert timebase.last_index(1.7) == 4
+    assert timebase.first_index(5) == 6
+    assert timebase.last_index(-1) == 0
+
+
+def test_concatenated_timebases():
+
+    time_rec = time_rec_with_gap_and_jitter()
+    timebase = Timebase.concatenate([Timebase.from_array(time_rec[:7000]), Timebase.from_array(time_rec[7000:])])
+
+    assert timebase.materialize().tobytes() == time_rec.tobytes()
+    assert timebase.monotonic
+    assert timebase.first_index(time_rec[9000]) == 9000
+
+    # the second part starts before the first ends
+    assert not Timebase.concatenate([Timebase.from_array(time_rec[7000:]), Timebase.from_array(time_rec[:7000])]).monotonic
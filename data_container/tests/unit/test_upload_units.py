@@ -0,0 +1,68 @@
+import threading
+from data_container.dc_upload import UploadScheduler
+
+
+class FakeDf():
+
+    hash_id = 'df'
+    status_closed = True
+
+
+class FakeSlice():
+
+    def __init__(self, data_type, slice_time_offset, sent_order, fail=False):
+        self.data_type = data_type
+        self.slice_type = 'y'
+        self.slice_time_offset = slice_time_offset
+        self.hash_long = f'df/{data_type}.{slice_time_offset}'
+        self.status_sent_server = False
+        self.status_compressed = True
+        self.values_send_pointer = 0
+        self.compressed_size = 100
+        self.sessions = []
+        self._sent_order = sent_order
+        self._fail = fail
+
+    def send(self, session, partially):
+        if self._fail:
+            raise ConnectionError('server gone')
+        self.sessions.append((threading.get_ident(), session))
+        self._sent_order.append(self.hash_long)
+        self.status_sent_server = True
+        return True
+
+
+def test_vitals_are_uploaded_first_and_the_results_are_reported():
+
+    sent_order = []
+    slices = [FakeSlice('ppg_red', 0, sent_order), FakeSlice('ppg_red', 10, sent_order), FakeSlice('heart_rate', 10, sent_order),
+              FakeSlice('heart_rate', 0, sent_order), FakeSlice('ppg_red', 20, sent_order, fail=True)]
+    slices[1].status_sent_server = True
+
+    scheduler = UploadScheduler(FakeDf(), num_workers=1)
+    results = scheduler.run(slices)
+
+    assert sent_order == ['df/heart_rate.0', 'df/heart_rate.10', 'df/ppg_red.0']
+    # one worker => one keep-alive session for all slices
+    assert len({id(session) for sl in slices for thread, session in sl.sessions}) == 1
+
+    assert [result['success'] for result in results] == [True, True, True, False]
+    assert results[-1]['error'] == 'server gone'
+    report = scheduler.report()
+    assert (report['slices'], report['successful'], report['failed'], report['bytes']) == (4, 3, 1, 300)
+
+
+def test_every_worker_uses_its_own_session():
+
+    sent_order = []
+    slices = [FakeSlice('ppg_red', i, sent_order) for i in range(20)]
+
+    UploadScheduler(FakeDf(), num_workers=4).run(slices)
+
+    sessions = {}
+    for sl in slices:
+        for thread, session in sl.sessions:
+            sessions.setdefault(thread, set()).add(id(session))
+    assert len(sent_order) == 20
+    assert all(len(ids) == 1 for ids in sessions.values())
+    assert len({session_id for ids in sessions.values() for session_id in ids}) == len(sessions)